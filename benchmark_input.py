@@ -0,0 +1,217 @@
+"""Benchmarks the training input pipeline on converted TFRecord datasets.
+
+Reports, for each dataset directory, the on-disk size of the split and the
+number of preprocessed images per second the input pipeline of train.py
+delivers, without running any model. This is used to compare datasets
+converted with different options, e.g. original versus pre-resized images:
+
+python benchmark_input.py \
+    --dataset_dirs=./data/inat2017,./data/inat2017_342 --num_batches=100
+
+or the queue-runner and tf.data input backends on the same dataset:
+
+python benchmark_input.py \
+    --dataset_dirs=./data/inat2017 --input_backends=queue,tf_data
+
+The "tf_data_dct" backend benchmarks the evaluation preprocessing with the
+reduced-resolution JPEG decoding of `eval.py --dct_scaled_decode`:
+
+python benchmark_input.py --dataset_dirs=./data/inat2017 \
+    --dataset_split_name=validation --is_training=False \
+    --input_backends=tf_data,tf_data_dct
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import warnings
+warnings.filterwarnings('ignore')
+import functools
+import os
+import sys
+import time
+import tensorflow as tf
+
+sys.path.insert(0, './slim/')
+from datasets import dataset_utils
+from datasets import fgvc
+from preprocessing import preprocessing_factory
+
+slim = tf.contrib.slim
+
+tf.app.flags.DEFINE_string(
+    'dataset_dirs', None,
+    'Comma-separated list of converted dataset directories to benchmark.')
+
+tf.app.flags.DEFINE_string(
+    'input_backends', 'queue',
+    'Comma-separated list of the input backends to benchmark, among "queue", '
+    '"tf_data" and "tf_data_dct" (evaluation only).')
+
+tf.app.flags.DEFINE_string(
+    'dataset_split_name', 'train', 'The name of the train/validation split.')
+
+tf.app.flags.DEFINE_string(
+    'preprocessing_name', 'inception_v3', 'The name of the preprocessing to '
+    'use.')
+
+tf.app.flags.DEFINE_boolean(
+    'is_training', True,
+    'Whether to benchmark the training or the evaluation preprocessing.')
+
+tf.app.flags.DEFINE_integer(
+    'image_size', 299, 'The size of the preprocessed images.')
+
+tf.app.flags.DEFINE_integer(
+    'batch_size', 64, 'The number of samples in each batch.')
+
+tf.app.flags.DEFINE_integer(
+    'num_readers', 4,
+    'The number of parallel readers that read data from the dataset.')
+
+tf.app.flags.DEFINE_integer(
+    'num_preprocessing_threads', 4,
+    'The number of threads used to create the batches.')
+
+tf.app.flags.DEFINE_integer(
+    'num_warmup_batches', 10,
+    'The number of batches pulled before timing starts, to fill the queues.')
+
+tf.app.flags.DEFINE_integer(
+    'num_batches', 100, 'The number of timed batches.')
+
+FLAGS = tf.app.flags.FLAGS
+
+
+def _split_size(dataset_dir, split_name):
+  """Returns the (number of records, number of bytes) of a converted split.
+
+  The record count comes from the shard metadata files when present and from
+  a full pass over the shard otherwise.
+  """
+  num_records = 0
+  num_bytes = 0
+  for shard in tf.gfile.Glob(
+      os.path.join(dataset_dir, fgvc._FILE_PATTERN % split_name)):
+    num_bytes += tf.gfile.Stat(shard).length
+    metadata = dataset_utils.read_shard_metadata(shard)
+    if metadata is not None:
+      num_records += metadata['num_records']
+    else:
+      num_records += sum(1 for _ in tf.python_io.tf_record_iterator(shard))
+  return num_records, num_bytes
+
+
+def _queue_batch(dataset, image_preprocessing_fn):
+  """Returns a batch of images from the queue-runner input pipeline."""
+  provider = slim.dataset_data_provider.DatasetDataProvider(
+      dataset,
+      num_readers=FLAGS.num_readers,
+      common_queue_capacity=20 * FLAGS.batch_size,
+      common_queue_min=10 * FLAGS.batch_size)
+  [image, label] = provider.get(['image', 'label'])
+  image = image_preprocessing_fn(image, FLAGS.image_size, FLAGS.image_size)
+  images, _ = tf.train.batch(
+      [image, label],
+      batch_size=FLAGS.batch_size,
+      num_threads=FLAGS.num_preprocessing_threads,
+      capacity=5 * FLAGS.batch_size)
+  return images
+
+
+def _tf_data_batch(dataset, image_preprocessing_fn):
+  """Returns a batch of images from the tf.data input pipeline."""
+  batches = fgvc.get_batched_dataset(
+      dataset, image_preprocessing_fn, FLAGS.image_size, FLAGS.batch_size,
+      is_training=FLAGS.is_training,
+      num_readers=FLAGS.num_readers,
+      num_preprocessing_threads=FLAGS.num_preprocessing_threads)
+  images, _ = batches.make_one_shot_iterator().get_next()
+  return images
+
+
+def _tf_data_dct_batch(dataset, _):
+  """Returns a batch of images decoded at a reduced resolution."""
+  if FLAGS.is_training:
+    raise ValueError('The tf_data_dct backend requires --is_training=False')
+  image_preprocessing_fn = functools.partial(
+      preprocessing_factory.get_encoded_preprocessing(
+          FLAGS.preprocessing_name, is_training=False),
+      dct_scaled_decode=True)
+  batches = fgvc.get_batched_dataset(
+      dataset, image_preprocessing_fn, FLAGS.image_size, FLAGS.batch_size,
+      is_training=False,
+      num_readers=FLAGS.num_readers,
+      num_preprocessing_threads=FLAGS.num_preprocessing_threads,
+      preprocess_encoded=True)
+  images, _ = batches.make_one_shot_iterator().get_next()
+  return images
+
+
+_BATCH_FNS = {
+    'queue': _queue_batch,
+    'tf_data': _tf_data_batch,
+    'tf_data_dct': _tf_data_dct_batch,
+}
+
+
+def _benchmark(dataset_dir, num_records, input_backend):
+  """Measures the images/s of an input pipeline on one dataset directory."""
+  with tf.Graph().as_default():
+    dataset = fgvc.get_split(
+        FLAGS.dataset_split_name, dataset_dir,
+        num_samples={FLAGS.dataset_split_name: num_records},
+        num_classes=0)
+    image_preprocessing_fn = preprocessing_factory.get_preprocessing(
+        FLAGS.preprocessing_name, is_training=FLAGS.is_training)
+    images = _BATCH_FNS[input_backend](dataset, image_preprocessing_fn)
+
+    with tf.Session() as sess:
+      sess.run([tf.global_variables_initializer(),
+                tf.local_variables_initializer()])
+      coord = tf.train.Coordinator()
+      threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+      try:
+        for _ in range(FLAGS.num_warmup_batches):
+          sess.run(images.op)
+        start_time = time.time()
+        for _ in range(FLAGS.num_batches):
+          sess.run(images.op)
+        seconds = time.time() - start_time
+      finally:
+        coord.request_stop()
+        coord.join(threads, stop_grace_period_secs=10)
+  return FLAGS.num_batches * FLAGS.batch_size / seconds
+
+
+def main(_):
+  if not FLAGS.dataset_dirs:
+    raise ValueError('You must supply the dataset directories with '
+                     '--dataset_dirs')
+  input_backends = [b.strip() for b in FLAGS.input_backends.split(',')]
+  for input_backend in input_backends:
+    if input_backend not in _BATCH_FNS:
+      raise ValueError('Input backend [%s] was not recognized' % input_backend)
+
+  tf.logging.set_verbosity(tf.logging.ERROR)
+  rows = []
+  for dataset_dir in FLAGS.dataset_dirs.split(','):
+    dataset_dir = dataset_dir.strip()
+    num_records, num_bytes = _split_size(dataset_dir, FLAGS.dataset_split_name)
+    for input_backend in input_backends:
+      images_per_sec = _benchmark(dataset_dir, num_records, input_backend)
+      rows.append((dataset_dir, input_backend, num_records, num_bytes,
+                   images_per_sec))
+
+  print('%-40s %11s %10s %10s %12s %10s' % (
+      'dataset_dir', 'backend', 'records', 'size (MB)', 'KB/record',
+      'images/s'))
+  for dataset_dir, input_backend, num_records, num_bytes, images_per_sec in (
+      rows):
+    print('%-40s %11s %10d %10.1f %12.1f %10.1f' % (
+        dataset_dir, input_backend, num_records, num_bytes / float(1 << 20),
+        num_bytes / float(1 << 10) / max(num_records, 1), images_per_sec))
+
+
+if __name__ == '__main__':
+  tf.app.run()
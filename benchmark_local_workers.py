@@ -0,0 +1,87 @@
+"""Benchmarks the scaling of train.py with the number of local workers.
+
+Runs a short training for every number of local workers, each in a fresh
+train_dir, and reports the images/s measured by `--run_stats_every_n_steps`
+next to the speedup and the scaling efficiency over the first run:
+
+python benchmark_local_workers.py --local_workers=1,2,4,8 \
+    --train_dir=/tmp/scaling --train_args="--dataset_dir=./data/inat2017 \
+    --dataset_name=inat2017 --model_name=inception_v3 --batch_size=32 \
+    --checkpoint_path=./checkpoints/inception_v3.ckpt \
+    --checkpoint_exclude_scopes=InceptionV3/Logits,InceptionV3/AuxLogits"
+
+--batch_size in --train_args is per worker, so the global batch grows with the
+number of workers.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import warnings
+warnings.filterwarnings('ignore')
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tensorflow as tf
+
+tf.app.flags.DEFINE_string(
+    'local_workers', '1,2,4,8',
+    'Comma-separated list of the numbers of local workers to benchmark.')
+
+tf.app.flags.DEFINE_string(
+    'train_dir', None,
+    'Directory under which the train_dir of every run is created.')
+
+tf.app.flags.DEFINE_string(
+    'train_args', '', 'The other flags of train.py, e.g. the dataset and model.')
+
+tf.app.flags.DEFINE_integer(
+    'num_steps', 50, 'The number of training steps of every run.')
+
+FLAGS = tf.app.flags.FLAGS
+
+
+def _run(local_workers):
+  """Trains with `local_workers` workers and returns their run statistics."""
+  train_dir = os.path.join(FLAGS.train_dir, 'local_workers_%d' % local_workers)
+  if tf.gfile.Exists(train_dir):
+    tf.gfile.DeleteRecursively(train_dir)
+  command = [sys.executable, 'train.py'] + shlex.split(FLAGS.train_args) + [
+      '--train_dir=%s' % train_dir,
+      '--local_workers=%d' % local_workers,
+      '--max_number_of_steps=%d' % FLAGS.num_steps,
+      '--run_stats_every_n_steps=%d' % FLAGS.num_steps,
+  ]
+  subprocess.check_call(command)
+  with tf.gfile.Open(os.path.join(train_dir, 'run_stats_0.json')) as f:
+    stats = json.loads(f.read())
+  if stats['images_per_sec'] is None:
+    raise ValueError('--num_steps is too small to leave out the warmup steps')
+  return stats
+
+
+def main(_):
+  if not FLAGS.train_dir:
+    raise ValueError('You must supply the train_dir with --train_dir')
+
+  rows = []
+  for local_workers in FLAGS.local_workers.split(','):
+    stats = _run(int(local_workers))
+    rows.append((int(local_workers), stats['images_per_step'],
+                 stats['images_per_sec'], stats['peak_rss_mb']))
+
+  base_workers, _, base_images_per_sec, _ = rows[0]
+  print('%8s %12s %10s %8s %11s %15s' % (
+      'workers', 'global batch', 'images/s', 'speedup', 'efficiency',
+      'RSS/worker (MB)'))
+  for local_workers, images_per_step, images_per_sec, peak_rss_mb in rows:
+    speedup = images_per_sec / base_images_per_sec
+    print('%8d %12d %10.1f %7.2fx %10.0f%% %15.0f' % (
+        local_workers, images_per_step, images_per_sec, speedup,
+        100 * speedup * base_workers / local_workers, peak_rss_mb))
+
+
+if __name__ == '__main__':
+  tf.app.run()
@@ -0,0 +1,286 @@
+"""Benchmarks the CPU inference latency of nets_factory architectures.
+
+Every combination of --model_names, --image_sizes, --batch_sizes,
+--intra_op_threads and --inter_op_threads is run in a fresh process, so that
+the peak resident memory of each one is measured alone. A configuration builds
+the network for inference with random weights, or the matching ones of
+--checkpoint_path, and times --num_runs batches after --num_warmup_runs:
+
+python benchmark_models.py \
+    --model_names=inception_v3,inception_v3_se,mobilenet_v2 \
+    --image_sizes=224,299 --batch_sizes=1,8 --intra_op_threads=1,4 \
+    --output_json=./benchmarks/cpu.json
+
+The p50 and p95 latencies, images/s and peak RSS of every configuration are
+written to --output_json. Two runs, e.g. before and after a change, are
+compared with:
+
+python benchmark_models.py \
+    --compare=./benchmarks/base.json,./benchmarks/new.json
+
+which lists the configurations whose p50 latency or peak RSS grew by more
+than --regression_threshold, and exits with status 1 if there are any.
+--baseline_json compares a fresh run to a previous one the same way.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import warnings
+warnings.filterwarnings('ignore')
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import tensorflow as tf
+
+sys.path.insert(0, './slim/')
+import checkpoint_tools
+from nets import nets_factory
+import training_hooks
+
+tf.app.flags.DEFINE_string(
+    'model_names',
+    'inception_v3,inception_v3_se,inception_v4,resnet_v2_50,mobilenet_v2',
+    'Comma-separated list of the nets_factory networks to benchmark.')
+
+tf.app.flags.DEFINE_string(
+    'image_sizes', '224,299,448,560',
+    'Comma-separated list of the heights and widths of the images.')
+
+tf.app.flags.DEFINE_string(
+    'batch_sizes', '1', 'Comma-separated list of the batch sizes.')
+
+tf.app.flags.DEFINE_string(
+    'intra_op_threads', '0',
+    'Comma-separated list of the numbers of threads of an op, 0 for the '
+    'number of cores.')
+
+tf.app.flags.DEFINE_string(
+    'inter_op_threads', '0',
+    'Comma-separated list of the numbers of ops run in parallel, 0 for the '
+    'number of cores.')
+
+tf.app.flags.DEFINE_integer(
+    'num_classes', 1000, 'The number of classes of the logits.')
+
+tf.app.flags.DEFINE_string(
+    'checkpoint_path', None,
+    'An optional checkpoint whose variables of the same names and shapes are '
+    'restored, with a single --model_names.')
+
+tf.app.flags.DEFINE_integer(
+    'num_warmup_runs', 10, 'The number of batches run before the timing.')
+
+tf.app.flags.DEFINE_integer(
+    'num_runs', 50, 'The number of timed batches.')
+
+tf.app.flags.DEFINE_string(
+    'output_json', None, 'The file the results are written to.')
+
+tf.app.flags.DEFINE_string(
+    'baseline_json', None,
+    'The results of a previous run the fresh results are compared to.')
+
+tf.app.flags.DEFINE_string(
+    'compare', None,
+    'Two comma-separated result files to compare, baseline first, instead of '
+    'running the benchmark.')
+
+tf.app.flags.DEFINE_float(
+    'regression_threshold', 0.1,
+    'The relative increase of the p50 latency or peak RSS reported as a '
+    'regression.')
+
+tf.app.flags.DEFINE_string(
+    'run_config', None,
+    'Internal: the JSON configuration benchmarked by a child process.')
+
+tf.app.flags.DEFINE_string(
+    'run_result', None,
+    'Internal: the file a child process writes its result to.')
+
+FLAGS = tf.app.flags.FLAGS
+
+# The fields identifying a configuration.
+_CONFIG_KEYS = ('model_name', 'image_size', 'batch_size', 'intra_op_threads',
+                'inter_op_threads')
+
+
+def _parse_ints(value):
+  return [int(item) for item in value.split(',')]
+
+
+def _restore(sess, checkpoint_path):
+  """Restores the variables matching the ones of a checkpoint."""
+  reader = checkpoint_tools.get_checkpoint_reader(checkpoint_path)
+  shapes = reader.get_variable_to_shape_map()
+  variables = [variable for variable in tf.global_variables()
+               if shapes.get(variable.op.name) == variable.shape.as_list()]
+  tf.logging.info('Restoring %d of %d variables from %s', len(variables),
+                  len(tf.global_variables()), checkpoint_path)
+  for variable in variables:
+    variable.load(reader.get_tensor(variable.op.name), sess)
+
+
+def _benchmark(config):
+  """Returns the latencies and memory of a configuration, in this process."""
+  network_fn = nets_factory.get_network_fn(
+      config['model_name'], FLAGS.num_classes, is_training=False)
+  shape = [config['batch_size'], config['image_size'], config['image_size'], 3]
+  with tf.Graph().as_default():
+    images = tf.placeholder(tf.float32, shape)
+    logits, _ = network_fn(images)
+    session_config = tf.ConfigProto(
+        device_count={'GPU': 0},
+        intra_op_parallelism_threads=config['intra_op_threads'],
+        inter_op_parallelism_threads=config['inter_op_threads'])
+    with tf.Session(config=session_config) as sess:
+      sess.run(tf.global_variables_initializer())
+      if FLAGS.checkpoint_path:
+        _restore(sess, FLAGS.checkpoint_path)
+      feed_dict = {images: np.random.rand(*shape).astype(np.float32)}
+      for _ in range(FLAGS.num_warmup_runs):
+        sess.run(logits, feed_dict)
+      latencies = []
+      for _ in range(FLAGS.num_runs):
+        start_time = time.time()
+        sess.run(logits, feed_dict)
+        latencies.append(time.time() - start_time)
+  result = dict(config)
+  result.update({
+      'p50_ms': 1000 * np.percentile(latencies, 50),
+      'p95_ms': 1000 * np.percentile(latencies, 95),
+      'images_per_sec': config['batch_size'] * len(latencies) / sum(latencies),
+      'peak_rss_mb': training_hooks.peak_rss_mb(),
+  })
+  return result
+
+
+def _run(config):
+  """Benchmarks a configuration in a child process and returns its result."""
+  result_file, result_filename = tempfile.mkstemp(suffix='.json')
+  os.close(result_file)
+  command = [sys.executable, os.path.abspath(__file__),
+             '--run_config=%s' % json.dumps(config),
+             '--run_result=%s' % result_filename,
+             '--num_classes=%d' % FLAGS.num_classes,
+             '--num_warmup_runs=%d' % FLAGS.num_warmup_runs,
+             '--num_runs=%d' % FLAGS.num_runs]
+  if FLAGS.checkpoint_path:
+    command.append('--checkpoint_path=%s' % FLAGS.checkpoint_path)
+  try:
+    if subprocess.call(command) != 0:
+      tf.logging.warning('The benchmark of %s failed', config)
+      result = dict(config)
+      result['error'] = True
+      return result
+    with open(result_filename) as f:
+      return json.loads(f.read())
+  finally:
+    os.remove(result_filename)
+
+
+def _read_results(filename):
+  with tf.gfile.Open(filename, 'r') as f:
+    return json.loads(f.read())['results']
+
+
+def _config_key(result):
+  return tuple(result[key] for key in _CONFIG_KEYS)
+
+
+def _compare(baseline, results):
+  """Prints the changes between two lists of results.
+
+  Returns:
+    The number of configurations whose latency or memory regressed.
+  """
+  baseline_results = {_config_key(result): result for result in baseline
+                      if not result.get('error')}
+  num_regressions = 0
+  print('%-24s %6s %6s %10s %10s %8s %10s %8s' % (
+      'model', 'size', 'batch', 'threads', 'p50 (ms)', 'change', 'RSS (MB)',
+      'change'))
+  for result in results:
+    base = baseline_results.get(_config_key(result))
+    if base is None or result.get('error'):
+      continue
+    latency_change = result['p50_ms'] / base['p50_ms'] - 1
+    rss_change = result['peak_rss_mb'] / base['peak_rss_mb'] - 1
+    regressed = max(latency_change, rss_change) > FLAGS.regression_threshold
+    num_regressions += regressed
+    print('%-24s %6d %6d %10s %10.1f %+7.1f%% %10.0f %+7.1f%%%s' % (
+        result['model_name'], result['image_size'], result['batch_size'],
+        '%d/%d' % (result['intra_op_threads'], result['inter_op_threads']),
+        result['p50_ms'], 100 * latency_change, result['peak_rss_mb'],
+        100 * rss_change, '  REGRESSION' if regressed else ''))
+  print('%d regressions over %.0f%%' % (num_regressions,
+                                        100 * FLAGS.regression_threshold))
+  return num_regressions
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+  if FLAGS.run_config:
+    result = _benchmark(json.loads(FLAGS.run_config))
+    with open(FLAGS.run_result, 'w') as f:
+      f.write(json.dumps(result))
+    return 0
+  if FLAGS.compare:
+    filenames = FLAGS.compare.split(',')
+    if len(filenames) != 2:
+      raise ValueError('--compare takes two result files')
+    return 1 if _compare(*[_read_results(name) for name in filenames]) else 0
+
+  model_names = FLAGS.model_names.split(',')
+  if FLAGS.checkpoint_path and len(model_names) != 1:
+    raise ValueError('--checkpoint_path requires a single --model_names')
+  for model_name in model_names:
+    if model_name not in nets_factory.networks_map:
+      raise ValueError('Name of network unknown %s' % model_name)
+  results = []
+  for values in itertools.product(
+      model_names, _parse_ints(FLAGS.image_sizes),
+      _parse_ints(FLAGS.batch_sizes), _parse_ints(FLAGS.intra_op_threads),
+      _parse_ints(FLAGS.inter_op_threads)):
+    result = _run(dict(zip(_CONFIG_KEYS, values)))
+    results.append(result)
+    if not result.get('error'):
+      tf.logging.info('%s: p50 %.1f ms, p95 %.1f ms, %.1f images/s, %.0f MB',
+                      values, result['p50_ms'], result['p95_ms'],
+                      result['images_per_sec'], result['peak_rss_mb'])
+
+  if FLAGS.output_json:
+    tf.gfile.MakeDirs(os.path.dirname(FLAGS.output_json) or '.')
+    with tf.gfile.Open(FLAGS.output_json, 'w') as f:
+      f.write(json.dumps({
+          'num_warmup_runs': FLAGS.num_warmup_runs,
+          'num_runs': FLAGS.num_runs,
+          'checkpoint_path': FLAGS.checkpoint_path,
+          'tensorflow_version': tf.__version__,
+          'results': results,
+      }, indent=2, sort_keys=True))
+
+  print('%-24s %6s %6s %10s %10s %10s %10s %10s' % (
+      'model', 'size', 'batch', 'threads', 'p50 (ms)', 'p95 (ms)',
+      'images/s', 'RSS (MB)'))
+  for result in results:
+    if result.get('error'):
+      continue
+    print('%-24s %6d %6d %10s %10.1f %10.1f %10.1f %10.0f' % (
+        result['model_name'], result['image_size'], result['batch_size'],
+        '%d/%d' % (result['intra_op_threads'], result['inter_op_threads']),
+        result['p50_ms'], result['p95_ms'], result['images_per_sec'],
+        result['peak_rss_mb']))
+  if FLAGS.baseline_json:
+    return 1 if _compare(_read_results(FLAGS.baseline_json), results) else 0
+  return 0
+
+
+if __name__ == '__main__':
+  tf.app.run()
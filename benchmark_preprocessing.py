@@ -0,0 +1,111 @@
+"""Benchmarks the per-image cost of the inception training preprocessing.
+
+Compares, on the same JPEG files, decoding the full image before sampling the
+training crop (`inception_preprocessing.preprocess_for_train`) with sampling
+the crop from the JPEG header and decoding only the crop window
+(`inception_preprocessing.preprocess_jpeg_for_train`). Both paths sample from
+the same distribution, so the mean and standard deviation of their outputs are
+reported next to the timings as a sanity check:
+
+python benchmark_preprocessing.py \
+    --image_pattern='./data/train_val_images/*/*/*.jpg' --num_images=200
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import warnings
+warnings.filterwarnings('ignore')
+import random
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+
+sys.path.insert(0, './slim/')
+from preprocessing import inception_preprocessing
+
+tf.app.flags.DEFINE_string(
+    'image_pattern', None, 'Glob pattern of the JPEG files to preprocess.')
+
+tf.app.flags.DEFINE_integer(
+    'num_images', 100, 'The number of images sampled from --image_pattern.')
+
+tf.app.flags.DEFINE_integer(
+    'num_runs', 5, 'The number of timed runs per image and path.')
+
+tf.app.flags.DEFINE_integer(
+    'image_size', 299, 'The size of the preprocessed images.')
+
+tf.app.flags.DEFINE_boolean(
+    'fast_mode', True, 'Whether to use the fast mode of the preprocessing.')
+
+tf.app.flags.DEFINE_integer(
+    'random_seed', 0, 'The seed used to sample the images.')
+
+FLAGS = tf.app.flags.FLAGS
+
+
+def _build_paths(image_buffer):
+  """Returns the preprocessed image Tensors of both paths, by name."""
+  decoded_image = tf.image.decode_jpeg(image_buffer, channels=3)
+  return [
+      ('decode_then_crop', inception_preprocessing.preprocess_for_train(
+          decoded_image, FLAGS.image_size, FLAGS.image_size, None,
+          fast_mode=FLAGS.fast_mode, add_image_summaries=False)),
+      ('decode_and_crop', inception_preprocessing.preprocess_jpeg_for_train(
+          image_buffer, FLAGS.image_size, FLAGS.image_size, None,
+          fast_mode=FLAGS.fast_mode, add_image_summaries=False)),
+  ]
+
+
+def main(_):
+  if not FLAGS.image_pattern:
+    raise ValueError('You must supply the JPEG files with --image_pattern')
+
+  filenames = sorted(tf.gfile.Glob(FLAGS.image_pattern))
+  if not filenames:
+    raise ValueError('No file matches %s' % FLAGS.image_pattern)
+  random.Random(FLAGS.random_seed).shuffle(filenames)
+  filenames = filenames[:FLAGS.num_images]
+
+  with tf.Graph().as_default():
+    image_buffer = tf.placeholder(dtype=tf.string)
+    image_shape = tf.image.extract_jpeg_shape(image_buffer)
+    paths = _build_paths(image_buffer)
+
+    seconds = dict((name, []) for name, _ in paths)
+    moments = dict((name, []) for name, _ in paths)
+    megapixels = []
+    with tf.Session() as sess:
+      for filename in filenames:
+        image_data = tf.gfile.GFile(filename, 'rb').read()
+        height, width, _ = sess.run(image_shape,
+                                    feed_dict={image_buffer: image_data})
+        megapixels.append(height * width / 1e6)
+        for name, image in paths:
+          # The first run of each path also warms up the kernels.
+          sess.run(image, feed_dict={image_buffer: image_data})
+          for _ in range(FLAGS.num_runs):
+            start_time = time.time()
+            output = sess.run(image, feed_dict={image_buffer: image_data})
+            seconds[name].append(time.time() - start_time)
+            moments[name].append((output.mean(), output.std()))
+
+  print('%d images, %.2f megapixels on average, %d runs each' % (
+      len(filenames), np.mean(megapixels), FLAGS.num_runs))
+  print('%-18s %10s %10s %10s %12s %12s' % (
+      'path', 'mean (ms)', 'p50 (ms)', 'p95 (ms)', 'output mean',
+      'output std'))
+  for name, _ in paths:
+    times = 1000 * np.array(seconds[name])
+    means, stds = zip(*moments[name])
+    print('%-18s %10.2f %10.2f %10.2f %12.4f %12.4f' % (
+        name, times.mean(), np.percentile(times, 50),
+        np.percentile(times, 95), np.mean(means), np.mean(stds)))
+  print('Speedup: %.2fx' % (np.mean(seconds['decode_then_crop']) /
+                            np.mean(seconds['decode_and_crop'])))
+
+
+if __name__ == '__main__':
+  tf.app.run()
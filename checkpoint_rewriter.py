@@ -0,0 +1,253 @@
+"""Rewrites checkpoints one tensor at a time.
+
+Restoring a checkpoint into variables to save it again holds the whole model
+twice in memory and builds a graph of every variable. `rewrite_checkpoint`
+instead reads the tensors one by one with a checkpoint reader, passes them
+through a transform and writes them to small tensor bundles, which are merged
+into the output checkpoint at the end, like the shards of a sharded `Saver`.
+At most `max_shard_bytes` of tensors, by default the size of the largest
+tensor of the checkpoint, are buffered at a time. The buffer is written before
+a tensor that would overflow it is read, but the tensor read is held along
+with its transformed copy, and the session writing a shard copies its tensors:
+the memory used peaks at about twice the largest of `max_shard_bytes` and the
+largest tensor.
+
+A transform is a function taking the name and numpy value of a tensor and
+returning its new name and value, or None to drop the tensor:
+
+  transform_fn = checkpoint_rewriter.compose(
+      checkpoint_rewriter.magnitude_threshold(1e-3, ['*weights*']),
+      checkpoint_rewriter.cast('float16'))
+  checkpoint_rewriter.rewrite_checkpoint(
+      './checkpoints/haute_garonne_other', './pruned/model.ckpt', transform_fn)
+
+Incremental checkpoints are read merged with their base checkpoint.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import fnmatch
+import os
+import numpy as np
+import tensorflow as tf
+
+from tensorflow.python.ops import gen_io_ops
+
+import checkpoint_tools
+
+
+def _matches(name, patterns):
+  return patterns is None or any(fnmatch.fnmatch(name, pattern)
+                                 for pattern in patterns)
+
+
+def _is_floating(value):
+  return np.issubdtype(value.dtype, np.floating)
+
+
+def compose(*transform_fns):
+  """Returns the transform applying `transform_fns` in order."""
+  def transform_fn(name, value):
+    for fn in transform_fns:
+      renamed = fn(name, value)
+      if renamed is None:
+        return None
+      name, value = renamed
+    return name, value
+  return transform_fn
+
+
+def magnitude_threshold(threshold, patterns=None):
+  """Returns the transform zeroing the weights smaller than `threshold`.
+
+  Args:
+    threshold: The magnitude under which the weights are zeroed.
+    patterns: An optional list of fnmatch patterns of the names of the
+      pruned tensors, all the floating point ones if None.
+  """
+  def transform_fn(name, value):
+    if _matches(name, patterns) and _is_floating(value):
+      value = np.where(np.abs(value) < threshold,
+                       np.zeros_like(value), value)
+    return name, value
+  return transform_fn
+
+
+def mask(masks):
+  """Returns the transform zeroing the weights whose mask is False.
+
+  Args:
+    masks: A dict, or an `np.load`ed .npz file which reads its arrays lazily,
+      from the names of the masked tensors to boolean arrays of their shape.
+  """
+  def transform_fn(name, value):
+    if name in masks:
+      value = np.where(masks[name], value, np.zeros_like(value))
+    return name, value
+  return transform_fn
+
+
+def cast(dtype, patterns=None):
+  """Returns the transform casting the floating point tensors to `dtype`.
+
+  Args:
+    dtype: The numpy dtype, or its name, of the rewritten tensors.
+    patterns: An optional list of fnmatch patterns of the names of the cast
+      tensors, all the floating point ones if None.
+  """
+  def transform_fn(name, value):
+    if _matches(name, patterns) and _is_floating(value):
+      value = value.astype(dtype)
+    return name, value
+  return transform_fn
+
+
+def rename(prefixes):
+  """Returns the transform replacing the prefixes of the names of tensors.
+
+  Args:
+    prefixes: A list of (old prefix, new prefix) pairs, the first matching one
+      of which is replaced.
+  """
+  def transform_fn(name, value):
+    for old_prefix, new_prefix in prefixes:
+      if name.startswith(old_prefix):
+        return new_prefix + name[len(old_prefix):], value
+    return name, value
+  return transform_fn
+
+
+def get_magnitude_percentile(reader, percentile, patterns=None,
+                             num_bins=2**16):
+  """Returns the magnitude under which `percentile` % of the weights lie.
+
+  The tensors are read twice, once for the range of their magnitudes and once
+  for a histogram of their logarithms, so the percentile is exact to within a
+  bin of `num_bins` log-spaced bins and only one tensor is held in memory.
+
+  Args:
+    reader: A checkpoint reader, see `checkpoint_tools.get_checkpoint_reader`.
+    percentile: The percentage of the weights under the returned magnitude.
+    patterns: An optional list of fnmatch patterns of the names of the
+      tensors, all the floating point ones if None.
+    num_bins: The number of bins of the histogram.
+
+  Returns:
+    The magnitude, to be used with `magnitude_threshold`.
+  """
+  dtypes = reader.get_variable_to_dtype_map()
+  names = sorted(name for name in dtypes
+                 if dtypes[name].is_floating and _matches(name, patterns))
+  num_weights, num_zeros = 0, 0
+  min_magnitude, max_magnitude = np.inf, 0.
+  for name in names:
+    magnitudes = np.abs(reader.get_tensor(name))
+    nonzero = magnitudes[magnitudes > 0]
+    num_weights += magnitudes.size
+    num_zeros += magnitudes.size - nonzero.size
+    if nonzero.size:
+      min_magnitude = min(min_magnitude, nonzero.min())
+      max_magnitude = max(max_magnitude, nonzero.max())
+  num_pruned = percentile / 100. * num_weights
+  if num_pruned <= num_zeros:
+    return 0.
+  if min_magnitude == max_magnitude:
+    return np.nextafter(max_magnitude, np.inf)
+
+  log_range = (np.log(min_magnitude), np.log(max_magnitude))
+  histogram = np.zeros(num_bins, dtype=np.int64)
+  for name in names:
+    magnitudes = np.abs(reader.get_tensor(name))
+    histogram += np.histogram(np.log(magnitudes[magnitudes > 0]),
+                              bins=num_bins, range=log_range)[0]
+  counts = num_zeros + np.cumsum(histogram)
+  bin_index = min(np.searchsorted(counts, num_pruned), num_bins - 1)
+  return float(np.exp(log_range[0] + (bin_index + 1) *
+                      (log_range[1] - log_range[0]) / num_bins))
+
+
+def _write_bundle(prefix, tensors):
+  """Writes a list of (name, value) tensors to a single tensor bundle."""
+  with tf.Graph().as_default():
+    values = [tf.placeholder(tf.string if value.dtype == object
+                             else tf.as_dtype(value.dtype), value.shape)
+              for _, value in tensors]
+    save_op = gen_io_ops.save_v2(
+        prefix, [name for name, _ in tensors], [''] * len(tensors), values)
+    with tf.Session() as sess:
+      sess.run(save_op, dict(zip(values, [value for _, value in tensors])))
+
+
+def rewrite_checkpoint(checkpoint_path, output_path, transform_fn=None,
+                       max_shard_bytes=None):
+  """Streams the tensors of a checkpoint through a transform to a new one.
+
+  Args:
+    checkpoint_path: A checkpoint or a directory of checkpoints.
+    output_path: The prefix of the written checkpoint.
+    transform_fn: An optional transform of the tensors, see the module
+      docstring.
+    max_shard_bytes: The size of the tensors buffered before they are written
+      to a shard. Defaults to the size of the largest tensor. The memory used
+      peaks at about twice the largest of this size and the largest tensor.
+
+  Returns:
+    The list of the names of the written tensors.
+
+  Raises:
+    ValueError: If two tensors are renamed to the same name, or if every
+      tensor is dropped.
+  """
+  reader = checkpoint_tools.get_checkpoint_reader(checkpoint_path)
+  shapes = reader.get_variable_to_shape_map()
+  dtypes = reader.get_variable_to_dtype_map()
+  sizes = {name: int(np.prod(shapes[name])) * dtypes[name].size
+           for name in shapes}
+  if not max_shard_bytes:
+    max_shard_bytes = max(sizes.values())
+
+  temp_dir = output_path + '_temp'
+  tf.gfile.MakeDirs(temp_dir)
+  shard_prefixes = []
+  tensors, num_bytes = [], 0
+  written_names = set()
+
+  def write_shard():
+    shard_prefixes.append(os.path.join(temp_dir,
+                                       'part-%05d' % len(shard_prefixes)))
+    _write_bundle(shard_prefixes[-1], tensors)
+
+  for name in sorted(shapes):
+    # The buffer is written before reading a tensor that would overflow it,
+    # rather than held along with the tensor and its transformed copy.
+    if tensors and num_bytes + sizes[name] > max_shard_bytes:
+      write_shard()
+      tensors, num_bytes = [], 0
+    value = np.asarray(reader.get_tensor(name))
+    if transform_fn is not None:
+      renamed = transform_fn(name, value)
+      if renamed is None:
+        continue
+      name, value = renamed
+    if name in written_names:
+      raise ValueError('Several tensors are written to %s' % name)
+    written_names.add(name)
+    # A transform can also grow a tensor, e.g. cast it to a wider type.
+    if tensors and num_bytes + value.nbytes > max_shard_bytes:
+      write_shard()
+      tensors, num_bytes = [], 0
+    tensors.append((name, value))
+    num_bytes += value.nbytes
+  if tensors:
+    write_shard()
+  if not shard_prefixes:
+    raise ValueError('Every tensor of %s was dropped' % checkpoint_path)
+
+  with tf.Graph().as_default(), tf.Session() as sess:
+    sess.run(gen_io_ops.merge_v2_checkpoints(
+        shard_prefixes, output_path, delete_old_dirs=True))
+  if tf.gfile.Exists(temp_dir):
+    tf.gfile.DeleteRecursively(temp_dir)
+  return sorted(written_names)
@@ -0,0 +1,129 @@
+"""Tests for checkpoint_rewriter."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import numpy as np
+import tensorflow as tf
+
+import checkpoint_rewriter
+import checkpoint_tools
+
+
+def _write_checkpoint(checkpoint_path, values):
+  """Saves a dict from names to numpy values as a checkpoint."""
+  with tf.Graph().as_default():
+    variables = {name: tf.Variable(value) for name, value in values.items()}
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      tf.train.Saver(variables).save(sess, checkpoint_path)
+
+
+def _read_checkpoint(checkpoint_path):
+  reader = tf.train.NewCheckpointReader(checkpoint_path)
+  return {name: reader.get_tensor(name)
+          for name in reader.get_variable_to_shape_map()}
+
+
+class CheckpointRewriterTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(CheckpointRewriterTest, self).setUp()
+    self._values = {
+        'net/conv/weights': np.random.randn(3, 3, 32, 64).astype(np.float32),
+        'net/conv/biases': np.random.randn(64).astype(np.float32),
+        'net/logits/weights': np.random.randn(64, 50).astype(np.float32),
+        'global_step': np.int64(10),
+    }
+    self._checkpoint_path = os.path.join(self.get_temp_dir(), 'input',
+                                         'model.ckpt')
+    _write_checkpoint(self._checkpoint_path, self._values)
+
+  def testRenameAndCastToSeveralShards(self):
+    output_path = os.path.join(self.get_temp_dir(), 'output', 'model.ckpt')
+    names = checkpoint_rewriter.rewrite_checkpoint(
+        self._checkpoint_path, output_path,
+        checkpoint_rewriter.compose(
+            checkpoint_rewriter.rename([('net/', 'model/')]),
+            checkpoint_rewriter.cast('float16', ['*weights'])),
+        max_shard_bytes=1)
+
+    self.assertEqual(names, ['global_step', 'model/conv/biases',
+                             'model/conv/weights', 'model/logits/weights'])
+    self.assertFalse(tf.gfile.Exists(output_path + '_temp'))
+    dtypes = tf.train.NewCheckpointReader(
+        output_path).get_variable_to_dtype_map()
+    self.assertEqual(dtypes['model/conv/weights'], tf.float16)
+    self.assertEqual(dtypes['model/conv/biases'], tf.float32)
+    self.assertEqual(dtypes['global_step'], tf.int64)
+    values = _read_checkpoint(output_path)
+    self.assertEqual(sorted(values), names)
+    self.assertAllEqual(values['model/conv/weights'],
+                        self._values['net/conv/weights'].astype(np.float16))
+    self.assertAllEqual(values['model/conv/biases'],
+                        self._values['net/conv/biases'])
+    self.assertEqual(values['global_step'], 10)
+
+  def testRenamingTwoTensorsToTheSameNameFails(self):
+    with self.assertRaisesRegexp(ValueError, 'Several tensors'):
+      checkpoint_rewriter.rewrite_checkpoint(
+          self._checkpoint_path,
+          os.path.join(self.get_temp_dir(), 'output', 'model.ckpt'),
+          checkpoint_rewriter.rename([('net/conv/', 'net/'),
+                                      ('net/logits/', 'net/')]))
+
+  def testDroppingEveryTensorFails(self):
+    with self.assertRaisesRegexp(ValueError, 'was dropped'):
+      checkpoint_rewriter.rewrite_checkpoint(
+          self._checkpoint_path,
+          os.path.join(self.get_temp_dir(), 'output', 'model.ckpt'),
+          lambda name, value: None)
+
+  def testMagnitudePercentile(self):
+    reader = tf.train.NewCheckpointReader(self._checkpoint_path)
+    magnitudes = np.abs(np.concatenate(
+        [self._values[name].reshape(-1) for name in self._values
+         if name != 'global_step']))
+    for percentile in [10, 50, 90]:
+      threshold = checkpoint_rewriter.get_magnitude_percentile(
+          reader, percentile)
+      self.assertAllClose(threshold, np.percentile(magnitudes, percentile),
+                          rtol=1e-2)
+      # A few magnitudes share the histogram bin of the threshold.
+      self.assertNear(np.mean(magnitudes < threshold), percentile / 100.,
+                      10. / magnitudes.size)
+
+    weights = self._values['net/logits/weights']
+    self.assertAllClose(
+        checkpoint_rewriter.get_magnitude_percentile(
+            reader, 50, ['*logits*']),
+        np.percentile(np.abs(weights), 50), rtol=1e-2)
+
+  def testRewriteIncrementalCheckpoint(self):
+    train_dir = os.path.join(self.get_temp_dir(), 'train')
+    with tf.Graph().as_default():
+      frozen = tf.Variable(self._values['net/conv/weights'],
+                           name='net/conv/weights')
+      checkpoint_tools.write_base_checkpoint(train_dir, self._checkpoint_path,
+                                             [frozen])
+    logits_weights = np.ones([64, 50], np.float32)
+    _write_checkpoint(os.path.join(train_dir, 'model.ckpt-20'), {
+        'net/conv/biases': self._values['net/conv/biases'],
+        'net/logits/weights': logits_weights,
+        'global_step': np.int64(20),
+    })
+
+    output_path = os.path.join(self.get_temp_dir(), 'output', 'model.ckpt')
+    checkpoint_rewriter.rewrite_checkpoint(train_dir, output_path)
+    values = _read_checkpoint(output_path)
+    self.assertEqual(sorted(values), sorted(self._values))
+    self.assertAllEqual(values['net/conv/weights'],
+                        self._values['net/conv/weights'])
+    self.assertAllEqual(values['net/logits/weights'], logits_weights)
+    self.assertEqual(values['global_step'], 20)
+
+
+if __name__ == '__main__':
+  tf.test.main()
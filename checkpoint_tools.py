@@ -0,0 +1,377 @@
+"""Incremental checkpoints of fine-tuning runs with a frozen backbone.
+
+When only a few layers are trained on top of a pretrained checkpoint, most of
+the variables never change: their values are the ones of the base checkpoint.
+An incremental checkpoint holds only the variables the training updates, such
+as the trained weights, their optimizer slots and moving averages, the batch
+norm statistics and the global step. The train_dir records the base
+checkpoint and the variables read from it in base_checkpoint.json:
+
+  {"base_checkpoint": "./checkpoints/inception/inception_v3_iNat_299.ckpt",
+   "frozen_variables": ["InceptionV3/Conv2d_1a_3x3/weights", ...]}
+
+`IncrementalSaver` writes these checkpoints from `train.py`, and the loaders
+of this module merge them with the base checkpoint back into full models for
+`eval.py`, `export_model_tf1.py` and `prune.py`. The base checkpoint must not
+be modified once a run has started from it.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import threading
+import tensorflow as tf
+
+from tensorflow.contrib import graph_editor as ge
+
+BASE_CHECKPOINT_FILENAME = 'base_checkpoint.json'
+
+# The op types writing to the variable of their first input.
+_ASSIGN_OP_TYPES = ('Assign', 'AssignAdd', 'AssignSub', 'AssignVariableOp',
+                    'AssignAddVariableOp', 'AssignSubVariableOp')
+
+_UPDATE_OP_TYPE_PREFIXES = ('Apply', 'ResourceApply', 'SparseApply',
+                            'ResourceSparseApply', 'Scatter',
+                            'ResourceScatter')
+
+
+def _checkpoint_dir(checkpoint_path):
+  """Returns the directory of a checkpoint or directory of checkpoints."""
+  if tf.gfile.IsDirectory(checkpoint_path):
+    return checkpoint_path
+  return os.path.dirname(checkpoint_path)
+
+
+def _resolve(checkpoint_path):
+  """Returns the latest checkpoint of a directory, or the path unchanged."""
+  if tf.gfile.IsDirectory(checkpoint_path):
+    return tf.train.latest_checkpoint(checkpoint_path)
+  return checkpoint_path
+
+
+def read_base_checkpoint(checkpoint_path):
+  """Reads the base_checkpoint.json of incremental checkpoints.
+
+  Args:
+    checkpoint_path: A checkpoint or a directory of checkpoints.
+
+  Returns:
+    The metadata dict, or None if the checkpoints are full checkpoints.
+  """
+  metadata_filename = os.path.join(_checkpoint_dir(checkpoint_path),
+                                   BASE_CHECKPOINT_FILENAME)
+  if not tf.gfile.Exists(metadata_filename):
+    return None
+  with tf.gfile.Open(metadata_filename, 'r') as f:
+    return json.loads(f.read())
+
+
+def write_base_checkpoint(train_dir, base_checkpoint, frozen_variables):
+  """Writes the base_checkpoint.json of the incremental checkpoints of a run.
+
+  Args:
+    train_dir: The directory of the incremental checkpoints.
+    base_checkpoint: The path of the base checkpoint.
+    frozen_variables: The variables read from the base checkpoint only.
+
+  Raises:
+    ValueError: If the train_dir already records another base checkpoint.
+  """
+  metadata = {
+      'base_checkpoint': base_checkpoint,
+      'frozen_variables': sorted(var.op.name for var in frozen_variables),
+  }
+  existing_metadata = read_base_checkpoint(train_dir)
+  if existing_metadata is not None:
+    if existing_metadata != metadata:
+      raise ValueError('%s records another base checkpoint or other frozen '
+                       'variables' % train_dir)
+    return
+  tf.gfile.MakeDirs(train_dir)
+  with tf.gfile.Open(os.path.join(train_dir, BASE_CHECKPOINT_FILENAME),
+                     'w') as f:
+    f.write(json.dumps(metadata, indent=2, sort_keys=True))
+
+
+def get_updated_variables(fetches):
+  """Returns the global variables written to when running `fetches`.
+
+  Args:
+    fetches: A list of ops or Tensors, e.g. the train op.
+
+  Returns:
+    The list of the global variables assigned or updated by an op `fetches`
+    depend on, through data or control dependencies.
+  """
+  seed_ops = [fetch.op if isinstance(fetch, tf.Tensor) else fetch
+              for fetch in fetches]
+  written_ops = set()
+  for op in ge.get_backward_walk_ops(seed_ops, inclusive=True,
+                                     control_inputs=True):
+    if (op.type in _ASSIGN_OP_TYPES or
+        op.type.startswith(_UPDATE_OP_TYPE_PREFIXES)):
+      written_ops.add(op.inputs[0].op)
+  return [var for var in tf.global_variables() if var.op in written_ops]
+
+
+class _AsyncCheckpointWriter(object):
+  """Writes checkpoints of numpy values from a background thread.
+
+  The values are assigned to copies of the variables in a graph and session of
+  its own, so the writes never hold the training session.
+  """
+
+  def __init__(self, names, variables, max_to_keep):
+    self._graph = tf.Graph()
+    with self._graph.as_default():
+      self._placeholders = []
+      assign_ops = []
+      copies = {}
+      for name, var in zip(names, variables):
+        copy = tf.Variable(tf.zeros(var.shape, var.dtype.base_dtype),
+                           trainable=False)
+        placeholder = tf.placeholder(var.dtype.base_dtype, var.shape)
+        self._placeholders.append(placeholder)
+        assign_ops.append(tf.assign(copy, placeholder))
+        copies[name] = copy
+      self._assign_op = tf.group(*assign_ops)
+      self.saver = tf.train.Saver(copies, max_to_keep=max_to_keep)
+      self._session = tf.Session()
+    self._thread = None
+    self._lock = threading.Lock()
+
+  def _write(self, values, save_path, global_step):
+    self._session.run(self._assign_op,
+                      feed_dict=dict(zip(self._placeholders, values)))
+    self.saver.save(self._session, save_path, global_step=global_step,
+                    write_meta_graph=False)
+
+  def write(self, values, save_path, global_step):
+    """Starts writing a checkpoint once the previous one is written."""
+    with self._lock:
+      self.wait()
+      self._thread = threading.Thread(
+          target=self._write, args=(values, save_path, global_step),
+          name='incremental_checkpoint_writer')
+      # Not a daemon, the last checkpoint is written before the process exits.
+      self._thread.start()
+
+  def wait(self):
+    """Waits for the checkpoint being written, if any."""
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+
+
+class IncrementalSaver(object):
+  """A `tf.train.Saver` substitute writing incremental checkpoints.
+
+  `save` reads the values of the updated variables in the training session
+  and writes them from a background thread. `restore` reads the frozen
+  variables from the base checkpoint and the others from the incremental
+  checkpoint. It implements what `slim.learning.train` and its `Supervisor`
+  use of a saver.
+  """
+
+  def __init__(self, variables, frozen_variables, base_checkpoint,
+               max_to_keep=5):
+    """Creates an IncrementalSaver.
+
+    Args:
+      variables: The variables of the incremental checkpoints.
+      frozen_variables: The variables restored from `base_checkpoint`.
+      base_checkpoint: The path of the base checkpoint.
+      max_to_keep: The number of recent incremental checkpoints to keep.
+    """
+    self._variables = list(variables)
+    self._base_checkpoint = base_checkpoint
+    self._saver = tf.train.Saver(self._variables)
+    self._base_saver = tf.train.Saver(list(frozen_variables),
+                                      allow_empty=True)
+    self._writer = _AsyncCheckpointWriter(
+        [var.op.name for var in self._variables], self._variables,
+        max_to_keep)
+
+  @property
+  def saver_def(self):
+    # The Supervisor exports it in the meta graph of the train_dir.
+    return self._saver.saver_def
+
+  @property
+  def last_checkpoints(self):
+    return self._writer.saver.last_checkpoints
+
+  def recover_last_checkpoints(self, checkpoint_paths):
+    self._writer.saver.recover_last_checkpoints(checkpoint_paths)
+
+  def save(self, sess, save_path, global_step=None, **unused_kwargs):
+    """Snapshots the variables and starts writing them.
+
+    Args:
+      sess: The training session.
+      save_path: The prefix of the checkpoint files.
+      global_step: An optional int, or Tensor or variable evaluated in `sess`,
+        appended to `save_path`.
+
+    Returns:
+      The path of the checkpoint being written.
+    """
+    if global_step is not None and not isinstance(global_step, int):
+      values, global_step = sess.run([self._variables, global_step])
+      global_step = int(global_step)
+    else:
+      values = sess.run(self._variables)
+    self._writer.write(values, save_path, global_step)
+    if global_step is None:
+      return save_path
+    return '%s-%d' % (save_path, global_step)
+
+  def wait(self):
+    """Waits for the checkpoint being written, if any."""
+    self._writer.wait()
+
+  def restore(self, sess, save_path):
+    """Restores the base checkpoint, then an incremental checkpoint."""
+    self._writer.wait()
+    self._base_saver.restore(sess, self._base_checkpoint)
+    self._saver.restore(sess, save_path)
+
+
+def _split_variables_to_restore(variables_to_restore, metadata):
+  """Splits the variables to restore between the base and the increment.
+
+  Args:
+    variables_to_restore: A list of variables, or a dict of variables keyed
+      by their name in the checkpoint.
+    metadata: The base_checkpoint.json of the checkpoints.
+
+  Returns:
+    The variables of the incremental checkpoints and those of the base
+    checkpoint, both as dicts keyed by checkpoint name.
+  """
+  if not isinstance(variables_to_restore, dict):
+    variables_to_restore = dict((var.op.name, var)
+                                for var in variables_to_restore)
+  frozen_names = set(metadata['frozen_variables'])
+  incremental_variables, base_variables = {}, {}
+  for name, var in variables_to_restore.items():
+    if name in frozen_names:
+      base_variables[name] = var
+    else:
+      incremental_variables[name] = var
+  return incremental_variables, base_variables
+
+
+def setup_incremental_restore(variables_to_restore, checkpoint_path):
+  """Prepares a graph to restore incremental checkpoints with a Scaffold.
+
+  With incremental checkpoints, the restore of the frozen variables from the
+  base checkpoint is added to the local init op, which the `Scaffold` of
+  `slim.evaluation.evaluation_loop` runs after every checkpoint restore. This
+  must be called once all the local variables, e.g. of the metrics, exist.
+
+  Args:
+    variables_to_restore: A list of variables, or a dict of variables keyed
+      by their name in the checkpoint.
+    checkpoint_path: A checkpoint or a directory of checkpoints.
+
+  Returns:
+    The variables to restore from the checkpoints: `variables_to_restore`
+    itself for full checkpoints.
+  """
+  metadata = read_base_checkpoint(checkpoint_path)
+  if metadata is None:
+    return variables_to_restore
+  incremental_variables, base_variables = _split_variables_to_restore(
+      variables_to_restore, metadata)
+  if base_variables:
+    base_saver = tf.train.Saver(base_variables,
+                                filename=metadata['base_checkpoint'])
+    restore_op = tf.get_default_graph().get_operation_by_name(
+        base_saver.saver_def.restore_op_name)
+    tf.add_to_collection(tf.GraphKeys.LOCAL_INIT_OP, tf.group(
+        tf.local_variables_initializer(), tf.tables_initializer(),
+        restore_op))
+    # The frozen variables are only initialized by the local init op.
+    tf.add_to_collection(
+        tf.GraphKeys.READY_FOR_LOCAL_INIT_OP,
+        tf.report_uninitialized_variables(
+            list(incremental_variables.values())))
+  return incremental_variables
+
+
+def restore(sess, variables_to_restore, checkpoint_path):
+  """Restores a full or incremental checkpoint into a session.
+
+  Args:
+    sess: The session.
+    variables_to_restore: A list of variables, or a dict of variables keyed
+      by their name in the checkpoint.
+    checkpoint_path: A checkpoint or a directory of checkpoints.
+  """
+  metadata = read_base_checkpoint(checkpoint_path)
+  checkpoint_path = _resolve(checkpoint_path)
+  if metadata is None:
+    tf.train.Saver(variables_to_restore).restore(sess, checkpoint_path)
+    return
+  incremental_variables, base_variables = _split_variables_to_restore(
+      variables_to_restore, metadata)
+  if base_variables:
+    tf.train.Saver(base_variables).restore(sess, metadata['base_checkpoint'])
+  tf.train.Saver(incremental_variables).restore(sess, checkpoint_path)
+
+
+class _MergedCheckpointReader(object):
+  """Reads an incremental checkpoint as if it were a full checkpoint."""
+
+  def __init__(self, checkpoint_path, metadata):
+    self._reader = tf.train.NewCheckpointReader(checkpoint_path)
+    self._base_reader = tf.train.NewCheckpointReader(
+        metadata['base_checkpoint'])
+    self._frozen_names = set(metadata['frozen_variables'])
+
+  def _reader_of(self, name):
+    if self._reader.has_tensor(name):
+      return self._reader
+    return self._base_reader
+
+  def _frozen(self, base_map):
+    return dict((name, value) for name, value in base_map.items()
+                if name in self._frozen_names)
+
+  def get_variable_to_shape_map(self):
+    shapes = self._frozen(self._base_reader.get_variable_to_shape_map())
+    shapes.update(self._reader.get_variable_to_shape_map())
+    return shapes
+
+  def get_variable_to_dtype_map(self):
+    dtypes = self._frozen(self._base_reader.get_variable_to_dtype_map())
+    dtypes.update(self._reader.get_variable_to_dtype_map())
+    return dtypes
+
+  def has_tensor(self, name):
+    return self._reader.has_tensor(name) or (
+        name in self._frozen_names and self._base_reader.has_tensor(name))
+
+  def get_tensor(self, name):
+    return self._reader_of(name).get_tensor(name)
+
+
+def get_checkpoint_reader(checkpoint_path):
+  """Returns a `tf.train.NewCheckpointReader` of a full or merged checkpoint.
+
+  Args:
+    checkpoint_path: A checkpoint or a directory of checkpoints.
+
+  Returns:
+    A reader of the checkpoint, whose incremental checkpoints read their
+    frozen variables from the base checkpoint.
+  """
+  metadata = read_base_checkpoint(checkpoint_path)
+  checkpoint_path = _resolve(checkpoint_path)
+  if metadata is None:
+    return tf.train.NewCheckpointReader(checkpoint_path)
+  return _MergedCheckpointReader(checkpoint_path, metadata)
@@ -0,0 +1,80 @@
+"""Tests for checkpoint_tools."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import numpy as np
+import tensorflow as tf
+
+import checkpoint_tools
+
+slim = tf.contrib.slim
+
+
+def _create_variables():
+  """Creates a frozen and a trained variable, and the global step."""
+  frozen = tf.get_variable('frozen', initializer=np.full([3], 2., np.float32))
+  head = tf.get_variable('head', initializer=np.full([3], .5, np.float32))
+  global_step = tf.train.get_or_create_global_step()
+  return frozen, head, global_step
+
+
+def _write_base_checkpoint(checkpoint_path):
+  with tf.Graph().as_default():
+    frozen, head, _ = _create_variables()
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      tf.train.Saver([frozen, head]).save(sess, checkpoint_path)
+
+
+class IncrementalSaverTest(tf.test.TestCase):
+
+  def testTrainAndRestore(self):
+    base_checkpoint = os.path.join(self.get_temp_dir(), 'base', 'model.ckpt')
+    _write_base_checkpoint(base_checkpoint)
+    train_dir = os.path.join(self.get_temp_dir(), 'train')
+
+    with tf.Graph().as_default():
+      frozen, head, global_step = _create_variables()
+      loss = tf.reduce_sum(tf.square(frozen * head - 1.))
+      train_op = slim.learning.create_train_op(
+          loss, tf.train.GradientDescentOptimizer(0.1),
+          variables_to_train=[head])
+      updated_variables = checkpoint_tools.get_updated_variables([train_op])
+      self.assertItemsEqual([var.op.name for var in updated_variables],
+                            ['head', 'global_step'])
+      checkpoint_tools.write_base_checkpoint(train_dir, base_checkpoint,
+                                             [frozen])
+      saver = checkpoint_tools.IncrementalSaver([head, global_step], [frozen],
+                                                base_checkpoint)
+      base_saver = tf.train.Saver([frozen, head])
+      slim.learning.train(
+          train_op, train_dir, number_of_steps=3,
+          init_fn=lambda sess: base_saver.restore(sess, base_checkpoint),
+          saver=saver, save_summaries_secs=600, save_interval_secs=600)
+      saver.wait()
+
+    checkpoint_path = tf.train.latest_checkpoint(train_dir)
+    self.assertEqual(
+        tf.train.NewCheckpointReader(checkpoint_path).get_variable_to_shape_map(
+        ).keys(), {'head', 'global_step'})
+
+    with tf.Graph().as_default():
+      frozen, head, global_step = _create_variables()
+      variables_to_restore = checkpoint_tools.setup_incremental_restore(
+          tf.global_variables(), train_dir)
+      self.assertItemsEqual(variables_to_restore, ['head', 'global_step'])
+      scaffold = tf.train.Scaffold(
+          saver=tf.train.Saver(variables_to_restore))
+      with tf.train.MonitoredSession(tf.train.ChiefSessionCreator(
+          scaffold, checkpoint_filename_with_path=checkpoint_path)) as sess:
+        frozen_value, head_value, step = sess.run([frozen, head, global_step])
+    self.assertAllEqual(frozen_value, np.full([3], 2.))
+    self.assertTrue(np.all(head_value > .5))
+    self.assertEqual(step, 3)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,77 @@
+"""Compares the wall-clock time training runs take to reach an accuracy.
+
+Reads the eval_log.jsonl written by `train.py --eval_every_n_steps` in every
+train_dir, and reports the training time, without the evaluations, after
+which each run first reached every target of the metric, e.g. to compare a
+fixed-resolution run with a `--resolution_schedule` run on the same data:
+
+python compare_runs.py \
+    --train_dirs=./checkpoints/fixed_299,./checkpoints/schedule_224_299 \
+    --metric=accuracy --targets=0.6,0.7,0.75
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import warnings
+warnings.filterwarnings('ignore')
+import json
+import os
+import tensorflow as tf
+
+tf.app.flags.DEFINE_string(
+    'train_dirs', None, 'Comma-separated list of the train_dirs to compare.')
+
+tf.app.flags.DEFINE_string(
+    'metric', 'accuracy',
+    'The compared metric, one of "accuracy", "recall_5" and "f1_score".')
+
+tf.app.flags.DEFINE_string(
+    'targets', '0.5,0.6,0.7',
+    'Comma-separated list of the metric values to report the time to.')
+
+FLAGS = tf.app.flags.FLAGS
+
+
+def _read_eval_log(train_dir):
+  """Returns the evaluations of a train_dir, in order."""
+  log_filename = os.path.join(train_dir, 'eval_log.jsonl')
+  if not tf.gfile.Exists(log_filename):
+    raise ValueError('%s has no eval_log.jsonl, it must be trained with '
+                     '--eval_every_n_steps' % train_dir)
+  with tf.gfile.Open(log_filename, 'r') as f:
+    return [json.loads(line) for line in f.read().splitlines() if line]
+
+
+def _format_hours(seconds):
+  return '-' if seconds is None else '%.2f' % (seconds / 3600.)
+
+
+def main(_):
+  if not FLAGS.train_dirs:
+    raise ValueError('You must supply the train_dirs with --train_dirs')
+  targets = [float(target) for target in FLAGS.targets.split(',')]
+
+  print('%-40s %8s %8s %8s %10s' % ('train_dir', 'steps', 'hours',
+                                    'best', 'best at h') +
+        ''.join(' %8s' % ('h to %g' % target) for target in targets))
+  for train_dir in FLAGS.train_dirs.split(','):
+    train_dir = train_dir.strip()
+    evals = _read_eval_log(train_dir)
+    if not evals:
+      continue
+    best = max(evals, key=lambda e: e[FLAGS.metric])
+    times_to_targets = []
+    for target in targets:
+      reached = [e for e in evals if e[FLAGS.metric] >= target]
+      times_to_targets.append(reached[0]['train_seconds'] if reached else None)
+    print('%-40s %8d %8s %8.4f %10s' % (
+        train_dir, evals[-1]['global_step'],
+        _format_hours(evals[-1]['train_seconds']), best[FLAGS.metric],
+        _format_hours(best['train_seconds'])) +
+          ''.join(' %8s' % _format_hours(seconds)
+                  for seconds in times_to_targets))
+
+
+if __name__ == '__main__':
+  tf.app.run()
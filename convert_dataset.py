@@ -7,10 +7,18 @@ from __future__ import division
 from __future__ import print_function
 import warnings
 warnings.filterwarnings('ignore')
+import collections
+import hashlib
+import json
 import math
+import multiprocessing
 import os
 import random
+import struct
 import sys
+import time
+import zlib
+from dataset_builder.core.constants import CLASS_LIST
 from dataset_builder.core.utility import load_manifest_parquet
 
 import tensorflow as tf
@@ -30,16 +38,181 @@ tf.app.flags.DEFINE_string(
 tf.app.flags.DEFINE_integer(
     'num_shards', 10, 'The number of shards per dataset split.')
 
+tf.app.flags.DEFINE_float(
+    'shard_size_mb', 0,
+    'If positive, shards are cut by size instead of by image count: each '
+    'split gets as many shards as needed for them to hold about this many MB '
+    'of source images. Overrides --num_shards.')
+
+tf.app.flags.DEFINE_integer(
+    'num_workers', 1,
+    'The number of worker processes converting shards in parallel. Each '
+    'worker runs its own decoder session and TFRecord writer. 1 converts '
+    'every shard in the calling process.')
+
+tf.app.flags.DEFINE_boolean(
+    'probe_image_headers', True,
+    'Read the image height and width from the JPEG/PNG header instead of '
+    'decoding the pixels. Images whose header cannot be parsed are decoded.')
+
+tf.app.flags.DEFINE_integer(
+    'random_seed', 0,
+    'Seed of the training set shuffle. Keeping it fixed keeps the content of '
+    'every shard stable, which is what lets an interrupted conversion resume.')
+
+tf.app.flags.DEFINE_boolean(
+    'interleave_classes', False,
+    'Order the images of both splits so that classes are interleaved in '
+    'proportion to their size, instead of a global shuffle for train and '
+    'manifest order for validation. Every shard, and every window of the '
+    'readers queues, then holds a near-proportional sample of every label.')
+
+tf.app.flags.DEFINE_boolean(
+    'verify', False,
+    'Instead of converting, stream every existing shard and check its record '
+    'count and record CRCs against its metadata file. Shards failing the '
+    'check are invalidated so that the next conversion rebuilds them.')
+
+tf.app.flags.DEFINE_integer(
+    'resize_shorter_side', 0,
+    'If positive, images whose shorter side is larger than this are resized '
+    'so that their shorter side equals it, keeping the aspect ratio, and '
+    're-encoded as JPEG before being written. 0 stores the original bytes.')
+
+tf.app.flags.DEFINE_integer(
+    'jpeg_quality', 90,
+    'The JPEG quality (0-100) used to re-encode resized images.')
+
+# The label to species name map written by dataset_builder's manifest step.
+_SPECIES_LABELS_FILENAME = 'dataset_species_labels.json'
+
+# The taxon of the labels whose images span several taxonomic classes, such as
+# the "Other" label of dataset_builder.
+_MIXED_TAXON = 'Other'
+
+# Describes the work needed to write one output shard. Only plain values are
+# stored so that the spec can be sent to a worker process.
+_ShardSpec = collections.namedtuple(
+    '_ShardSpec',
+    ['split_name', 'shard_id', 'num_shards', 'output_filename',
+     'filenames', 'labels', 'rows', 'sources_digest', 'probe_image_headers',
+     'resize'])
+
+# Statistics reported back by a worker once its shard has been written.
+_ShardResult = collections.namedtuple(
+    '_ShardResult',
+    ['split_name', 'shard_id', 'num_shards', 'num_images', 'num_bytes_read',
+     'num_bytes_written', 'seconds', 'num_header_probed', 'num_decoded',
+     'num_resized'])
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Start-of-frame markers of the baseline, extended and progressive Huffman
+# coded JPEG processes, the ones the TensorFlow JPEG decoder supports.
+_JPEG_SOF_MARKERS = (0xC0, 0xC1, 0xC2)
+
+
+def _read_jpeg_header_dims(image_data):
+  """Returns the (height, width) stored in the SOF segment of a JPEG.
+
+  Args:
+    image_data: The encoded JPEG bytes.
+
+  Returns:
+    A (height, width) tuple, or None if the data is not a JPEG the decoder
+    supports or the frame header could not be found before the scan data.
+  """
+  if image_data[:2] != b'\xff\xd8':
+    return None
+  offset = 2
+  while offset + 4 <= len(image_data):
+    if image_data[offset] != 0xFF:
+      return None
+    marker = image_data[offset + 1]
+    if marker == 0xFF:
+      # Fill byte preceding a marker.
+      offset += 1
+      continue
+    if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+      # Standalone markers carry no length field.
+      offset += 2
+      continue
+    if marker in (0xD9, 0xDA):
+      # End of image or start of scan reached without a frame header.
+      return None
+    segment_length = struct.unpack('>H', image_data[offset+2:offset+4])[0]
+    if marker in _JPEG_SOF_MARKERS:
+      if offset + 9 > len(image_data):
+        return None
+      height, width = struct.unpack('>HH', image_data[offset+5:offset+9])
+      if not height or not width:
+        # A zero height is defined later by a DNL marker.
+        return None
+      return height, width
+    if 0xC3 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+      # Lossless or arithmetic coded frame, let the decoder handle it.
+      return None
+    offset += 2 + segment_length
+  return None
+
+
+def _read_png_header_dims(image_data):
+  """Returns the (height, width) stored in the IHDR chunk of a PNG, or None."""
+  if image_data[:8] != _PNG_SIGNATURE or image_data[12:16] != b'IHDR':
+    return None
+  if len(image_data) < 24:
+    return None
+  width, height = struct.unpack('>II', image_data[16:24])
+  return height, width
+
+
+def _image_format(image_data):
+  """Returns the `image/format` value matching the encoded image bytes."""
+  if image_data[:8] == _PNG_SIGNATURE:
+    return b'png'
+  return b'jpg'
+
 
 class ImageReader(object):
   """Helper class that provides TensorFlow image coding utilities."""
 
-  def __init__(self):
+  def __init__(self, probe_image_headers=True, resize_shorter_side=0,
+               jpeg_quality=90):
     # Initializes function that decodes RGB JPEG data.
     self._decode_jpeg_data = tf.placeholder(dtype=tf.string)
     self._decode_jpeg = tf.image.decode_jpeg(self._decode_jpeg_data, channels=3)
+    self._probe_image_headers = probe_image_headers
+    self._resize_shorter_side = resize_shorter_side
+    if resize_shorter_side:
+      # Initializes function that downsizes the decoded image so that its
+      # shorter side is resize_shorter_side and encodes it back to JPEG.
+      shape = tf.to_float(tf.shape(self._decode_jpeg)[:2])
+      scale = resize_shorter_side / tf.reduce_min(shape)
+      new_size = tf.to_int32(tf.round(shape * scale))
+      resized = tf.image.resize_images(
+          self._decode_jpeg, new_size, method=tf.image.ResizeMethod.AREA)
+      self._resize_jpeg = tf.image.encode_jpeg(
+          tf.saturate_cast(tf.round(resized), tf.uint8),
+          quality=jpeg_quality)
+      self._resized_size = new_size
+    # Number of images whose dimensions came from the header and from a full
+    # decode respectively, and number of images that were resized.
+    self.num_header_probed = 0
+    self.num_decoded = 0
+    self.num_resized = 0
+
+  def _read_header_dims(self, image_data):
+    if not self._probe_image_headers:
+      return None
+    return (_read_jpeg_header_dims(image_data) or
+            _read_png_header_dims(image_data))
 
   def read_image_dims(self, sess, image_data):
+    dims = self._read_header_dims(image_data)
+    if dims is not None:
+      self.num_header_probed += 1
+      return dims
+    self.num_decoded += 1
     image = self.decode_jpeg(sess, image_data)
     return image.shape[0], image.shape[1]
 
@@ -50,6 +223,29 @@ class ImageReader(object):
     assert image.shape[2] == 3
     return image
 
+  def maybe_resize_jpeg(self, sess, image_data):
+    """Downsizes an image whose shorter side exceeds resize_shorter_side.
+
+    Images that are already small enough are returned untouched, so they do
+    not lose quality to a second JPEG encoding.
+
+    Args:
+      sess: The session used to run the resize.
+      image_data: The encoded image bytes.
+
+    Returns:
+      A (image_data, height, width) tuple of the image to store.
+    """
+    height, width = self.read_image_dims(sess, image_data)
+    if (not self._resize_shorter_side or
+        min(height, width) <= self._resize_shorter_side):
+      return image_data, height, width
+    self.num_resized += 1
+    image_data, (height, width) = sess.run(
+        [self._resize_jpeg, self._resized_size],
+        feed_dict={self._decode_jpeg_data: image_data})
+    return image_data, height, width
+
 
 # def _get_filenames_and_labels(dataset_dir):
 #   train_filenames = []
@@ -83,89 +279,522 @@ def _get_filenames_and_labels(dataset_dir: str):
 
 
 
-def _get_dataset_filename(dataset_dir, split_name, shard_id):
+def _get_dataset_filename(dataset_dir, split_name, shard_id, num_shards):
   output_filename = '%s_%05d-of-%05d.tfrecord' % (
-      split_name, shard_id, FLAGS.num_shards)
+      split_name, shard_id, num_shards)
   return os.path.join(dataset_dir, output_filename)
 
 
-def _convert_dataset(split_name, filenames, labels, dataset_dir):
-  """Converts the given filenames to a TFRecord dataset.
+def _get_sources_digest(filenames, labels, rows):
+  """Fingerprints the (filename, label, manifest row) list of a shard."""
+  sha = hashlib.sha1()
+  for filename, label, row in zip(filenames, labels, rows):
+    sha.update(('%s\t%d\t%d\n' % (filename, label, row)).encode('utf-8'))
+  return sha.hexdigest()
+
+
+def _interleave_classes(entries, rng):
+  """Interleaves the entries of every class in proportion to the class size.
+
+  The images of each class are shuffled and the k-th image of a class of n
+  images is placed at position (k + u) / n of the output, u being a random
+  jitter in [0, 1). Any contiguous slice of the result, a shard in
+  particular, therefore holds about the same fraction of every class, where
+  a plain round-robin would run out of the small classes first.
+
+  Args:
+    entries: A list of (filename, label, row) tuples.
+    rng: The `random.Random` used for the shuffles and the jitter.
+
+  Returns:
+    The interleaved list of entries.
+  """
+  entries_by_label = collections.defaultdict(list)
+  for entry in entries:
+    entries_by_label[entry[1]].append(entry)
+
+  keyed_entries = []
+  for label in sorted(entries_by_label):
+    class_entries = entries_by_label[label]
+    rng.shuffle(class_entries)
+    num_entries = float(len(class_entries))
+    for k, entry in enumerate(class_entries):
+      keyed_entries.append(((k + rng.random()) / num_entries, entry))
+  keyed_entries.sort(key=lambda keyed_entry: keyed_entry[0])
+  return [entry for _, entry in keyed_entries]
+
+
+def _get_shard_boundaries(filenames):
+  """Returns the [start, end) image ranges of the shards of a split.
+
+  Shards hold the same number of images, or, with `--shard_size_mb`, about
+  the same number of bytes. Byte balancing uses the size of the source files,
+  so shards of resized images are balanced on their pre-resize size.
+
+  Args:
+    filenames: The list of image paths of the split, in shard order.
+
+  Returns:
+    A list of (start, end) index tuples, one per shard.
+  """
+  if FLAGS.shard_size_mb <= 0:
+    num_per_shard = int(math.ceil(len(filenames) / float(FLAGS.num_shards)))
+    return [(shard_id * num_per_shard,
+             min((shard_id + 1) * num_per_shard, len(filenames)))
+            for shard_id in range(FLAGS.num_shards)]
+
+  target_bytes = FLAGS.shard_size_mb * (1 << 20)
+  boundaries = []
+  start_ndx = 0
+  shard_bytes = 0
+  for i, filename in enumerate(filenames):
+    shard_bytes += tf.gfile.Stat(filename).length
+    if shard_bytes >= target_bytes:
+      boundaries.append((start_ndx, i + 1))
+      start_ndx = i + 1
+      shard_bytes = 0
+  if start_ndx < len(filenames) or not boundaries:
+    boundaries.append((start_ndx, len(filenames)))
+  return boundaries
+
+
+def _convert_shard(spec, num_threads=0, show_progress=False):
+  """Writes a single TFRecord shard and its metadata file.
+
+  The shard gets its own graph and session, so it can run in a worker process
+  independently of every other shard. Records are written to a temporary file
+  which is renamed once complete, and the metadata file, which marks the shard
+  as complete, is written last.
+
+  Args:
+    spec: A `_ShardSpec` describing the images of the shard.
+    num_threads: The intra/inter op thread count of the decoding session, 0
+      lets TensorFlow pick.
+    show_progress: Whether to print a per-image progress line.
+
+  Returns:
+    A `_ShardResult` with the shard statistics.
+  """
+  start_time = time.time()
+  num_bytes_read = 0
+  record_crc32 = []
+  # (offset, length, label, manifest row) of every record in the shard.
+  index = []
+  offset = 0
+  session_config = tf.ConfigProto(
+      intra_op_parallelism_threads=num_threads,
+      inter_op_parallelism_threads=num_threads)
+  temp_filename = spec.output_filename + '.tmp'
+  temp_index_filename = (
+      spec.output_filename + dataset_utils.SHARD_INDEX_SUFFIX + '.tmp')
+
+  with tf.Graph().as_default():
+    resize = spec.resize or {}
+    image_reader = ImageReader(
+        spec.probe_image_headers,
+        resize_shorter_side=resize.get('shorter_side', 0),
+        jpeg_quality=resize.get('jpeg_quality', 90))
+
+    with tf.Session('', config=session_config) as sess:
+      with tf.python_io.TFRecordWriter(temp_filename) as tfrecord_writer:
+        for i, (filename, class_id, row) in enumerate(
+            zip(spec.filenames, spec.labels, spec.rows)):
+          if show_progress:
+            sys.stdout.write('\r>> Converting %s image %d/%d shard %d' % (
+                spec.split_name, i+1, len(spec.filenames), spec.shard_id))
+            sys.stdout.flush()
+
+          # Read the filename and label:
+          image_data = tf.gfile.FastGFile(filename, 'rb').read()
+          num_bytes_read += len(image_data)
+          image_data, height, width = image_reader.maybe_resize_jpeg(
+              sess, image_data)
+
+          example = dataset_utils.image_to_tfexample(
+              image_data, _image_format(image_data), height, width, class_id,
+              manifest_row=row)
+          serialized = example.SerializeToString()
+          record_crc32.append(zlib.crc32(serialized) & 0xffffffff)
+          index.append((offset, len(serialized), class_id, row))
+          offset += dataset_utils.tfrecord_frame_size(len(serialized))
+          tfrecord_writer.write(serialized)
+
+  dataset_utils.write_shard_index(temp_index_filename, index)
+  tf.gfile.Rename(temp_filename, spec.output_filename, overwrite=True)
+  tf.gfile.Rename(
+      temp_index_filename,
+      spec.output_filename + dataset_utils.SHARD_INDEX_SUFFIX,
+      overwrite=True)
+  num_bytes_written = tf.gfile.Stat(spec.output_filename).length
+  label_counts = collections.Counter(spec.labels)
+  dataset_utils.write_shard_metadata(spec.output_filename, {
+      'num_records': len(record_crc32),
+      'label_counts': {str(label): label_counts[label]
+                       for label in sorted(label_counts)},
+      'num_bytes': num_bytes_written,
+      'sources_digest': spec.sources_digest,
+      'resize': spec.resize,
+      'record_crc32': record_crc32,
+  })
+
+  return _ShardResult(
+      split_name=spec.split_name,
+      shard_id=spec.shard_id,
+      num_shards=spec.num_shards,
+      num_images=len(spec.filenames),
+      num_bytes_read=num_bytes_read,
+      num_bytes_written=num_bytes_written,
+      seconds=time.time() - start_time,
+      num_header_probed=image_reader.num_header_probed,
+      num_decoded=image_reader.num_decoded,
+      num_resized=image_reader.num_resized)
+
+
+def _convert_shard_in_worker(spec):
+  """Pool entry point, a worker converts with a single decoding thread."""
+  return _convert_shard(spec, num_threads=1)
+
+
+def _print_shard_result(result):
+  print('>> [%s] shard %d/%d: %d images, %.1f MB in %.1fs (%.1f images/s)' % (
+      result.split_name, result.shard_id + 1, result.num_shards,
+      result.num_images, result.num_bytes_written / float(1 << 20),
+      result.seconds, result.num_images / max(result.seconds, 1e-6)))
+
+
+def _get_shard_specs(split_name, filenames, labels, rows, dataset_dir):
+  """Splits the images of a dataset split into shards.
 
   Args:
     split_name: The name of the dataset, either 'train' or 'validation'.
     filenames: A list of absolute paths to png or jpg images.
     labels: A list of class ids (integers start with 0).
+    rows: A list with the row of each image in the split manifest.
     dataset_dir: The directory where the converted datasets are stored.
+
+  Returns:
+    A list of `_ShardSpec`, one per output shard.
   """
   assert split_name in ['train', 'validation']
 
-  num_per_shard = int(math.ceil(len(filenames) / float(FLAGS.num_shards)))
+  resize = None
+  if FLAGS.resize_shorter_side > 0:
+    resize = {'shorter_side': FLAGS.resize_shorter_side,
+              'jpeg_quality': FLAGS.jpeg_quality}
+
+  boundaries = _get_shard_boundaries(filenames)
+  num_shards = len(boundaries)
+
+  specs = []
+  for shard_id, (start_ndx, end_ndx) in enumerate(boundaries):
+    shard_filenames = list(filenames[start_ndx:end_ndx])
+    shard_labels = list(labels[start_ndx:end_ndx])
+    shard_rows = list(rows[start_ndx:end_ndx])
+    specs.append(_ShardSpec(
+        split_name=split_name,
+        shard_id=shard_id,
+        num_shards=num_shards,
+        output_filename=_get_dataset_filename(
+            dataset_dir, split_name, shard_id, num_shards),
+        filenames=shard_filenames,
+        labels=shard_labels,
+        rows=shard_rows,
+        sources_digest=_get_sources_digest(
+            shard_filenames, shard_labels, shard_rows),
+        probe_image_headers=FLAGS.probe_image_headers,
+        resize=resize))
+  return specs
+
+
+def _shard_is_complete(spec):
+  """Checks whether a shard was fully written from the same source images.
+
+  This is the cheap check done on every run: the metadata file must exist,
+  describe the same (filename, label) list and resize parameters, and match
+  the size of the shard, which catches shards truncated by an interrupted
+  run. Use `--verify` to check every record.
 
-  with tf.Graph().as_default():
-    image_reader = ImageReader()
+  Args:
+    spec: The `_ShardSpec` of the shard.
 
-    with tf.Session('') as sess:
+  Returns:
+    True if the shard can be kept as is.
+  """
+  if not tf.gfile.Exists(spec.output_filename):
+    return False
+  if not tf.gfile.Exists(
+      spec.output_filename + dataset_utils.SHARD_INDEX_SUFFIX):
+    return False
+  metadata = dataset_utils.read_shard_metadata(spec.output_filename)
+  if metadata is None:
+    return False
+  return (metadata.get('sources_digest') == spec.sources_digest and
+          metadata.get('resize') == spec.resize and
+          metadata.get('num_bytes') ==
+          tf.gfile.Stat(spec.output_filename).length)
+
+
+def _map_shards(fn, worker_fn, specs):
+  """Runs `fn` on every spec in process, or `worker_fn` on a process pool.
 
-      for shard_id in range(FLAGS.num_shards):
-        output_filename = _get_dataset_filename(
-            dataset_dir, split_name, shard_id)
+  Args:
+    fn: The function applied to each spec when `--num_workers` is 1.
+    worker_fn: The module level function applied to each spec in a worker.
+    specs: A list of `_ShardSpec`.
 
-        with tf.python_io.TFRecordWriter(output_filename) as tfrecord_writer:
-          start_ndx = shard_id * num_per_shard
-          end_ndx = min((shard_id+1) * num_per_shard, len(filenames))
-          for i in range(start_ndx, end_ndx):
-            sys.stdout.write('\r>> Converting %s image %d/%d shard %d' % (
-                split_name, i+1, len(filenames), shard_id))
-            sys.stdout.flush()
+  Yields:
+    The results, in completion order.
+  """
+  if FLAGS.num_workers <= 1:
+    for spec in specs:
+      yield fn(spec)
+    return
 
-            # Read the filename and label:
-            image_data = tf.gfile.FastGFile(filenames[i], 'rb').read()
-            height, width = image_reader.read_image_dims(sess, image_data)
-            class_id = labels[i]
+  # TensorFlow is not fork-safe once a session exists, so the workers are
+  # started from a fresh interpreter.
+  pool = multiprocessing.get_context('spawn').Pool(FLAGS.num_workers)
+  try:
+    for result in pool.imap_unordered(worker_fn, specs):
+      yield result
+  finally:
+    pool.close()
+    pool.join()
 
-            example = dataset_utils.image_to_tfexample(
-                image_data, b'jpg', height, width, class_id)
-            tfrecord_writer.write(example.SerializeToString())
 
-  sys.stdout.write('\n')
-  sys.stdout.flush()
+def _convert_shards(specs):
+  """Converts the given shards to TFRecords.
 
+  Shards are written one after another when `--num_workers` is 1 and spread
+  across a pool of `--num_workers` processes otherwise.
 
-def _dataset_exists(dataset_dir):
+  Args:
+    specs: A list of `_ShardSpec` to write.
+
+  Returns:
+    The list of `_ShardResult` of the written shards.
+  """
+  results = []
+  if FLAGS.num_workers <= 1:
+    convert_fn = lambda spec: _convert_shard(spec, show_progress=True)
+  else:
+    convert_fn = None
+  for result in _map_shards(convert_fn, _convert_shard_in_worker, specs):
+    if FLAGS.num_workers <= 1:
+      sys.stdout.write('\n')
+      sys.stdout.flush()
+    _print_shard_result(result)
+    results.append(result)
+  return results
+
+
+def _print_throughput(results, seconds):
+  """Prints the aggregated conversion throughput of all written shards."""
+  num_images = sum(result.num_images for result in results)
+  mb_read = sum(result.num_bytes_read for result in results) / float(1 << 20)
+  mb_written = sum(
+      result.num_bytes_written for result in results) / float(1 << 20)
+  seconds = max(seconds, 1e-6)
+  print('Converted %d images in %.1fs with %d worker(s): %.1f images/s, '
+        '%.1f MB/s read, %.1f MB/s written.' % (
+            num_images, seconds, max(FLAGS.num_workers, 1),
+            num_images / seconds, mb_read / seconds, mb_written / seconds))
+  print('Image dimensions: %d read from the header, %d fully decoded.' % (
+      sum(result.num_header_probed for result in results),
+      sum(result.num_decoded for result in results)))
+  if FLAGS.resize_shorter_side > 0:
+    print('Resized %d images to a shorter side of %d at JPEG quality %d.' % (
+        sum(result.num_resized for result in results),
+        FLAGS.resize_shorter_side, FLAGS.jpeg_quality))
+
+
+def _verify_shard(spec):
+  """Streams a shard and checks it against its metadata file.
+
+  Every record is read with `tf_record_iterator`, which validates the framing
+  CRCs of the TFRecord format, and the CRC32 of each serialized example is
+  compared with the one recorded at conversion time.
+
+  Args:
+    spec: The `_ShardSpec` of the shard.
+
+  Returns:
+    A (spec, error) tuple, error being None for a valid shard.
+  """
+  if not tf.gfile.Exists(spec.output_filename):
+    return spec, 'missing shard'
+  metadata = dataset_utils.read_shard_metadata(spec.output_filename)
+  if metadata is None:
+    return spec, 'missing metadata'
+  if metadata.get('sources_digest') != spec.sources_digest:
+    return spec, 'built from a different manifest'
+
+  expected_crc32 = metadata['record_crc32']
+  num_records = 0
+  try:
+    for record in tf.python_io.tf_record_iterator(spec.output_filename):
+      if (num_records >= len(expected_crc32) or
+          zlib.crc32(record) & 0xffffffff != expected_crc32[num_records]):
+        return spec, 'record %d does not match its CRC' % num_records
+      num_records += 1
+  except tf.errors.DataLossError as e:
+    return spec, 'corrupted after record %d: %s' % (num_records, e.message)
+  if num_records != metadata['num_records']:
+    return spec, '%d records, expected %d' % (
+        num_records, metadata['num_records'])
+  return spec, None
+
+
+def _verify_shards(specs):
+  """Verifies the given shards in parallel and invalidates broken ones.
+
+  Args:
+    specs: A list of `_ShardSpec` to check.
+
+  Returns:
+    The number of shards that failed the check.
+  """
+  num_failed = 0
+  for spec, error in _map_shards(_verify_shard, _verify_shard, specs):
+    if error is None:
+      print('>> [%s] shard %d/%d: OK' % (
+          spec.split_name, spec.shard_id + 1, spec.num_shards))
+      continue
+    num_failed += 1
+    print('>> [%s] shard %d/%d: FAILED, %s' % (
+        spec.split_name, spec.shard_id + 1, spec.num_shards, error))
+    # Drop the completion marker so that the next run rebuilds the shard.
+    dataset_utils.remove_shard_metadata(spec.output_filename)
+  return num_failed
+
+
+def _warn_about_stale_shards(dataset_dir, specs):
+  """Warns about shards of a previous, differently sharded conversion.
+
+  Readers glob every shard of a split, so such shards would be read twice.
+  """
+  expected = set(spec.output_filename for spec in specs)
   for split_name in ['train', 'validation']:
-    for shard_id in range(FLAGS.num_shards):
-      output_filename = _get_dataset_filename(
-          dataset_dir, split_name, shard_id)
-      if not tf.gfile.Exists(output_filename):
-        return False
-  return True
+    pattern = os.path.join(dataset_dir, '%s_*.tfrecord' % split_name)
+    for shard in sorted(tf.gfile.Glob(pattern)):
+      if shard not in expected:
+        print('WARNING: %s is not part of this conversion, remove it before '
+              'training.' % shard)
+
+
+def _get_labels_to_taxa(specs):
+  """Maps every label to the taxonomic class of its images.
+
+  dataset_builder lays the images out as <class>/<species>/<image>, so the
+  class of an image is the name of its grandparent directory.
+
+  Args:
+    specs: The `_ShardSpec` of every shard of the dataset.
+
+  Returns:
+    A dict from the label, as a string, to the name of its class, or an empty
+    dict when the images are not laid out under the classes of `CLASS_LIST`.
+  """
+  labels_to_classes = collections.defaultdict(set)
+  for spec in specs:
+    for filename, label in zip(spec.filenames, spec.labels):
+      labels_to_classes[label].add(
+          os.path.basename(os.path.dirname(os.path.dirname(filename))))
+  if not all(classes <= set(CLASS_LIST)
+             for classes in labels_to_classes.values()):
+    return {}
+  return {str(label): classes.pop() if len(classes) == 1 else _MIXED_TAXON
+          for label, classes in labels_to_classes.items()}
+
+
+def _write_dataset_metadata(dataset_dir, specs):
+  """Writes the dataset metadata sidecar read by `fgvc.get_split`.
+
+  Args:
+    dataset_dir: The directory of the converted dataset.
+    specs: The `_ShardSpec` of every shard of the dataset.
+  """
+  num_samples = {'train': 0, 'validation': 0}
+  shards = {'train': [], 'validation': []}
+  labels = set()
+  for spec in specs:
+    num_samples[spec.split_name] += len(spec.filenames)
+    shards[spec.split_name].append(os.path.basename(spec.output_filename))
+    labels.update(spec.labels)
+
+  labels_to_names = {}
+  species_labels_path = os.path.join(dataset_dir, _SPECIES_LABELS_FILENAME)
+  if tf.gfile.Exists(species_labels_path):
+    with tf.gfile.Open(species_labels_path, 'r') as f:
+      labels_to_names = {str(label): name
+                         for label, name in json.loads(f.read()).items()}
+
+  dataset_utils.write_dataset_metadata(dataset_dir, {
+      'dataset_name': FLAGS.dataset_name,
+      'num_samples': num_samples,
+      'num_classes': max(len(labels_to_names), max(labels) + 1),
+      'labels_to_names': labels_to_names,
+      'labels_to_taxa': _get_labels_to_taxa(specs),
+      'shards': shards,
+      'resize': specs[0].resize,
+      'interleave_classes': FLAGS.interleave_classes,
+  })
 
 
 def run(dataset_dir):
   """Runs the conversion operation.
 
+  Only shards that are missing or incomplete are (re)built, so an interrupted
+  conversion picks up where it stopped.
+
   Args:
     dataset_dir: The dataset directory where the dataset is stored.
   """
   if not tf.gfile.Exists(dataset_dir):
     tf.gfile.MakeDirs(dataset_dir)
 
-  if _dataset_exists(dataset_dir):
-    print('Dataset files already exist. Exiting without re-creating them.')
-    return
-
   train_filenames, val_filenames, train_labels, val_labels = \
       _get_filenames_and_labels(dataset_dir)
 
-  train_idx = list(zip(train_filenames, train_labels))
-  random.shuffle(train_idx)
-  train_filenames, train_labels = zip(*train_idx)
+  rng = random.Random(FLAGS.random_seed)
+  train_idx = list(zip(train_filenames, train_labels,
+                       range(len(train_filenames))))
+  val_idx = list(zip(val_filenames, val_labels, range(len(val_filenames))))
+  if FLAGS.interleave_classes:
+    train_idx = _interleave_classes(train_idx, rng)
+    val_idx = _interleave_classes(val_idx, rng)
+  else:
+    rng.shuffle(train_idx)
+  train_filenames, train_labels, train_rows = zip(*train_idx)
+  val_filenames, val_labels, val_rows = zip(*val_idx)
+
+  specs = (_get_shard_specs('train', train_filenames, train_labels,
+                            train_rows, dataset_dir) +
+           _get_shard_specs('validation', val_filenames, val_labels,
+                            val_rows, dataset_dir))
+
+  if FLAGS.verify:
+    num_failed = _verify_shards(specs)
+    print('\n%d/%d shards failed verification.' % (num_failed, len(specs)))
+    return
+
+  _warn_about_stale_shards(dataset_dir, specs)
+
+  pending_specs = [spec for spec in specs if not _shard_is_complete(spec)]
+  if not pending_specs:
+    print('Dataset files already exist. Exiting without re-creating them.')
+    _write_dataset_metadata(dataset_dir, specs)
+    return
+  if len(pending_specs) < len(specs):
+    print('Resuming: %d/%d shards are already complete.' % (
+        len(specs) - len(pending_specs), len(specs)))
+
+  start_time = time.time()
+  results = _convert_shards(pending_specs)
 
-  _convert_dataset('train', train_filenames, train_labels, dataset_dir)
-  _convert_dataset('validation', val_filenames, val_labels, dataset_dir)
+  _write_dataset_metadata(dataset_dir, specs)
 
   print('\nFinished converting the dataset!')
+  _print_throughput(results, time.time() - start_time)
 
 
 def main(_):
@@ -0,0 +1,115 @@
+"""Tests for convert_dataset.py, run from the root of the repository."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import random
+import struct
+import numpy as np
+import tensorflow as tf
+
+import convert_dataset
+
+_HEIGHT = 24
+
+_WIDTH = 40
+
+
+def _encode_images():
+  """Returns a baseline JPEG, a progressive JPEG and a PNG of one image."""
+  with tf.Graph().as_default(), tf.Session() as sess:
+    image = tf.constant(
+        np.random.randint(0, 255, [_HEIGHT, _WIDTH, 3]).astype(np.uint8))
+    return sess.run([tf.image.encode_jpeg(image),
+                     tf.image.encode_jpeg(image, progressive=True),
+                     tf.image.encode_png(image)])
+
+
+def _insert_segment(jpeg_data, marker, payload):
+  """Inserts a marker segment right after the SOI marker of a JPEG."""
+  segment = (b'\xff' + bytes([marker]) +
+             struct.pack('>H', len(payload) + 2) + payload)
+  return jpeg_data[:2] + segment + jpeg_data[2:]
+
+
+class ImageHeaderTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(ImageHeaderTest, self).setUp()
+    self._jpeg_data, self._progressive_data, self._png_data = _encode_images()
+
+  def testBaselineJpeg(self):
+    self.assertEqual(convert_dataset._read_jpeg_header_dims(self._jpeg_data),
+                     (_HEIGHT, _WIDTH))
+    self.assertIsNone(convert_dataset._read_png_header_dims(self._jpeg_data))
+
+  def testProgressiveJpeg(self):
+    self.assertIn(b'\xff\xc2', self._progressive_data)
+    self.assertEqual(
+        convert_dataset._read_jpeg_header_dims(self._progressive_data),
+        (_HEIGHT, _WIDTH))
+
+  def testJpegWithApplicationSegmentsBeforeTheFrame(self):
+    jpeg_data = _insert_segment(self._jpeg_data, 0xE1,
+                                b'Exif\x00\x00' + b'\xff\xc0' * 16)
+    jpeg_data = _insert_segment(jpeg_data, 0xED, b'Photoshop 3.0\x00')
+    self.assertEqual(convert_dataset._read_jpeg_header_dims(jpeg_data),
+                     (_HEIGHT, _WIDTH))
+
+  def testPng(self):
+    self.assertEqual(convert_dataset._read_png_header_dims(self._png_data),
+                     (_HEIGHT, _WIDTH))
+    self.assertIsNone(convert_dataset._read_jpeg_header_dims(self._png_data))
+
+  def testTruncatedImagesAreLeftToTheDecoder(self):
+    frame_end = self._jpeg_data.index(b'\xff\xc0') + 9
+    for size in range(frame_end):
+      self.assertIsNone(
+          convert_dataset._read_jpeg_header_dims(self._jpeg_data[:size]))
+    # The dimensions of a JPEG truncated in its scan data are still read.
+    self.assertEqual(
+        convert_dataset._read_jpeg_header_dims(self._jpeg_data[:frame_end]),
+        (_HEIGHT, _WIDTH))
+    for size in range(24):
+      self.assertIsNone(
+          convert_dataset._read_png_header_dims(self._png_data[:size]))
+
+  def testImageReaderProbesOrDecodes(self):
+    probing_reader = convert_dataset.ImageReader()
+    decoding_reader = convert_dataset.ImageReader(probe_image_headers=False)
+    with self.test_session() as sess:
+      for image_data in [self._jpeg_data, self._progressive_data]:
+        self.assertEqual(probing_reader.read_image_dims(sess, image_data),
+                         (_HEIGHT, _WIDTH))
+        self.assertEqual(decoding_reader.read_image_dims(sess, image_data),
+                         (_HEIGHT, _WIDTH))
+    self.assertEqual((probing_reader.num_header_probed,
+                      probing_reader.num_decoded), (2, 0))
+    self.assertEqual((decoding_reader.num_header_probed,
+                      decoding_reader.num_decoded), (0, 2))
+
+
+class InterleaveClassesTest(tf.test.TestCase):
+
+  def testShardsHoldTheClassProportions(self):
+    class_sizes = [50, 30, 15, 5]
+    entries = [('image_%d.jpg' % row, label, row) for row, label in enumerate(
+        label for label, size in enumerate(class_sizes) for _ in range(size))]
+    num_shards = 10
+    shard_size = len(entries) // num_shards
+    for seed in range(10):
+      interleaved = convert_dataset._interleave_classes(
+          list(entries), random.Random(seed))
+      self.assertEqual(sorted(interleaved), sorted(entries))
+      for start in range(0, len(entries), shard_size):
+        histogram = collections.Counter(
+            label for _, label, _ in interleaved[start:start + shard_size])
+        for label, size in enumerate(class_sizes):
+          self.assertNear(histogram[label],
+                          shard_size * size / float(len(entries)), 1.)
+
+
+if __name__ == '__main__':
+  tf.test.main()
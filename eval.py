@@ -19,14 +19,21 @@ from __future__ import division
 from __future__ import print_function
 import warnings
 warnings.filterwarnings('ignore')
+import functools
 import math
+import os
 import sys
 import tensorflow as tf
 
 sys.path.insert(0, './slim/')
+import checkpoint_tools
 from datasets import dataset_factory_fgvc
+from datasets import fgvc
+from nets import hierarchical_head
+from nets import inception_utils
 from nets import nets_factory
 from preprocessing import preprocessing_factory
+import training_hooks
 
 slim = tf.contrib.slim
 
@@ -61,6 +68,17 @@ tf.app.flags.DEFINE_string(
 tf.app.flags.DEFINE_string(
     'dataset_dir', './data/', 'The directory where the dataset files are stored.')
 
+tf.app.flags.DEFINE_string(
+    'input_backend', 'queue',
+    'The input pipeline, either "queue" for the queue-runner '
+    'DatasetDataProvider or "tf_data" for a tf.data pipeline.')
+
+tf.app.flags.DEFINE_boolean(
+    'dct_scaled_decode', False,
+    'Whether to decode JPEG images at 1/2, 1/4 or 1/8 of their resolution when '
+    'they are large enough. Requires --input_backend=tf_data and the '
+    'inception preprocessing.')
+
 tf.app.flags.DEFINE_integer(
     'labels_offset', 0,
     'An offset for the labels in the dataset. This flag is primarily used to '
@@ -70,6 +88,21 @@ tf.app.flags.DEFINE_integer(
 tf.app.flags.DEFINE_string(
     'model_name', 'inception_v3', 'The name of the architecture to evaluate.')
 
+tf.app.flags.DEFINE_boolean(
+    'hierarchical_head', False,
+    'Whether the model was trained with --hierarchical_head. The accuracy of '
+    'the predicted taxa is then also reported.')
+
+tf.app.flags.DEFINE_integer(
+    'top_k_groups', 0,
+    'With --hierarchical_head, the number of most likely taxa of every image '
+    'whose species are computed, or 0 for all of them.')
+
+tf.app.flags.DEFINE_string(
+    'channel_config', None,
+    'The channel_config.json written by structured_prune.py next to a pruned '
+    'inception checkpoint.')
+
 tf.app.flags.DEFINE_string(
     'preprocessing_name', None, 'The name of the preprocessing to use. If left '
     'as `None`, then the model_name flag is used.')
@@ -85,6 +118,30 @@ tf.app.flags.DEFINE_integer(
 tf.app.flags.DEFINE_bool(
     'quantize', False, 'whether to use quantized graph or not.')
 
+tf.app.flags.DEFINE_integer(
+    'profile_every_n_steps', 0,
+    'If positive, every n-th step is traced with a full trace. The traces are '
+    'written as Chrome timelines next to a table of the op times in '
+    '--profile_dir.')
+
+tf.app.flags.DEFINE_integer(
+    'profile_start_step', 0,
+    'The first step, counted from the start of the process, of a window of '
+    '--profile_num_steps traced steps.')
+
+tf.app.flags.DEFINE_integer(
+    'profile_num_steps', 0, 'The number of steps of the traced window.')
+
+tf.app.flags.DEFINE_string(
+    'profile_scopes', None,
+    'Comma-separated list of fnmatch patterns of op names whose time is '
+    'aggregated in the profile, e.g. "InceptionV3/Mixed_6*,*/Logits/*".')
+
+tf.app.flags.DEFINE_string(
+    'profile_dir', None,
+    'Directory of the profile. Defaults to the profile/ subdirectory of '
+    'the eval_dir.')
+
 tf.app.flags.DEFINE_integer(
     'eval_interval_secs', 60, 'Evaluation frequency, in seconds.')
 
@@ -108,44 +165,75 @@ def main(_):
     ####################
     # Select the model #
     ####################
+    label_groups = None
+    if FLAGS.hierarchical_head:
+      label_groups, _ = hierarchical_head.get_label_groups(
+          dataset.labels_to_taxa, dataset.num_classes - FLAGS.labels_offset,
+          FLAGS.labels_offset)
     network_fn = nets_factory.get_network_fn(
         FLAGS.model_name,
         num_classes=(dataset.num_classes - FLAGS.labels_offset),
-        is_training=False)
-
-    ##############################################################
-    # Create a dataset provider that loads data from the dataset #
-    ##############################################################
-    provider = slim.dataset_data_provider.DatasetDataProvider(
-        dataset,
-        shuffle=False,
-        common_queue_capacity=2 * FLAGS.batch_size,
-        common_queue_min=FLAGS.batch_size)
-    [image, label] = provider.get(['image', 'label'])
-    label -= FLAGS.labels_offset
+        is_training=False,
+        label_groups=label_groups,
+        top_k_groups=FLAGS.top_k_groups,
+        channel_config=(
+            inception_utils.read_channel_config(FLAGS.channel_config)
+            if FLAGS.channel_config else None))
 
     #####################################
     # Select the preprocessing function #
     #####################################
     preprocessing_name = FLAGS.preprocessing_name or FLAGS.model_name
-    image_preprocessing_fn = preprocessing_factory.get_preprocessing(
-        preprocessing_name,
-        is_training=False)
+    if FLAGS.dct_scaled_decode:
+      if FLAGS.input_backend != 'tf_data':
+        raise ValueError('--dct_scaled_decode requires --input_backend=tf_data')
+      image_preprocessing_fn = functools.partial(
+          preprocessing_factory.get_encoded_preprocessing(
+              preprocessing_name, is_training=False),
+          dct_scaled_decode=True)
+    else:
+      image_preprocessing_fn = preprocessing_factory.get_preprocessing(
+          preprocessing_name,
+          is_training=False)
 
     eval_image_size = FLAGS.eval_image_size or network_fn.default_image_size
 
-    image = image_preprocessing_fn(image, eval_image_size, eval_image_size)
-
-    images, labels = tf.train.batch(
-        [image, label],
-        batch_size=FLAGS.batch_size,
-        num_threads=FLAGS.num_preprocessing_threads,
-        capacity=5 * FLAGS.batch_size)
+    ##############################################################
+    # Create a dataset provider that loads data from the dataset #
+    ##############################################################
+    if FLAGS.input_backend == 'queue':
+      provider = slim.dataset_data_provider.DatasetDataProvider(
+          dataset,
+          shuffle=False,
+          common_queue_capacity=2 * FLAGS.batch_size,
+          common_queue_min=FLAGS.batch_size)
+      [image, label] = provider.get(['image', 'label'])
+      label -= FLAGS.labels_offset
+
+      image = image_preprocessing_fn(image, eval_image_size, eval_image_size)
+
+      images, labels = tf.train.batch(
+          [image, label],
+          batch_size=FLAGS.batch_size,
+          num_threads=FLAGS.num_preprocessing_threads,
+          capacity=5 * FLAGS.batch_size)
+    elif FLAGS.input_backend == 'tf_data':
+      batches = fgvc.get_batched_dataset(
+          dataset, image_preprocessing_fn, eval_image_size, FLAGS.batch_size,
+          is_training=False,
+          num_readers=1,
+          num_preprocessing_threads=FLAGS.num_preprocessing_threads,
+          labels_offset=FLAGS.labels_offset,
+          preprocess_encoded=FLAGS.dct_scaled_decode)
+      images, labels = batches.make_one_shot_iterator().get_next()
+    else:
+      raise ValueError('Input backend [%s] was not recognized' %
+                       FLAGS.input_backend)
 
     ####################
     # Define the model #
     ####################
-    logits, _ = network_fn(images)
+    logits, end_points = network_fn(images)
 
     if FLAGS.quantize:
       tf.contrib.quantize.create_eval_graph()
@@ -173,14 +261,20 @@ def main(_):
     # f1_update = tf.group(precision_update, recall_update)
 
     # Define the metrics:
-    names_to_values, names_to_updates = slim.metrics.aggregate_metric_map({
+    metric_map = {
         'Accuracy': slim.metrics.streaming_accuracy(predictions, labels),
         'Recall_5': slim.metrics.streaming_recall_at_k(logits, labels, 5),
         # 'Precision': (precision, precision_update),
         # 'Recall': (recall, recall_update),
         # 'F1-Score': (f1_score, f1_update)
         'F1-Score': (f1_score, f1_update)
-    })
+    }
+    if label_groups is not None:
+      metric_map['Group_Accuracy'] = slim.metrics.streaming_accuracy(
+          tf.argmax(end_points['GroupLogits'], 1),
+          tf.gather(tf.constant(label_groups, dtype=tf.int64), labels))
+    names_to_values, names_to_updates = slim.metrics.aggregate_metric_map(
+        metric_map)
 
     # Print the summaries to screen.
     summary_ops = []
@@ -204,11 +298,24 @@ def main(_):
       checkpoint_path = FLAGS.checkpoint_path
 
     tf.logging.info('Evaluating %s' % checkpoint_path)
+    # Incremental checkpoints read their frozen variables from their base.
+    variables_to_restore = checkpoint_tools.setup_incremental_restore(
+        variables_to_restore, FLAGS.checkpoint_path)
 
     # Allocate only as much GPU memory based on runtime allocations.
     session_config = tf.ConfigProto()
     session_config.gpu_options.allow_growth = True
 
+    hooks = []
+    if FLAGS.profile_every_n_steps > 0 or FLAGS.profile_num_steps > 0:
+      hooks.append(training_hooks.ProfilerHook(
+          FLAGS.profile_dir or os.path.join(FLAGS.eval_dir, 'profile'),
+          every_n_steps=FLAGS.profile_every_n_steps,
+          start_step=FLAGS.profile_start_step,
+          num_steps=FLAGS.profile_num_steps,
+          scope_patterns=(FLAGS.profile_scopes.split(',')
+                          if FLAGS.profile_scopes else None)))
+
     slim.evaluation.evaluation_loop(
         master=FLAGS.master,
         checkpoint_dir=FLAGS.checkpoint_path,
@@ -218,7 +325,8 @@ def main(_):
         variables_to_restore=variables_to_restore,
         summary_op=tf.summary.merge(summary_ops),
         eval_interval_secs=FLAGS.eval_interval_secs,
-        session_config=session_config)
+        session_config=session_config,
+        hooks=hooks)
 
 
 if __name__ == '__main__':
@@ -27,7 +27,9 @@ from tensorflow.saved_model import builder as saved_model_builder
 from tensorflow.saved_model import tag_constants, signature_constants, signature_def_utils
 
 sys.path.insert(0, './slim/')
+import checkpoint_tools
 from datasets import dataset_factory_fgvc
+from nets import inception_utils
 from nets import nets_factory
 from preprocessing import preprocessing_factory
 
@@ -88,6 +90,11 @@ tf.app.flags.DEFINE_integer(
 tf.app.flags.DEFINE_bool(
     'quantize', False, 'whether to use quantized graph or not.')
 
+tf.app.flags.DEFINE_string(
+    'channel_config', None,
+    'The channel_config.json written by structured_prune.py next to a pruned '
+    'inception checkpoint.')
+
 tf.app.flags.DEFINE_integer(
     'eval_interval_secs', 60, 'Evaluation frequency, in seconds.')
 
@@ -114,7 +121,10 @@ def main(_):
     network_fn = nets_factory.get_network_fn(
         FLAGS.model_name,
         num_classes=(dataset.num_classes - FLAGS.labels_offset),
-        is_training=False)
+        is_training=False,
+        channel_config=(
+            inception_utils.read_channel_config(FLAGS.channel_config)
+            if FLAGS.channel_config else None))
 
     ##############################################################
     # Create a dataset provider that loads data from the dataset #
@@ -173,12 +183,8 @@ def main(_):
     with tf.Session() as sess:
         sess.run(tf.global_variables_initializer())
         sess.run(tf.local_variables_initializer())
-        if tf.gfile.IsDirectory(FLAGS.checkpoint_path):
-            checkpoint_path = tf.train.latest_checkpoint(FLAGS.checkpoint_path)
-        else:
-            checkpoint_path = FLAGS.checkpoint_path
-        saver = tf.train.Saver(variables_to_restore)
-        saver.restore(sess, checkpoint_path)
+        checkpoint_tools.restore(sess, variables_to_restore,
+                                 FLAGS.checkpoint_path)
 
         export_dir = "saved_model_tf1"
         builder = saved_model_builder.SavedModelBuilder(export_dir)
@@ -35,6 +35,9 @@ checkpoints_path = './checkpoints/inception/inception_v4_iNat_448_FT_560.ckpt'
 
 image_size = 299
 moving_average_decay = 0.9999
+# Decode large JPEG images at 1/2, 1/4 or 1/8 of their resolution, as long as
+# the central crop stays larger than image_size.
+dct_scaled_decode = False
 
 if base_network == 'InceptionV4':
     fea_dim = 1536
@@ -84,7 +87,12 @@ label_val = np.zeros((len(val_list), ), dtype=np.int32)
 with tf.Graph().as_default():
     tf_global_step = tf.train.get_or_create_global_step()
     image_path = tf.placeholder(tf.string)
-    image = tf.image.decode_jpeg(tf.read_file(image_path), channels=3)
+    image_buffer = tf.read_file(image_path)
+    if dct_scaled_decode:
+        image = inception_preprocessing.decode_jpeg_for_eval(
+            image_buffer, image_size, image_size)
+    else:
+        image = tf.image.decode_jpeg(image_buffer, channels=3)
     image = tf.image.convert_image_dtype(image, tf.float32)
     image = inception_preprocessing.preprocess_image(image,
                                                      image_size,
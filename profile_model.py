@@ -0,0 +1,261 @@
+"""Profiles the parameters, compute and memory of a network, scope by scope.
+
+Builds any network of nets_factory for inference on a batch of images and
+reports, for every variable scope down to --scope_depth components, e.g. the
+Mixed_* blocks of the inception networks with the default depth of 2:
+
+  - the bytes of the parameters read to compute the logits,
+  - the multiply-adds of the convolutions and fully connected layers,
+  - the bytes of the activations computed by the ops of the scope,
+  - an estimate of the peak memory of the activations while the scope runs,
+    when the ops are run one at a time in the order of the graph and every
+    activation is freed after its last use,
+  - with --measure_latency, the CPU time of the ops of the scope.
+
+python profile_model.py --model_name=inception_v3 --image_size=299 \
+    --batch_size=1 --measure_latency
+
+It replaces the shapes dumped by hand in model_size.txt, and shows the cost of
+the pruned networks with --channel_config and of the squeeze-and-excitation
+variants, e.g. --model_name=inception_v3_se.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import warnings
+warnings.filterwarnings('ignore')
+import collections
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+
+sys.path.insert(0, './slim/')
+from nets import inception_utils
+from nets import nets_factory
+
+tf.app.flags.DEFINE_string(
+    'model_name', 'inception_v3', 'The name of the architecture to profile.')
+
+tf.app.flags.DEFINE_integer(
+    'num_classes', 1000, 'The number of classes of the logits.')
+
+tf.app.flags.DEFINE_integer(
+    'image_size', None,
+    'The height and width of the images. Defaults to the network default.')
+
+tf.app.flags.DEFINE_integer(
+    'batch_size', 1, 'The number of images of the profiled batch.')
+
+tf.app.flags.DEFINE_string(
+    'channel_config', None,
+    'The channel_config.json of a network pruned by structured_prune.py.')
+
+tf.app.flags.DEFINE_integer(
+    'scope_depth', 2,
+    'The number of components of the op names the statistics are grouped by.')
+
+tf.app.flags.DEFINE_boolean(
+    'measure_latency', False,
+    'Whether to measure the CPU time of every scope. The ops are run one at a '
+    'time so that the times of the scopes add up to the latency.')
+
+tf.app.flags.DEFINE_integer(
+    'latency_runs', 20,
+    'The number of timed inferences of the latency, after 5 warmup ones.')
+
+tf.app.flags.DEFINE_string(
+    'output_csv', None, 'If set, the table is also written to this CSV file.')
+
+FLAGS = tf.app.flags.FLAGS
+
+# The statistics of the ops of a scope.
+ScopeProfile = collections.namedtuple(
+    'ScopeProfile', ['parameter_bytes', 'multiply_adds', 'activation_bytes',
+                     'peak_bytes'])
+
+
+def _scope(name):
+  """Returns the scope of an op or variable name, down to --scope_depth."""
+  components = name.split('/')
+  # The op names of the inception networks repeat the network scope, e.g.
+  # InceptionV3/InceptionV3/Mixed_5b/..., unlike the names of their variables.
+  if len(components) > 1 and components[0] == components[1]:
+    components = components[1:]
+  return '/'.join(components[:FLAGS.scope_depth])
+
+
+def _num_bytes(tensor):
+  if tensor.dtype.base_dtype == tf.resource:
+    return 0
+  # The shapes of the activations are static, except for a few small ones.
+  return (tensor.shape.num_elements() or 0) * tensor.dtype.base_dtype.size
+
+
+def _multiply_adds(op):
+  """Returns the multiply-adds of a convolution or matmul op, else 0."""
+  if op.type == 'Conv2D':
+    kernel_shape = op.inputs[1].shape.as_list()
+    return op.outputs[0].shape.num_elements() * int(np.prod(kernel_shape[:3]))
+  if op.type == 'DepthwiseConv2dNative':
+    kernel_shape = op.inputs[1].shape.as_list()
+    return op.outputs[0].shape.num_elements() * int(np.prod(kernel_shape[:2]))
+  if op.type == 'MatMul':
+    transpose_a = op.get_attr('transpose_a')
+    return (op.outputs[0].shape.num_elements() *
+            op.inputs[0].shape[0 if transpose_a else 1].value)
+  return 0
+
+
+def _get_inference_ops(inputs, outputs):
+  """Returns the ops between `inputs` and `outputs`, in the graph order.
+
+  Returns:
+    ops: The list of the ops depending on `inputs` and computing `outputs`.
+    dependencies: The set of all the ops `outputs` depends on, including the
+      variables.
+  """
+  dependencies = set()
+  stack = [outputs.op]
+  while stack:
+    op = stack.pop()
+    if op not in dependencies:
+      dependencies.add(op)
+      stack.extend(tensor.op for tensor in op.inputs)
+  dependents = set()
+  stack = [inputs.op]
+  while stack:
+    op = stack.pop()
+    if op not in dependents:
+      dependents.add(op)
+      stack.extend(consumer for tensor in op.outputs
+                   for consumer in tensor.consumers())
+  ops = [op for op in inputs.graph.get_operations()
+         if op in dependencies and op in dependents]
+  return ops, dependencies
+
+
+def _get_profiles(inputs, outputs):
+  """Returns a dict from the scopes to their `ScopeProfile`, in order."""
+  ops, dependencies = _get_inference_ops(inputs, outputs)
+  parameter_bytes = collections.Counter()
+  for variable in tf.global_variables():
+    if variable.op in dependencies:
+      parameter_bytes[_scope(variable.op.name)] += (
+          variable.shape.num_elements() * variable.dtype.base_dtype.size)
+
+  # The index of the last op reading every activation.
+  positions = {op: position for position, op in enumerate(ops)}
+  last_uses = {}
+  for op in ops:
+    for tensor in op.outputs:
+      last_uses[tensor] = max([positions[consumer]
+                               for consumer in tensor.consumers()
+                               if consumer in positions] or [len(ops)])
+  frees = collections.defaultdict(list)
+  for tensor, last_use in last_uses.items():
+    frees[last_use].append(tensor)
+
+  profiles = collections.OrderedDict()
+  live_bytes = 0
+  for position, op in enumerate(ops):
+    scope = _scope(op.name)
+    output_bytes = sum(_num_bytes(tensor) for tensor in op.outputs)
+    live_bytes += output_bytes
+    profile = profiles.get(scope, ScopeProfile(parameter_bytes[scope], 0, 0, 0))
+    profiles[scope] = ScopeProfile(
+        profile.parameter_bytes,
+        profile.multiply_adds + _multiply_adds(op),
+        profile.activation_bytes + output_bytes,
+        max(profile.peak_bytes, live_bytes))
+    live_bytes -= sum(_num_bytes(tensor) for tensor in frees[position])
+  for scope in parameter_bytes:
+    if scope not in profiles:
+      profiles[scope] = ScopeProfile(parameter_bytes[scope], 0, 0, 0)
+  return profiles
+
+
+def _measure_latencies(inputs, outputs):
+  """Returns the median CPU time of the ops of every scope, and in total."""
+  config = tf.ConfigProto(device_count={'GPU': 0},
+                          inter_op_parallelism_threads=1)
+  images = np.random.rand(*inputs.shape.as_list()).astype(np.float32)
+  run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+  scope_micros = collections.defaultdict(list)
+  latencies = []
+  with tf.Session(config=config) as sess:
+    sess.run(tf.global_variables_initializer())
+    for _ in range(5):
+      sess.run(outputs, {inputs: images})
+    for _ in range(FLAGS.latency_runs):
+      start_time = time.time()
+      sess.run(outputs, {inputs: images})
+      latencies.append(time.time() - start_time)
+      run_metadata = tf.RunMetadata()
+      sess.run(outputs, {inputs: images}, options=run_options,
+               run_metadata=run_metadata)
+      micros = collections.Counter()
+      for device_stats in run_metadata.step_stats.dev_stats:
+        for node_stats in device_stats.node_stats:
+          micros[_scope(node_stats.node_name)] += (
+              node_stats.all_end_rel_micros)
+      for scope, scope_time in micros.items():
+        scope_micros[scope].append(scope_time)
+  return ({scope: np.median(times) / 1000.
+           for scope, times in scope_micros.items()},
+          1000 * np.median(latencies))
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+  network_fn = nets_factory.get_network_fn(
+      FLAGS.model_name, FLAGS.num_classes, is_training=False,
+      channel_config=(
+          inception_utils.read_channel_config(FLAGS.channel_config)
+          if FLAGS.channel_config else None))
+  image_size = FLAGS.image_size or network_fn.default_image_size
+
+  with tf.Graph().as_default():
+    inputs = tf.placeholder(tf.float32,
+                            [FLAGS.batch_size, image_size, image_size, 3],
+                            name='input')
+    logits, _ = network_fn(inputs)
+    profiles = _get_profiles(inputs, logits)
+    latencies, total_latency = {}, None
+    if FLAGS.measure_latency:
+      latencies, total_latency = _measure_latencies(inputs, logits)
+
+  header = ['scope', 'parameters (MB)', 'GMACs', 'activations (MB)',
+            'peak (MB)']
+  if FLAGS.measure_latency:
+    header.append('CPU time (ms)')
+  rows = []
+  for scope, profile in profiles.items():
+    rows.append([scope, profile.parameter_bytes / 2.**20,
+                 profile.multiply_adds / 1e9,
+                 profile.activation_bytes / 2.**20,
+                 profile.peak_bytes / 2.**20] +
+                ([latencies.get(scope, 0.)] if FLAGS.measure_latency else []))
+  total = [
+      'total', sum(row[1] for row in rows), sum(row[2] for row in rows),
+      sum(row[3] for row in rows), max(row[4] for row in rows)] + (
+          [total_latency] if FLAGS.measure_latency else [])
+
+  print('%s at %dx%d, batch of %d' % (FLAGS.model_name, image_size,
+                                       image_size, FLAGS.batch_size))
+  print('%-40s' % header[0] + ''.join(' %16s' % name for name in header[1:]))
+  for row in rows + [total]:
+    print('%-40s' % row[0] + ''.join(' %16.3f' % value for value in row[1:]))
+  print('The estimated peak memory of the inference is %.1f MB of parameters '
+        'and %.1f MB of activations' % (total[1], total[4]))
+  if FLAGS.output_csv:
+    with tf.gfile.Open(FLAGS.output_csv, 'w') as f:
+      f.write(','.join(header) + '\n')
+      for row in rows + [total]:
+        f.write(','.join([row[0]] + ['%g' % value for value in row[1:]]) +
+                '\n')
+
+
+if __name__ == '__main__':
+  tf.app.run()
@@ -0,0 +1,37 @@
+"""Tests for profile_model.py, run from the root of the repository."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+from absl.testing import flagsaver
+
+import profile_model
+from nets import inception
+
+
+class ProfileModelTest(tf.test.TestCase):
+
+  def testInceptionV3BlocksHaveTheirCompute(self):
+    with tf.Graph().as_default():
+      inputs = tf.placeholder(tf.float32, [1, 299, 299, 3])
+      logits, _ = inception.inception_v3(inputs, num_classes=10,
+                                         is_training=False)
+      with flagsaver.flagsaver(scope_depth=2):
+        profiles = profile_model._get_profiles(inputs, logits)
+
+    self.assertNotIn('InceptionV3/InceptionV3', profiles)
+    for block in ['Conv2d_1a_3x3', 'Mixed_5b', 'Mixed_6e', 'Mixed_7c',
+                  'Logits']:
+      profile = profiles['InceptionV3/%s' % block]
+      self.assertGreater(profile.multiply_adds, 0)
+      self.assertGreater(profile.parameter_bytes, 0)
+      self.assertGreater(profile.activation_bytes, 0)
+    # The auxiliary logits are not computed by the inference.
+    self.assertNotIn('InceptionV3/AuxLogits', profiles)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -1,32 +1,90 @@
+"""Zeroes the small weights of a checkpoint.
+
+The tensors are streamed one at a time through `checkpoint_rewriter`, so with
+the default --max_shard_bytes the memory used peaks at about twice the size of
+the largest tensor of the checkpoint. The weights under --prune_threshold, or
+under the --prune_percentile of the magnitudes of all the pruned weights, are
+zeroed, and the tensors can also be masked, cast and renamed on the way:
+
+python prune.py --checkpoint_path=checkpoints/haute_garonne_other \
+    --output_path=checkpoints/haute_garonne_other/pruned_model.ckpt \
+    --prune_percentile=50
+"""
+
 import tensorflow as tf
 import numpy as np
 
-# checkpoint_path = tf.train.latest_checkpoint("checkpoints/haute_garonne_other")
-# print("Latest checkpoint:", checkpoint_path)
-checkpoint_path = "checkpoints/haute_garonne_other/model.ckpt-2810"
-new_checkpoint_path = "checkpoints/haute_garonne_other/pruned_model.ckpt"
-prune_threshold = 1e-3
+import checkpoint_rewriter
+import checkpoint_tools
+
+tf.app.flags.DEFINE_string(
+    'checkpoint_path', 'checkpoints/haute_garonne_other/model.ckpt-2810',
+    'The checkpoint to prune, or the directory of its latest checkpoint.')
+
+tf.app.flags.DEFINE_string(
+    'output_path', 'checkpoints/haute_garonne_other/pruned_model.ckpt',
+    'The path of the pruned checkpoint.')
+
+tf.app.flags.DEFINE_float(
+    'prune_threshold', 1e-3, 'The magnitude under which weights are zeroed.')
+
+tf.app.flags.DEFINE_float(
+    'prune_percentile', None,
+    'If set, the percentage of the pruned weights zeroed, smallest first, '
+    'which replaces --prune_threshold.')
+
+tf.app.flags.DEFINE_string(
+    'prune_patterns', '*weights*',
+    'Comma-separated list of fnmatch patterns of the pruned tensors.')
+
+tf.app.flags.DEFINE_string(
+    'masks', None,
+    'An .npz file of boolean masks keyed by tensor name, whose False weights '
+    'are zeroed.')
+
+tf.app.flags.DEFINE_string(
+    'cast_dtype', None,
+    'If set, the dtype, e.g. float16, the floating point tensors are cast to.')
+
+tf.app.flags.DEFINE_string(
+    'rename', None,
+    'Comma-separated list of old_prefix=new_prefix replacements of the names '
+    'of the tensors.')
+
+tf.app.flags.DEFINE_integer(
+    'max_shard_bytes', 0,
+    'The size of the tensors buffered before they are written. Defaults to '
+    'the size of the largest tensor.')
 
-reader = tf.train.NewCheckpointReader(checkpoint_path)
-variable_map = reader.get_variable_to_shape_map()
-pruned_vars = {}
-# for var_name in variable_map:
-#     print(var_name, variable_map[var_name])
-#     tensor = reader.get_tensor(var_name)
-with tf.Session() as sess:
-    for var_name in variable_map:
-        # print(var_name, variable_map[var_name])
-        tensor = reader.get_tensor(var_name)
+FLAGS = tf.app.flags.FLAGS
 
-        if "weights" in var_name:
-            print(f"Prunning {var_name}...")
-            tensor[np.abs(tensor) < prune_threshold] = 0
 
-        pruned_vars[var_name] = tf.Variable(tensor, name=var_name)
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+  patterns = FLAGS.prune_patterns.split(',')
+  threshold = FLAGS.prune_threshold
+  if FLAGS.prune_percentile is not None:
+    # Incremental checkpoints are merged with their base checkpoint.
+    threshold = checkpoint_rewriter.get_magnitude_percentile(
+        checkpoint_tools.get_checkpoint_reader(FLAGS.checkpoint_path),
+        FLAGS.prune_percentile, patterns)
+  print(f"Prunning the weights of {FLAGS.prune_patterns} under {threshold:g}")
 
-    saver = tf.train.Saver(var_list=pruned_vars)
+  transform_fns = [checkpoint_rewriter.magnitude_threshold(threshold,
+                                                           patterns)]
+  if FLAGS.masks:
+    transform_fns.append(checkpoint_rewriter.mask(np.load(FLAGS.masks)))
+  if FLAGS.cast_dtype:
+    transform_fns.append(checkpoint_rewriter.cast(FLAGS.cast_dtype))
+  if FLAGS.rename:
+    transform_fns.append(checkpoint_rewriter.rename(
+        [replacement.split('=', 1) for replacement in FLAGS.rename.split(',')]))
+  names = checkpoint_rewriter.rewrite_checkpoint(
+      FLAGS.checkpoint_path, FLAGS.output_path,
+      checkpoint_rewriter.compose(*transform_fns),
+      max_shard_bytes=FLAGS.max_shard_bytes)
+  print(f"Pruned model of {len(names)} tensors saved at {FLAGS.output_path}")
 
-    sess.run(tf.global_variables_initializer())
-    saver.save(sess, new_checkpoint_path)
 
-print(f"Pruned model saved at {new_checkpoint_path}")
\ No newline at end of file
+if __name__ == '__main__':
+  tf.app.run()
@@ -0,0 +1,462 @@
+"""Measures the sensitivity of the accuracy to the pruning of every layer.
+
+The checkpoint is loaded once and a fixed subset of the validation split, the
+first --num_images records in order, is decoded and preprocessed into memory.
+Every layer is then pruned alone at each of --prune_ratios and the top-1
+accuracy of the subset is measured, before the original weights are put back.
+
+With --method=channel, the output channels of a convolution are removed as
+structured_prune.py removes them, by zeroing the input channels of the layers
+that read them, which computes exactly the thinner network. With
+--method=magnitude, the smallest weights of the layer are zeroed, as prune.py
+does.
+
+Since a single layer changes at a time, the activations at the input of the
+block of the first modified layer are cached and the network is only run from
+there. The layers are visited in the order of the network so that the cached
+activations of a block are computed from the ones of the previous block.
+
+python prune_sensitivity.py --model_name=inception_v3 \
+    --checkpoint_path=./checkpoints/haute_garonne_other \
+    --dataset_name=haute_garonne_other \
+    --dataset_dir=./data/haute_garonne_other \
+    --output_dir=./checkpoints/sensitivity --target_flops=0.7
+
+writes the accuracies to sensitivity.csv and a pruning plan to
+prune_plan.json in --output_dir. The plan greedily raises the pruning ratio of
+the layers losing the least accuracy per FLOP (--target_flops) or per
+parameter (--target_size) removed, until the pruned network keeps the target
+fraction of them, assuming the accuracy drops of the layers add up. A channel
+plan is applied with structured_prune.py --prune_plan.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import warnings
+warnings.filterwarnings('ignore')
+import collections
+import fnmatch
+import json
+import os
+import sys
+import numpy as np
+import tensorflow as tf
+
+sys.path.insert(0, './slim/')
+import checkpoint_tools
+from datasets import dataset_factory_fgvc
+from datasets import fgvc
+from nets import channel_pruning
+from nets import inception_utils
+from nets import nets_factory
+from preprocessing import preprocessing_factory
+
+slim = tf.contrib.slim
+
+tf.app.flags.DEFINE_string(
+    'model_name', 'inception_v3', 'The name of the architecture to analyze.')
+
+tf.app.flags.DEFINE_string(
+    'checkpoint_path', None,
+    'The checkpoint to analyze, or the directory of its latest checkpoint.')
+
+tf.app.flags.DEFINE_string(
+    'channel_config', None,
+    'The channel config of the checkpoint if it was already pruned.')
+
+tf.app.flags.DEFINE_string(
+    'dataset_name', 'cub_200', 'The name of the dataset to load.')
+
+tf.app.flags.DEFINE_string(
+    'dataset_split_name', 'validation', 'The name of the evaluated split.')
+
+tf.app.flags.DEFINE_string(
+    'dataset_dir', './data/',
+    'The directory where the dataset files are stored.')
+
+tf.app.flags.DEFINE_integer(
+    'labels_offset', 0, 'An offset for the labels in the dataset.')
+
+tf.app.flags.DEFINE_string(
+    'preprocessing_name', None, 'The name of the preprocessing to use. If left '
+    'as `None`, then the model_name flag is used.')
+
+tf.app.flags.DEFINE_integer(
+    'eval_image_size', None,
+    'The image size. Defaults to the network default.')
+
+tf.app.flags.DEFINE_integer(
+    'num_images', 500,
+    'The number of validation images held in memory. The cached activations '
+    'of the first blocks take a few MB per image.')
+
+tf.app.flags.DEFINE_integer(
+    'batch_size', 50, 'The number of images of every inference.')
+
+tf.app.flags.DEFINE_integer(
+    'num_preprocessing_threads', 4,
+    'The number of images decoded and preprocessed in parallel.')
+
+tf.app.flags.DEFINE_string(
+    'method', 'channel',
+    'Either "channel" to remove output channels of the convolutions or '
+    '"magnitude" to zero the smallest weights of the layers.')
+
+tf.app.flags.DEFINE_string(
+    'prune_ratios', '0.25,0.5,0.75',
+    'Comma-separated list of the fractions of the channels or weights of a '
+    'layer removed.')
+
+tf.app.flags.DEFINE_string(
+    'criterion', 'l1',
+    'With --method=channel, the importance of a channel, "l1" or "bn_gamma", '
+    'see structured_prune.py.')
+
+tf.app.flags.DEFINE_integer(
+    'channel_round', 8,
+    'With --method=channel, the numbers of kept channels are rounded up to a '
+    'multiple of it.')
+
+tf.app.flags.DEFINE_integer(
+    'min_channels', 8,
+    'With --method=channel, the smallest number of channels of a convolution.')
+
+tf.app.flags.DEFINE_string(
+    'layer_scopes', None,
+    'Comma-separated list of fnmatch patterns of the layers to analyze, e.g. '
+    '"InceptionV3/Mixed_6*". Defaults to all of them.')
+
+tf.app.flags.DEFINE_float(
+    'target_flops', None,
+    'The fraction of the FLOPs of the convolutions and fully connected layers '
+    'kept by the recommended plan.')
+
+tf.app.flags.DEFINE_float(
+    'target_size', None,
+    'The fraction of the parameters kept by the recommended plan.')
+
+tf.app.flags.DEFINE_string(
+    'output_dir', None,
+    'The directory of sensitivity.csv and prune_plan.json.')
+
+FLAGS = tf.app.flags.FLAGS
+
+# The end points which are not the output of a block of the network.
+_SKIPPED_END_POINTS = ('AuxLogits', 'Predictions')
+
+# The accuracy of a layer pruned at a ratio, and the FLOPs of an image and the
+# parameters it removes.
+Sensitivity = collections.namedtuple(
+    'Sensitivity', ['scope', 'ratio', 'accuracy', 'flops', 'parameters'])
+
+
+def _get_layer_flops(graph):
+  """Returns the FLOPs of an image of every convolution and matmul.
+
+  The layers are keyed by the scope of their variables, like the
+  `PrunableConv`s of channel_pruning.
+  """
+  layer_flops = {}
+  for op in graph.get_operations():
+    if op.type == 'Conv2D':
+      output_shape = op.outputs[0].shape.as_list()
+      kernel_shape = op.inputs[1].shape.as_list()
+      layer_flops[channel_pruning.get_variable_scope(op)] = 2 * int(
+          np.prod(output_shape[1:]) * np.prod(kernel_shape[:3]))
+    elif op.type == 'MatMul':
+      layer_flops[channel_pruning.get_variable_scope(op)] = 2 * int(
+          np.prod(op.inputs[1].shape.as_list()))
+  return layer_flops
+
+
+def _get_cuts(graph, images, end_points):
+  """Returns the inputs of the blocks of the network, in order.
+
+  Returns:
+    cuts: A list of Tensors, the images followed by the outputs of the blocks.
+    block_cuts: A dict from the names of the blocks to the index of their
+      input in `cuts`.
+  """
+  op_indices = {op: index for index, op in enumerate(graph.get_operations())}
+  # The op names of a block may repeat the network scope, e.g.
+  # InceptionV3/InceptionV3/Mixed_5b/concat, unlike its variables.
+  blocks = sorted(
+      (name for name, tensor in end_points.items()
+       if name not in _SKIPPED_END_POINTS and
+       name in tensor.op.name.split('/')[:-1]),
+      key=lambda name: op_indices[end_points[name].op])
+  cuts = [images] + [end_points[name] for name in blocks]
+  return cuts, {name: index for index, name in enumerate(blocks)}
+
+
+def _get_cut(scopes, block_cuts):
+  """Returns the index of the latest input preceding the layers of scopes.
+
+  The scopes are variable scopes, whose second component is the block.
+  """
+  # Layers outside of the blocks are run from the images.
+  return min(block_cuts.get(scope.split('/')[1], 0) for scope in scopes)
+
+
+def _run_batches(sess, fetch, feed_tensor, inputs):
+  """Runs `fetch` on the batches of `inputs` fed to `feed_tensor`."""
+  outputs = []
+  for start in range(0, len(inputs), FLAGS.batch_size):
+    outputs.append(sess.run(
+        fetch, {feed_tensor: inputs[start:start + FLAGS.batch_size]}))
+  return np.concatenate(outputs)
+
+
+def _load_images(dataset, image_size):
+  """Decodes and preprocesses the first images of the dataset."""
+  preprocessing_fn = preprocessing_factory.get_preprocessing(
+      FLAGS.preprocessing_name or FLAGS.model_name, is_training=False)
+  with tf.Graph().as_default():
+    batches = fgvc.get_cached_dataset(
+        dataset, preprocessing_fn, image_size, FLAGS.batch_size,
+        num_samples=FLAGS.num_images,
+        num_preprocessing_threads=FLAGS.num_preprocessing_threads,
+        labels_offset=FLAGS.labels_offset)
+    next_batch = batches.make_one_shot_iterator().get_next()
+    images, labels = [], []
+    with tf.Session() as sess:
+      while True:
+        try:
+          batch_images, batch_labels = sess.run(next_batch)
+        except tf.errors.OutOfRangeError:
+          break
+        images.append(batch_images)
+        labels.append(batch_labels)
+  return np.concatenate(images), np.concatenate(labels)
+
+
+def _get_channel_edits(conv, kept_channels, values):
+  """Returns the weights of the consumers of `conv` without its channels."""
+  removed = np.setdiff1d(np.arange(conv.num_channels), kept_channels)
+  edits = {}
+  for consumer in conv.consumers:
+    name = consumer.scope + '/weights'
+    if name not in edits:
+      edits[name] = values[name].copy()
+    index = [slice(None)] * edits[name].ndim
+    index[consumer.axis] = consumer.offset + removed
+    edits[name][tuple(index)] = 0
+  return edits
+
+
+def _get_magnitude_edits(scope, ratio, values):
+  """Returns the weights of a layer without their smallest fraction."""
+  weights = values[scope + '/weights'].copy()
+  num_pruned = int(round(ratio * weights.size))
+  weights.reshape(-1)[np.argsort(np.abs(weights), axis=None)[:num_pruned]] = 0
+  return {scope + '/weights': weights}
+
+
+def _get_prunings(graph, values, layer_flops, prune_ratios):
+  """Returns the pruned weights of every layer and ratio, with their cost.
+
+  Returns:
+    A list of (scope, modified scopes, [(ratio, edits, flops, parameters)])
+    tuples, the edits being a dict from variable names to pruned values.
+  """
+  patterns = FLAGS.layer_scopes.split(',') if FLAGS.layer_scopes else None
+  prunings = []
+  if FLAGS.method == 'channel':
+    convs = channel_pruning.find_prunable_convs(graph, patterns)
+    for ratio in prune_ratios:
+      kept_channels = channel_pruning.select_channels(
+          values.__getitem__, convs, ratio, criterion=FLAGS.criterion,
+          channel_round=FLAGS.channel_round, min_channels=FLAGS.min_channels)
+      for index, conv in enumerate(convs):
+        if len(prunings) <= index:
+          prunings.append((conv.scope,
+                           [consumer.scope for consumer in conv.consumers],
+                           []))
+        num_removed = conv.num_channels - len(kept_channels[conv.scope])
+        weights = values[conv.scope + '/weights']
+        flops = layer_flops[conv.scope] * num_removed / conv.num_channels
+        parameters = weights.size * num_removed / conv.num_channels
+        for consumer in conv.consumers:
+          num_inputs = values[consumer.scope + '/weights'].shape[consumer.axis]
+          flops += layer_flops[consumer.scope] * num_removed / num_inputs
+          parameters += (values[consumer.scope + '/weights'].size *
+                         num_removed / num_inputs)
+        prunings[index][2].append((
+            ratio, _get_channel_edits(conv, kept_channels[conv.scope], values),
+            flops, parameters))
+  elif FLAGS.method == 'magnitude':
+    for scope in sorted(layer_flops):
+      if patterns and not any(fnmatch.fnmatch(scope, pattern)
+                              for pattern in patterns):
+        continue
+      weights = values[scope + '/weights']
+      prunings.append((scope, [scope], [
+          (ratio, _get_magnitude_edits(scope, ratio, values),
+           layer_flops[scope] * ratio, weights.size * ratio)
+          for ratio in prune_ratios]))
+  else:
+    raise ValueError('Pruning method [%s] was not recognized' % FLAGS.method)
+  return prunings
+
+
+def _recommend_plan(sensitivities, baseline_accuracy, cost, budget):
+  """Greedily selects the pruning ratios of the layers to save `budget`.
+
+  Args:
+    sensitivities: A dict from the scopes of the layers to their list of
+      `Sensitivity`.
+    baseline_accuracy: The accuracy of the unpruned network.
+    cost: The saved cost, either "flops" or "parameters".
+    budget: The amount of `cost` to save.
+
+  Returns:
+    A dict from the scopes of the pruned layers to their `Sensitivity`.
+  """
+  plan = {}
+  saved = 0.
+  while saved < budget:
+    best = None
+    for scope, rows in sensitivities.items():
+      current_accuracy = (plan[scope].accuracy if scope in plan
+                          else baseline_accuracy)
+      current_saved = getattr(plan[scope], cost) if scope in plan else 0.
+      for row in rows:
+        gain = getattr(row, cost) - current_saved
+        if gain <= 0:
+          continue
+        loss_per_gain = (current_accuracy - row.accuracy) / gain
+        if best is None or loss_per_gain < best[0]:
+          best = (loss_per_gain, gain, row)
+    if best is None:
+      tf.logging.warning('The budget cannot be met with --prune_ratios')
+      break
+    _, gain, row = best
+    plan[row.scope] = row
+    saved += gain
+  return plan
+
+
+def main(_):
+  if not FLAGS.checkpoint_path or not FLAGS.output_dir:
+    raise ValueError('You must supply --checkpoint_path and --output_dir')
+  if FLAGS.target_flops is not None and FLAGS.target_size is not None:
+    raise ValueError('Only one of --target_flops and --target_size can be set')
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  checkpoint_path = FLAGS.checkpoint_path
+  if tf.gfile.IsDirectory(checkpoint_path):
+    checkpoint_path = tf.train.latest_checkpoint(checkpoint_path)
+  prune_ratios = [float(ratio) for ratio in FLAGS.prune_ratios.split(',')]
+  dataset = dataset_factory_fgvc.get_dataset(
+      FLAGS.dataset_name, FLAGS.dataset_split_name, FLAGS.dataset_dir)
+  network_fn = nets_factory.get_network_fn(
+      FLAGS.model_name,
+      num_classes=(dataset.num_classes - FLAGS.labels_offset),
+      is_training=False,
+      channel_config=(
+          inception_utils.read_channel_config(FLAGS.channel_config)
+          if FLAGS.channel_config else None))
+  image_size = FLAGS.eval_image_size or network_fn.default_image_size
+  images, labels = _load_images(dataset, image_size)
+  tf.logging.info('Loaded %d images of %s', len(images),
+                  FLAGS.dataset_split_name)
+
+  with tf.Graph().as_default() as graph:
+    inputs = tf.placeholder(tf.float32, [None, image_size, image_size, 3])
+    if FLAGS.model_name.startswith('inception_v'):
+      logits, end_points = network_fn(inputs, create_aux_logits=False)
+    else:
+      logits, end_points = network_fn(inputs)
+    predictions = tf.argmax(logits, 1)
+    cuts, block_cuts = _get_cuts(graph, inputs, end_points)
+    layer_flops = _get_layer_flops(graph)
+    variables = {variable.op.name: variable
+                 for variable in tf.global_variables()}
+
+    with tf.Session() as sess:
+      checkpoint_tools.restore(sess, list(variables.values()), checkpoint_path)
+      values = sess.run({name: variable.value()
+                         for name, variable in variables.items()})
+      prunings = _get_prunings(graph, values, layer_flops, prune_ratios)
+      prunings.sort(key=lambda pruning: _get_cut(pruning[1], block_cuts))
+
+      def accuracy(cut, activations):
+        return np.mean(_run_batches(sess, predictions, cuts[cut], activations)
+                       == labels)
+
+      baseline_accuracy = accuracy(0, images)
+      tf.logging.info('Baseline accuracy %.4f', baseline_accuracy)
+      sensitivities = collections.OrderedDict()
+      cut, activations = 0, images
+      for scope, modified_scopes, ratios in prunings:
+        while cut < _get_cut(modified_scopes, block_cuts):
+          activations = _run_batches(sess, cuts[cut + 1], cuts[cut],
+                                     activations)
+          cut += 1
+        sensitivities[scope] = []
+        for ratio, edits, flops, parameters in ratios:
+          for name, value in edits.items():
+            variables[name].load(value, sess)
+          sensitivities[scope].append(Sensitivity(
+              scope, ratio, accuracy(cut, activations), flops, parameters))
+          for name in edits:
+            variables[name].load(values[name], sess)
+        tf.logging.info('%s: %s', scope, ', '.join(
+            '%.2f: %.4f' % (row.ratio, row.accuracy)
+            for row in sensitivities[scope]))
+
+  tf.gfile.MakeDirs(FLAGS.output_dir)
+  with tf.gfile.Open(os.path.join(FLAGS.output_dir, 'sensitivity.csv'),
+                     'w') as f:
+    f.write('layer,ratio,accuracy,accuracy_drop,flops_saved,'
+            'parameters_saved\n')
+    for rows in sensitivities.values():
+      for row in rows:
+        f.write('%s,%g,%.4f,%.4f,%d,%d\n' % (
+            row.scope, row.ratio, row.accuracy,
+            baseline_accuracy - row.accuracy, row.flops, row.parameters))
+
+  print('baseline accuracy %.4f on %d images' % (baseline_accuracy,
+                                                   len(images)))
+  print('%-60s' % 'accuracy drop' +
+        ''.join(' %7.2f' % ratio for ratio in prune_ratios))
+  for scope, rows in sensitivities.items():
+    print('%-60s' % scope + ''.join(
+        ' %7.4f' % (baseline_accuracy - row.accuracy) for row in rows))
+
+  if FLAGS.target_flops is None and FLAGS.target_size is None:
+    return
+  if FLAGS.target_flops is not None:
+    cost, target, total = 'flops', FLAGS.target_flops, sum(
+        layer_flops.values())
+  else:
+    cost, target, total = 'parameters', FLAGS.target_size, sum(
+        value.size for value in values.values())
+  plan = _recommend_plan(sensitivities, baseline_accuracy, cost,
+                         (1 - target) * total)
+  kept = 1 - sum(getattr(row, cost) for row in plan.values()) / total
+  predicted_accuracy = baseline_accuracy - sum(
+      baseline_accuracy - row.accuracy for row in plan.values())
+  plan_filename = os.path.join(FLAGS.output_dir, 'prune_plan.json')
+  with tf.gfile.Open(plan_filename, 'w') as f:
+    f.write(json.dumps({
+        'model_name': FLAGS.model_name,
+        'checkpoint_path': checkpoint_path,
+        'method': FLAGS.method,
+        'criterion': FLAGS.criterion,
+        'channel_round': FLAGS.channel_round,
+        'min_channels': FLAGS.min_channels,
+        'target': {cost: target},
+        'kept_fraction': kept,
+        'baseline_accuracy': baseline_accuracy,
+        'predicted_accuracy': predicted_accuracy,
+        'prune_ratios': {scope: row.ratio for scope, row in plan.items()},
+    }, indent=2, sort_keys=True))
+  print('Plan of %d layers keeping %.1f%% of the %s, predicted accuracy '
+        '%.4f, saved at %s' % (len(plan), 100 * kept, cost,
+                               predicted_accuracy, plan_filename))
+
+
+if __name__ == '__main__':
+  tf.app.run()
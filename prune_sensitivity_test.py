@@ -0,0 +1,86 @@
+"""Tests for prune_sensitivity.py, run from the root of the repository."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from absl.testing import flagsaver
+
+import prune_sensitivity
+
+slim = tf.contrib.slim
+
+
+def _build_network(images):
+  """Builds a small network with the scopes of the inception networks."""
+  end_points = {}
+  with tf.variable_scope('Net') as scope:
+    # Like inception_v3_base, reopening the scope repeats it in the op names.
+    with tf.variable_scope(scope):
+      net = slim.conv2d(images, 8, [3, 3], scope='Conv2d_1a_3x3')
+      end_points['Conv2d_1a_3x3'] = net
+      with tf.variable_scope('Mixed_5b'):
+        with tf.variable_scope('Branch_0'):
+          branch_0 = slim.conv2d(net, 8, [1, 1], scope='Conv2d_0a_1x1')
+        with tf.variable_scope('Branch_1'):
+          branch_1 = slim.conv2d(net, 8, [1, 1], scope='Conv2d_0a_1x1')
+        net = tf.concat(axis=3, values=[branch_0, branch_1])
+      end_points['Mixed_5b'] = net
+      with tf.variable_scope('Mixed_5c'):
+        with tf.variable_scope('Branch_0'):
+          net = slim.conv2d(net, 8, [1, 1], scope='Conv2d_0a_1x1')
+      end_points['Mixed_5c'] = net
+    net = tf.reduce_mean(net, [1, 2])
+    logits = slim.fully_connected(net, 5, activation_fn=None, scope='Logits')
+    end_points['Logits'] = logits
+  return logits, end_points
+
+
+class PruneSensitivityTest(tf.test.TestCase):
+
+  def testLayersAndCutsOfTheBlocks(self):
+    with tf.Graph().as_default() as graph:
+      images = tf.placeholder(tf.float32, [1, 8, 8, 3])
+      _, end_points = _build_network(images)
+      self.assertEqual(end_points['Mixed_5b'].op.name,
+                       'Net/Net/Mixed_5b/concat')
+      cuts, block_cuts = prune_sensitivity._get_cuts(graph, images,
+                                                     end_points)
+      layer_flops = prune_sensitivity._get_layer_flops(graph)
+      values = {variable.op.name: np.random.rand(*variable.shape.as_list())
+                for variable in tf.global_variables()}
+      with flagsaver.flagsaver(method='channel', layer_scopes=None,
+                               criterion='l1', channel_round=1,
+                               min_channels=1):
+        prunings = prune_sensitivity._get_prunings(graph, values,
+                                                   layer_flops, [0.5])
+
+    self.assertEqual(layer_flops, {
+        'Net/Conv2d_1a_3x3': 2 * 8 * 8 * 8 * 3 * 3 * 3,
+        'Net/Mixed_5b/Branch_0/Conv2d_0a_1x1': 2 * 8 * 8 * 8 * 8,
+        'Net/Mixed_5b/Branch_1/Conv2d_0a_1x1': 2 * 8 * 8 * 8 * 8,
+        'Net/Mixed_5c/Branch_0/Conv2d_0a_1x1': 2 * 8 * 8 * 8 * 16,
+        'Net/Logits': 2 * 8 * 5,
+    })
+    self.assertEqual(block_cuts, {'Conv2d_1a_3x3': 0, 'Mixed_5b': 1,
+                                  'Mixed_5c': 2, 'Logits': 3})
+    self.assertIs(cuts[0], images)
+    self.assertIs(cuts[2], end_points['Mixed_5b'])
+
+    table = {scope: (prune_sensitivity._get_cut(modified_scopes, block_cuts),
+                     ratios[0][2])
+             for scope, modified_scopes, ratios in prunings}
+    self.assertEqual(table, {
+        # Half the filters of the layer and half the inputs of its consumers.
+        'Net/Conv2d_1a_3x3': (1, (27648 + 2 * 8192) / 2),
+        'Net/Mixed_5b/Branch_0/Conv2d_0a_1x1': (2, (8192 + 16384 / 2) / 2),
+        'Net/Mixed_5b/Branch_1/Conv2d_0a_1x1': (2, (8192 + 16384 / 2) / 2),
+        'Net/Mixed_5c/Branch_0/Conv2d_0a_1x1': (3, (16384 + 80) / 2),
+    })
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,321 @@
+"""Caches the features of a frozen network to train only the layers after them.
+
+The cache of a split holds, for every record, the activations of one end point
+of the network (e.g. `AvgPool_1a`, `Mixed_7c` or `Mixed_6e`) computed once with
+the restored weights and the network in inference mode. It is made of:
+
+  bottleneck.json   the parameters the cache was computed with.
+  labels.npy        the label of every record.
+  features_<k>.npy  the end point activations of the k-th view of every record.
+
+Without augmented views, a single view is computed with the evaluation
+preprocessing. Otherwise every view is an independent draw of the training
+preprocessing. The .npy files are read as memory maps, so the cache does not
+need to fit in memory.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import numpy as np
+import tensorflow as tf
+
+from tensorflow.contrib import graph_editor as ge
+
+from datasets import fgvc
+
+BOTTLENECK_METADATA_FILENAME = 'bottleneck.json'
+
+_LABELS_FILENAME = 'labels.npy'
+
+_FEATURES_FILENAME = 'features_%d.npy'
+
+# Collection of the image placeholders replaced by cached features.
+_IMAGES_COLLECTION = 'bottleneck_images'
+
+
+def read_cache_metadata(cache_dir):
+  """Reads the metadata file of a bottleneck cache.
+
+  Args:
+    cache_dir: The directory of the cache.
+
+  Returns:
+    The metadata dict, or None if the cache is missing or incomplete.
+  """
+  metadata_filename = os.path.join(cache_dir, BOTTLENECK_METADATA_FILENAME)
+  if not tf.gfile.Exists(metadata_filename):
+    return None
+  try:
+    with tf.gfile.Open(metadata_filename, 'r') as f:
+      return json.loads(f.read())
+  except ValueError:
+    return None
+
+
+def _upstream_variables(tensor):
+  """Returns the global variables `tensor` is computed from."""
+  ops = set(ge.get_backward_walk_ops(tensor.op, inclusive=True))
+  return [var for var in tf.global_variables() if var.op in ops]
+
+
+def build_cache(cache_dir,
+                dataset,
+                network_fn,
+                endpoint,
+                image_size,
+                num_views,
+                train_preprocessing_fn,
+                eval_preprocessing_fn,
+                checkpoint_path,
+                batch_size=64,
+                num_preprocessing_threads=4,
+                model_name=None):
+  """Computes the bottleneck cache of a split, unless it is already up to date.
+
+  The metadata file is written last, so an interrupted computation is started
+  over on the next call.
+
+  Args:
+    cache_dir: The local directory of the cache.
+    dataset: A `Dataset` returned by `fgvc.get_split`.
+    network_fn: A function returned by `nets_factory.get_network_fn` with
+      `is_training=False`.
+    endpoint: The name of the end point whose activations are cached.
+    image_size: The height and width of the preprocessed images.
+    num_views: The number of augmented views of every record. With 0, a single
+      view is computed with `eval_preprocessing_fn`.
+    train_preprocessing_fn: The training preprocessing function.
+    eval_preprocessing_fn: The evaluation preprocessing function.
+    checkpoint_path: The checkpoint, or directory of checkpoints, holding the
+      weights of the layers up to `endpoint`.
+    batch_size: The number of images run through the network at once.
+    num_preprocessing_threads: The number of images preprocessed in parallel.
+    model_name: The name of the network, recorded in the metadata.
+
+  Returns:
+    The metadata dict of the cache.
+
+  Raises:
+    ValueError: If `endpoint` is not an end point of the network or if the
+      split does not hold `dataset.num_samples` records.
+  """
+  if tf.gfile.IsDirectory(checkpoint_path):
+    checkpoint_path = tf.train.latest_checkpoint(checkpoint_path)
+  metadata = {
+      'model_name': model_name,
+      'endpoint': endpoint,
+      'image_size': image_size,
+      'num_views': num_views,
+      'num_samples': dataset.num_samples,
+      'checkpoint_path': checkpoint_path,
+  }
+  existing_metadata = read_cache_metadata(cache_dir)
+  if existing_metadata is not None and all(
+      existing_metadata.get(key) == value for key, value in metadata.items()):
+    tf.logging.info('Reusing the bottleneck cache in %s', cache_dir)
+    return existing_metadata
+
+  metadata_filename = os.path.join(cache_dir, BOTTLENECK_METADATA_FILENAME)
+  if tf.gfile.Exists(metadata_filename):
+    tf.gfile.Remove(metadata_filename)
+  tf.gfile.MakeDirs(cache_dir)
+
+  num_samples = dataset.num_samples
+  preprocessing_fn = (
+      train_preprocessing_fn if num_views else eval_preprocessing_fn)
+
+  def _parse(record):
+    image_buffer, image_format, label = fgvc.parse_record(record)
+    image = fgvc.decode_image(image_buffer, image_format)
+    return preprocessing_fn(image, image_size, image_size), label
+
+  with tf.Graph().as_default():
+    files = tf.data.Dataset.list_files(dataset.data_sources, shuffle=False)
+    records = files.flat_map(tf.data.TFRecordDataset)
+    batches = records.map(_parse, num_parallel_calls=num_preprocessing_threads)
+    batches = batches.batch(batch_size).prefetch(1)
+    iterator = batches.make_initializable_iterator()
+    images, labels = iterator.get_next()
+
+    _, end_points = network_fn(images)
+    if endpoint not in end_points:
+      raise ValueError('End point [%s] was not found in the network' % endpoint)
+    features = end_points[endpoint]
+    metadata['shape'] = features.shape[1:].as_list()
+    saver = tf.train.Saver(_upstream_variables(features))
+
+    with tf.Session() as sess:
+      tf.logging.info('Computing the %s features of %d records from %s',
+                      endpoint, num_samples, checkpoint_path)
+      saver.restore(sess, checkpoint_path)
+      cached_labels = np.lib.format.open_memmap(
+          os.path.join(cache_dir, _LABELS_FILENAME), mode='w+',
+          dtype=np.int64, shape=(num_samples,))
+      for view in range(max(num_views, 1)):
+        cached_features = np.lib.format.open_memmap(
+            os.path.join(cache_dir, _FEATURES_FILENAME % view), mode='w+',
+            dtype=np.float32, shape=tuple([num_samples] + metadata['shape']))
+        sess.run(iterator.initializer)
+        offset = 0
+        while True:
+          try:
+            batch_features, batch_labels = sess.run([features, labels])
+          except tf.errors.OutOfRangeError:
+            break
+          end = offset + len(batch_labels)
+          if end > num_samples:
+            raise ValueError('The split holds more than %d records' %
+                             num_samples)
+          cached_features[offset:end] = batch_features
+          if view == 0:
+            cached_labels[offset:end] = batch_labels
+          offset = end
+        if offset != num_samples:
+          raise ValueError('The split holds %d records, expected %d' %
+                           (offset, num_samples))
+        cached_features.flush()
+        del cached_features
+        tf.logging.info('Cached view %d/%d', view + 1, max(num_views, 1))
+      cached_labels.flush()
+      del cached_labels
+
+  with tf.gfile.Open(metadata_filename, 'w') as f:
+    f.write(json.dumps(metadata, indent=2, sort_keys=True))
+  return metadata
+
+
+def get_batched_dataset(cache_dir, batch_size, labels_offset=0):
+  """Returns a `tf.data.Dataset` of random batches drawn from a cache.
+
+  Every batch samples records and views uniformly, without replacement within
+  an epoch over all the views, and the pipeline repeats indefinitely.
+
+  Args:
+    cache_dir: The directory of a cache written by `build_cache`.
+    batch_size: The number of samples in each batch.
+    labels_offset: An offset subtracted from the labels.
+
+  Returns:
+    A `tf.data.Dataset` of (features, labels) batches, features being a float
+    Tensor of shape [batch_size] + the shape of the cached end point and labels
+    an int64 Tensor of shape [batch_size].
+
+  Raises:
+    ValueError: If there is no complete cache in `cache_dir`.
+  """
+  metadata = read_cache_metadata(cache_dir)
+  if metadata is None:
+    raise ValueError('There is no bottleneck cache in %s' % cache_dir)
+  num_samples = metadata['num_samples']
+  views = [np.load(os.path.join(cache_dir, _FEATURES_FILENAME % view),
+                   mmap_mode='r')
+           for view in range(max(metadata['num_views'], 1))]
+  labels = np.load(os.path.join(cache_dir, _LABELS_FILENAME))
+
+  def _gather(indices):
+    # Reading the rows in order keeps the accesses to each memory map forward.
+    view_ids, rows = np.divmod(np.sort(indices), num_samples)
+    features = np.stack([views[view_id][row]
+                         for view_id, row in zip(view_ids, rows)])
+    return features, labels[rows] - labels_offset
+
+  def _load(indices):
+    features, batch_labels = tf.py_func(
+        _gather, [indices], [tf.float32, tf.int64], stateful=False)
+    features.set_shape([batch_size] + metadata['shape'])
+    batch_labels.set_shape([batch_size])
+    return features, batch_labels
+
+  num_entries = len(views) * num_samples
+  indices = tf.data.Dataset.range(num_entries).shuffle(num_entries).repeat()
+  batches = indices.batch(batch_size, drop_remainder=True).map(_load)
+  return batches.prefetch(2)
+
+
+def depends_on_images(op_or_tensor):
+  """Whether an op or Tensor is computed from the `network_on_features` images.
+
+  Such ops cannot be run, since the image placeholders are never fed.
+  """
+  images_ops = set(
+      images.op for images in tf.get_collection(_IMAGES_COLLECTION))
+  if isinstance(op_or_tensor, tf.Tensor):
+    op_or_tensor = op_or_tensor.op
+  return not images_ops.isdisjoint(
+      ge.get_backward_walk_ops(op_or_tensor, inclusive=True))
+
+
+def network_on_features(network_fn, features, endpoint, image_size):
+  """Builds a network whose `endpoint` is replaced by cached features.
+
+  The network is built on an image placeholder that is never fed, then the
+  consumers of `endpoint` are rerouted to `features`, so only the layers after
+  the end point are computed. All the variables of the network are still
+  created, so the checkpoints have the layout of the full network. The end
+  points that still depend on the images, such as the auxiliary logits of
+  inception_v3 cut after `Mixed_6e`, are left out.
+
+  Args:
+    network_fn: A function returned by `nets_factory.get_network_fn`.
+    features: A batch of cached features, as returned by `get_batched_dataset`.
+    endpoint: The name of the cached end point.
+    image_size: The height and width of the images the features come from.
+
+  Returns:
+    The logits and the end points of the network.
+
+  Raises:
+    ValueError: If `endpoint` is not an end point of the network.
+  """
+  images = tf.placeholder(
+      tf.float32, [features.shape[0].value, image_size, image_size, 3],
+      name='bottleneck_images')
+  tf.add_to_collection(_IMAGES_COLLECTION, images)
+  logits, end_points = network_fn(images)
+  if endpoint not in end_points:
+    raise ValueError('End point [%s] was not found in the network' % endpoint)
+  ge.reroute_ts([features], [end_points[endpoint]])
+  end_points[endpoint] = features
+  end_points = dict((name, tensor) for name, tensor in end_points.items()
+                    if not depends_on_images(tensor))
+  return logits, end_points
+
+
+def get_variables_before_endpoint(losses, variables):
+  """Returns the variables of the layers before the cached end point.
+
+  These layers are only computed from the images, which are never fed, so no
+  loss computed from the cached features reads their variables.
+
+  Args:
+    losses: The losses of the network built by `network_on_features`, without
+      the regularization losses.
+    variables: The candidate variables.
+
+  Returns:
+    The list of the `variables` none of `losses` is computed from.
+  """
+  loss_ops = set(ge.get_backward_walk_ops([loss.op for loss in losses],
+                                          inclusive=True))
+  return [var for var in variables if var.op not in loss_ops]
+
+
+def get_regularization_losses(variables_before_endpoint):
+  """Returns the regularization losses of the layers after the end point.
+
+  The weight decay of the variables before the cached end point would shrink
+  them away from the weights the features were computed with.
+
+  Args:
+    variables_before_endpoint: As returned by `get_variables_before_endpoint`.
+
+  Returns:
+    The regularization losses reading none of `variables_before_endpoint`.
+  """
+  excluded = set(variables_before_endpoint)
+  return [loss for loss in tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES)
+          if excluded.isdisjoint(_upstream_variables(loss))]
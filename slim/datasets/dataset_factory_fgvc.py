@@ -20,18 +20,16 @@ from __future__ import print_function
 
 import os
 
+from datasets import dataset_utils
 from datasets import fgvc
 
+# Counts of datasets converted before convert_dataset.py wrote a metadata
+# sidecar. Datasets with a sidecar do not need an entry.
 datasets_map = {
   'ILSVRC2012': {'num_samples': {'train': 1281167, 'validation': 50000},
                  'num_classes': 1000},
-  # 'inat2017': {'num_samples': {'train': 318668, 'validation': 35408},
-  #              'num_classes': 1985},
-  'inat2017': {'num_samples': {'train': 1, 'validation': 142},
+  'inat2017': {'num_samples': {'train': 318668, 'validation': 35408},
                'num_classes': 1985},
-
-  'haute_garonne': {'num_samples': {'train': 55250, 'validation': 6139},
-               'num_classes': 284},
   'haute_garonne_other': {'num_samples': {'train': 55250, 'validation': 6139},
                'num_classes': 17},
   'inat2017_other': {'num_samples': {'train': 318668, 'validation': 35408},
@@ -58,6 +56,9 @@ datasets_map = {
 def get_dataset(name, split_name, root_dir, file_pattern=None, reader=None):
   """Given a dataset name and a split_name returns a Dataset.
 
+  The counts come from the metadata sidecar of the dataset directory when it
+  has one, and from `datasets_map` otherwise.
+
   Args:
     name: String, the name of the dataset.
     split_name: A train/validation split name.
@@ -72,11 +73,18 @@ def get_dataset(name, split_name, root_dir, file_pattern=None, reader=None):
   Raises:
     ValueError: If the dataset `name` is unknown.
   """
+  dataset_dir = os.path.join(root_dir, name)
+  if dataset_utils.has_dataset_metadata(dataset_dir):
+    return fgvc.get_split(
+        split_name,
+        dataset_dir,
+        file_pattern=file_pattern,
+        reader=reader)
   if name not in datasets_map:
     raise ValueError('Name of dataset unknown %s' % name)
   return fgvc.get_split(
       split_name,
-      os.path.join(root_dir, name),
+      dataset_dir,
       datasets_map[name]['num_samples'],
       datasets_map[name]['num_classes'],
       file_pattern,
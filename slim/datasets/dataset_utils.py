@@ -17,6 +17,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import json
 import os
 import sys
 import tarfile
@@ -26,6 +28,23 @@ import tensorflow as tf
 
 LABELS_FILENAME = 'labels.txt'
 
+DATASET_METADATA_FILENAME = 'dataset_metadata.json'
+
+SHARD_METADATA_SUFFIX = '.json'
+
+SHARD_INDEX_SUFFIX = '.index'
+
+# A TFRecord frame is a uint64 length and its uint32 masked CRC, followed by
+# the data and its uint32 masked CRC.
+_TFRECORD_HEADER_SIZE = 12
+_TFRECORD_FOOTER_SIZE = 4
+
+# One record of a shard index: the byte offset of the record frame in the
+# shard, the length of the serialized example, its label and its row in the
+# split manifest.
+ShardIndexEntry = collections.namedtuple(
+    'ShardIndexEntry', ['offset', 'length', 'label', 'row'])
+
 
 def int64_feature(values):
   """Returns a TF-Feature of int64s.
@@ -67,14 +86,18 @@ def float_feature(values):
   return tf.train.Feature(float_list=tf.train.FloatList(value=values))
 
 
-def image_to_tfexample(image_data, image_format, height, width, class_id):
-  return tf.train.Example(features=tf.train.Features(feature={
+def image_to_tfexample(image_data, image_format, height, width, class_id,
+                       manifest_row=None):
+  feature = {
       'image/encoded': bytes_feature(image_data),
       'image/format': bytes_feature(image_format),
       'image/class/label': int64_feature(class_id),
       'image/height': int64_feature(height),
       'image/width': int64_feature(width),
-  }))
+  }
+  if manifest_row is not None:
+    feature['image/manifest_row'] = int64_feature(manifest_row)
+  return tf.train.Example(features=tf.train.Features(feature=feature))
 
 
 def download_and_uncompress_tarball(tarball_url, dataset_dir):
@@ -148,3 +171,141 @@ def read_label_file(dataset_dir, filename=LABELS_FILENAME):
     index = line.index(':')
     labels_to_class_names[int(line[:index])] = line[index+1:]
   return labels_to_class_names
+
+
+def write_dataset_metadata(dataset_dir, metadata,
+                           filename=DATASET_METADATA_FILENAME):
+  """Writes the metadata sidecar describing a converted dataset.
+
+  Args:
+    dataset_dir: The directory of the converted dataset.
+    metadata: A JSON serializable dict with, at least, `num_samples` (a dict of
+      number of samples per split) and `num_classes`.
+    filename: The filename of the sidecar.
+  """
+  with tf.gfile.Open(os.path.join(dataset_dir, filename), 'w') as f:
+    f.write(json.dumps(metadata, indent=2, sort_keys=True))
+
+
+def has_dataset_metadata(dataset_dir, filename=DATASET_METADATA_FILENAME):
+  """Specifies whether or not the dataset directory contains a metadata sidecar.
+
+  Args:
+    dataset_dir: The directory of the converted dataset.
+    filename: The filename of the sidecar.
+
+  Returns:
+    `True` if the sidecar exists and `False` otherwise.
+  """
+  return tf.gfile.Exists(os.path.join(dataset_dir, filename))
+
+
+def read_dataset_metadata(dataset_dir, filename=DATASET_METADATA_FILENAME):
+  """Reads the metadata sidecar of a converted dataset.
+
+  Args:
+    dataset_dir: The directory of the converted dataset.
+    filename: The filename of the sidecar.
+
+  Returns:
+    The metadata dict.
+  """
+  with tf.gfile.Open(os.path.join(dataset_dir, filename), 'r') as f:
+    return json.loads(f.read())
+
+
+def write_shard_metadata(shard_filename, metadata):
+  """Writes the metadata file that accompanies a TFRecord shard.
+
+  The metadata file is written once the shard is complete, its presence is
+  what marks the shard as complete.
+
+  Args:
+    shard_filename: The path of the TFRecord shard.
+    metadata: A JSON serializable dict describing the shard.
+  """
+  with tf.gfile.Open(shard_filename + SHARD_METADATA_SUFFIX, 'w') as f:
+    f.write(json.dumps(metadata))
+
+
+def read_shard_metadata(shard_filename):
+  """Reads the metadata file of a TFRecord shard.
+
+  Args:
+    shard_filename: The path of the TFRecord shard.
+
+  Returns:
+    The metadata dict, or None if the shard has no readable metadata file.
+  """
+  metadata_filename = shard_filename + SHARD_METADATA_SUFFIX
+  if not tf.gfile.Exists(metadata_filename):
+    return None
+  try:
+    with tf.gfile.Open(metadata_filename, 'r') as f:
+      return json.loads(f.read())
+  except ValueError:
+    return None
+
+
+def remove_shard_metadata(shard_filename):
+  """Removes the metadata file of a TFRecord shard, marking it incomplete.
+
+  Args:
+    shard_filename: The path of the TFRecord shard.
+  """
+  metadata_filename = shard_filename + SHARD_METADATA_SUFFIX
+  if tf.gfile.Exists(metadata_filename):
+    tf.gfile.Remove(metadata_filename)
+
+
+def tfrecord_frame_size(length):
+  """Returns the number of bytes a record of `length` takes in a TFRecord."""
+  return _TFRECORD_HEADER_SIZE + length + _TFRECORD_FOOTER_SIZE
+
+
+def write_shard_index(index_filename, entries):
+  """Writes the per-record index of a TFRecord shard.
+
+  The index is a text file with one tab separated
+  `offset length label row` line per record, in shard order.
+
+  Args:
+    index_filename: The path of the index file.
+    entries: An iterable of (offset, length, label, row) tuples.
+  """
+  with tf.gfile.Open(index_filename, 'w') as f:
+    for entry in entries:
+      f.write('%d\t%d\t%d\t%d\n' % tuple(entry))
+
+
+def read_shard_index(shard_filename):
+  """Reads the per-record index of a TFRecord shard.
+
+  Args:
+    shard_filename: The path of the TFRecord shard.
+
+  Returns:
+    A list of `ShardIndexEntry`, in shard order.
+  """
+  with tf.gfile.Open(shard_filename + SHARD_INDEX_SUFFIX, 'r') as f:
+    lines = filter(None, f.read().split('\n'))
+  return [ShardIndexEntry(*[int(field) for field in line.split('\t')])
+          for line in lines]
+
+
+def read_record(shard_filename, entry):
+  """Reads a single serialized example of a shard without scanning it.
+
+  The record CRC is not checked, use `tf.python_io.tf_record_iterator` for
+  that.
+
+  Args:
+    shard_filename: The path of the TFRecord shard.
+    entry: The `ShardIndexEntry` of the record.
+
+  Returns:
+    The serialized `tf.train.Example` bytes.
+  """
+  with tf.gfile.GFile(shard_filename, 'rb') as f:
+    f.seek(entry.offset + _TFRECORD_HEADER_SIZE)
+    return f.read(entry.length)
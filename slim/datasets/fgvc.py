@@ -22,48 +22,82 @@ _ITEMS_TO_DESCRIPTIONS = {
     'label': 'A single integer',
 }
 
+# Autotuned buffer size of tf.data, when the installed version supports it.
+_AUTOTUNE = getattr(tf.contrib.data, 'AUTOTUNE', None)
+
+
+def _get_keys_to_features():
+  return {
+      'image/encoded': tf.FixedLenFeature((), tf.string, default_value=''),
+      'image/format': tf.FixedLenFeature((), tf.string, default_value='png'),
+      'image/class/label': tf.FixedLenFeature(
+          [], tf.int64, default_value=tf.zeros([], dtype=tf.int64)),
+      # -1 for the records converted before the manifest rows were stored.
+      'image/manifest_row': tf.FixedLenFeature(
+          [], tf.int64, default_value=tf.constant(-1, dtype=tf.int64)),
+  }
+
 
 def get_split(split_name,
               dataset_dir,
-              num_samples,
-              num_classes,
+              num_samples=None,
+              num_classes=None,
               file_pattern=None,
               reader=None):
   """Gets a dataset tuple with instructions for reading flowers.
 
+  The number of samples, the number of classes, the label names and the list
+  of shards are read from the metadata sidecar written by convert_dataset.py
+  when the dataset directory has one, so no pass over the shards is needed.
+
   Args:
     split_name: A train/validation split name.
     dataset_dir: The base directory of the dataset sources.
+    num_samples: A dict of number of samples in train/validation. If None, it
+      is read from the dataset metadata sidecar.
+    num_classes: Number of classes. If None, it is read from the dataset
+      metadata sidecar.
     file_pattern: The file pattern to use when matching the dataset sources.
       It is assumed that the pattern contains a '%s' string so that the split
-      name can be inserted.
+      name can be inserted. If None, the shards listed in the metadata sidecar,
+      or the default pattern when there is none, are used.
     reader: The TensorFlow reader type.
-    num_samples: A dict of number of samples in train/validation.
-    num_classes: Number of classes.
 
   Returns:
     A `Dataset` namedtuple.
 
   Raises:
-    ValueError: if `split_name` is not a valid train/validation split.
+    ValueError: if `split_name` is not a valid train/validation split, or if
+      the counts are not given and the dataset has no metadata sidecar.
   """
   if split_name not in ['train', 'validation']:
     raise ValueError('split name %s was not recognized.' % split_name)
 
-  if not file_pattern:
-    file_pattern = _FILE_PATTERN
-  file_pattern = os.path.join(dataset_dir, file_pattern % split_name)
+  metadata = None
+  if dataset_utils.has_dataset_metadata(dataset_dir):
+    metadata = dataset_utils.read_dataset_metadata(dataset_dir)
+  elif num_samples is None or num_classes is None:
+    raise ValueError('%s has no %s, num_samples and num_classes must be given.'
+                     % (dataset_dir, dataset_utils.DATASET_METADATA_FILENAME))
+
+  if num_samples is None:
+    num_samples = metadata['num_samples']
+  if num_classes is None:
+    num_classes = metadata['num_classes']
+
+  if file_pattern:
+    data_sources = os.path.join(dataset_dir, file_pattern % split_name)
+  elif metadata is not None:
+    data_sources = [os.path.join(dataset_dir, shard)
+                    for shard in metadata['shards'][split_name]]
+  else:
+    data_sources = os.path.join(dataset_dir, _FILE_PATTERN % split_name)
 
   # Allowing None in the signature so that dataset_factory can use the default.
   if reader is None:
     reader = tf.TFRecordReader
 
-  keys_to_features = {
-      'image/encoded': tf.FixedLenFeature((), tf.string, default_value=''),
-      'image/format': tf.FixedLenFeature((), tf.string, default_value='png'),
-      'image/class/label': tf.FixedLenFeature(
-          [], tf.int64, default_value=tf.zeros([], dtype=tf.int64)),
-  }
+  keys_to_features = _get_keys_to_features()
 
   items_to_handlers = {
       'image': slim.tfexample_decoder.Image(),
@@ -74,14 +108,195 @@ def get_split(split_name,
       keys_to_features, items_to_handlers)
 
   labels_to_names = None
-  if dataset_utils.has_labels(dataset_dir):
+  if metadata is not None and metadata.get('labels_to_names'):
+    labels_to_names = {int(label): name for label, name
+                       in metadata['labels_to_names'].items()}
+  elif dataset_utils.has_labels(dataset_dir):
     labels_to_names = dataset_utils.read_label_file(dataset_dir)
+  # The taxonomic class of every label, for the hierarchical head.
+  labels_to_taxa = None
+  if metadata is not None and metadata.get('labels_to_taxa'):
+    labels_to_taxa = {int(label): taxon for label, taxon
+                      in metadata['labels_to_taxa'].items()}
 
   return slim.dataset.Dataset(
-      data_sources=file_pattern,
+      data_sources=data_sources,
       reader=reader,
       decoder=decoder,
       num_samples=num_samples[split_name],
       items_to_descriptions=_ITEMS_TO_DESCRIPTIONS,
       num_classes=num_classes,
-      labels_to_names=labels_to_names)
+      labels_to_names=labels_to_names,
+      labels_to_taxa=labels_to_taxa)
+
+
+def parse_record(record, with_manifest_row=False):
+  """Parses a serialized record into (encoded image, image format, label).
+
+  Args:
+    record: A scalar string Tensor with a serialized `tf.train.Example`.
+    with_manifest_row: Whether to also return the manifest row of the record.
+
+  Returns:
+    A tuple of the scalar string Tensors `image/encoded` and `image/format` and
+    the scalar int64 Tensor `image/class/label`, followed with
+    `with_manifest_row` by the scalar int64 Tensor `image/manifest_row`, -1
+    when the record does not have one.
+  """
+  features = tf.parse_single_example(record, _get_keys_to_features())
+  parsed = (features['image/encoded'], features['image/format'],
+            features['image/class/label'])
+  if with_manifest_row:
+    parsed += (features['image/manifest_row'],)
+  return parsed
+
+
+def decode_image(image_buffer, image_format):
+  """Decodes an encoded PNG or JPEG image into a 3-D uint8 RGB Tensor.
+
+  Args:
+    image_buffer: A scalar string Tensor with the encoded image.
+    image_format: A scalar string Tensor with the `image/format` of the record.
+
+  Returns:
+    A 3-D uint8 Tensor of shape [height, width, 3].
+  """
+  is_png = tf.logical_or(tf.equal(image_format, 'png'),
+                         tf.equal(image_format, 'PNG'))
+  image = tf.cond(
+      is_png,
+      lambda: tf.image.decode_png(image_buffer, channels=3),
+      lambda: tf.image.decode_jpeg(image_buffer, channels=3))
+  image.set_shape([None, None, 3])
+  return image
+
+
+def _get_parse_fn(image_preprocessing_fn, image_size, labels_offset,
+                  preprocess_encoded, with_manifest_rows=False):
+  """Returns a function parsing a record into a preprocessed (image, label).
+
+  With `with_manifest_rows`, the function returns (image, label, manifest row).
+  """
+  def _parse(record):
+    image_buffer, image_format, label, row = parse_record(
+        record, with_manifest_row=True)
+    if preprocess_encoded:
+      image = image_preprocessing_fn(image_buffer, image_format,
+                                     image_size, image_size)
+    else:
+      image = decode_image(image_buffer, image_format)
+      image = image_preprocessing_fn(image, image_size, image_size)
+    if with_manifest_rows:
+      return image, label - labels_offset, row
+    return image, label - labels_offset
+  return _parse
+
+
+def get_batched_dataset(dataset,
+                        image_preprocessing_fn,
+                        image_size,
+                        batch_size,
+                        is_training,
+                        num_readers=4,
+                        num_preprocessing_threads=4,
+                        labels_offset=0,
+                        shuffle_buffer_size=None,
+                        preprocess_encoded=False,
+                        with_manifest_rows=False):
+  """Builds a `tf.data` input pipeline over the shards of a `Dataset`.
+
+  It is the `tf.data` counterpart of `DatasetDataProvider` followed by
+  `tf.train.batch`: shards are read with a parallel interleave, records are
+  decoded and preprocessed by a parallel map, batched with a static batch size
+  and prefetched. The pipeline repeats indefinitely, like the queue runners
+  do, so the last evaluation batch wraps around to the first records.
+
+  Args:
+    dataset: A `Dataset` returned by `get_split`.
+    image_preprocessing_fn: A function such as the ones returned by
+      `preprocessing_factory.get_preprocessing`, taking a decoded image, a
+      height and a width.
+    image_size: The height and width of the preprocessed images.
+    batch_size: The number of samples in each batch.
+    is_training: Whether to shuffle the shards and the records.
+    num_readers: The number of shards read in parallel.
+    num_preprocessing_threads: The number of records decoded and preprocessed
+      in parallel.
+    labels_offset: An offset subtracted from the labels.
+    shuffle_buffer_size: The number of records of the shuffle buffer. Defaults
+      to 20 batches, the capacity of the training common queue.
+    preprocess_encoded: Whether `image_preprocessing_fn` decodes the images
+      itself, such as the ones returned by
+      `preprocessing_factory.get_encoded_preprocessing`. It then takes the
+      encoded image and its format before the height and width.
+    with_manifest_rows: Whether the batches also hold the manifest rows of the
+      records, as an int64 Tensor of shape [batch_size].
+
+  Returns:
+    A `tf.data.Dataset` of (images, labels) batches, images being a float
+    Tensor of shape [batch_size, image_size, image_size, 3] and labels an int64
+    Tensor of shape [batch_size].
+  """
+  files = tf.data.Dataset.list_files(dataset.data_sources, shuffle=is_training)
+  files = files.repeat()
+  records = files.apply(tf.contrib.data.parallel_interleave(
+      tf.data.TFRecordDataset, cycle_length=num_readers, sloppy=is_training))
+  if is_training:
+    records = records.shuffle(shuffle_buffer_size or 20 * batch_size)
+  batches = records.apply(tf.contrib.data.map_and_batch(
+      _get_parse_fn(image_preprocessing_fn, image_size, labels_offset,
+                    preprocess_encoded, with_manifest_rows),
+      batch_size,
+      num_parallel_calls=num_preprocessing_threads,
+      drop_remainder=True))
+  return batches.prefetch(_AUTOTUNE or 2)
+
+
+def get_cached_dataset(dataset,
+                       image_preprocessing_fn,
+                       image_size,
+                       batch_size,
+                       num_samples=None,
+                       num_preprocessing_threads=4,
+                       labels_offset=0,
+                       cache_filename='',
+                       preprocess_encoded=False):
+  """Builds a single-pass `tf.data` pipeline whose images are cached.
+
+  The first `num_samples` records of the shards, in order, are decoded and
+  preprocessed during the first pass only. The following passes read the
+  preprocessed images from memory, or from `cache_filename`, which suits a
+  fixed subset evaluated repeatedly with the deterministic evaluation
+  preprocessing. The pipeline has to be run to the end on the first pass for
+  the cache to be completed, e.g. with an initializable iterator.
+
+  Args:
+    dataset: A `Dataset` returned by `get_split`.
+    image_preprocessing_fn: A function such as the ones returned by
+      `preprocessing_factory.get_preprocessing`, taking a decoded image, a
+      height and a width.
+    image_size: The height and width of the preprocessed images.
+    batch_size: The maximum number of samples in each batch.
+    num_samples: The number of records of the subset, or None for all the
+      records.
+    num_preprocessing_threads: The number of records decoded and preprocessed
+      in parallel.
+    labels_offset: An offset subtracted from the labels.
+    cache_filename: The prefix of the cache files, or an empty string to cache
+      the images in memory.
+    preprocess_encoded: Whether `image_preprocessing_fn` decodes the images
+      itself, as in `get_batched_dataset`.
+
+  Returns:
+    A `tf.data.Dataset` of (images, labels) batches, the last batch of which
+    may be smaller than `batch_size`.
+  """
+  files = tf.data.Dataset.list_files(dataset.data_sources, shuffle=False)
+  records = files.flat_map(tf.data.TFRecordDataset)
+  if num_samples:
+    records = records.take(num_samples)
+  samples = records.map(
+      _get_parse_fn(image_preprocessing_fn, image_size, labels_offset,
+                    preprocess_encoded),
+      num_parallel_calls=num_preprocessing_threads)
+  return samples.cache(cache_filename).batch(batch_size).prefetch(1)
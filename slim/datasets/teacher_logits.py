@@ -0,0 +1,226 @@
+"""Stores the logits of a teacher network to distill it without running it.
+
+The logits of every record of a split are computed once, with the evaluation
+preprocessing at the teacher's image size, and stored by the manifest row of
+the record, the `image/manifest_row` feature written by convert_dataset.py.
+A store is made of:
+
+  teacher.json   the parameters the logits were computed with.
+  rows.npy       the sorted manifest rows of the records.
+  logits.npy     the float16 logits of every row, without top-k.
+  top_k_logits.npy, top_k_classes.npy
+                 the k largest logits of every row and their classes, with
+                 top-k. The other classes get no probability in the soft
+                 targets.
+
+The student sees augmented crops of the images the teacher saw whole, the
+usual trade-off of offline distillation.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import numpy as np
+import tensorflow as tf
+
+from datasets import fgvc
+
+TEACHER_METADATA_FILENAME = 'teacher.json'
+
+_ROWS_FILENAME = 'rows.npy'
+
+_LOGITS_FILENAME = 'logits.npy'
+
+_TOP_K_LOGITS_FILENAME = 'top_k_logits.npy'
+
+_TOP_K_CLASSES_FILENAME = 'top_k_classes.npy'
+
+
+def read_store_metadata(store_dir):
+  """Reads the metadata file of a teacher logits store.
+
+  Args:
+    store_dir: The directory of the store.
+
+  Returns:
+    The metadata dict, or None if the store is missing or incomplete.
+  """
+  metadata_filename = os.path.join(store_dir, TEACHER_METADATA_FILENAME)
+  if not tf.gfile.Exists(metadata_filename):
+    return None
+  try:
+    with tf.gfile.Open(metadata_filename, 'r') as f:
+      return json.loads(f.read())
+  except ValueError:
+    return None
+
+
+def build_store(store_dir,
+                dataset,
+                network_fn,
+                image_size,
+                preprocessing_fn,
+                checkpoint_path,
+                top_k=0,
+                batch_size=32,
+                num_preprocessing_threads=4,
+                model_name=None):
+  """Computes the teacher logits of a split, unless they are up to date.
+
+  The metadata file is written last, so an interrupted computation is started
+  over on the next call.
+
+  Args:
+    store_dir: The local directory of the store.
+    dataset: A `Dataset` returned by `fgvc.get_split`.
+    network_fn: The teacher function returned by
+      `nets_factory.get_network_fn` with `is_training=False`.
+    image_size: The height and width of the teacher's images.
+    preprocessing_fn: The evaluation preprocessing of the teacher.
+    checkpoint_path: The checkpoint, or directory of checkpoints, of the
+      teacher.
+    top_k: The number of largest logits kept per record, or 0 for all.
+    batch_size: The number of images run through the teacher at once.
+    num_preprocessing_threads: The number of images preprocessed in parallel.
+    model_name: The name of the teacher network, recorded in the metadata.
+
+  Returns:
+    The metadata dict of the store.
+
+  Raises:
+    ValueError: If the records have no manifest row or the split does not
+      hold `dataset.num_samples` records.
+  """
+  if tf.gfile.IsDirectory(checkpoint_path):
+    checkpoint_path = tf.train.latest_checkpoint(checkpoint_path)
+  metadata = {
+      'model_name': model_name,
+      'image_size': image_size,
+      'top_k': top_k,
+      'num_samples': dataset.num_samples,
+      'checkpoint_path': checkpoint_path,
+  }
+  existing_metadata = read_store_metadata(store_dir)
+  if existing_metadata is not None and all(
+      existing_metadata.get(key) == value for key, value in metadata.items()):
+    tf.logging.info('Reusing the teacher logits in %s', store_dir)
+    return existing_metadata
+
+  metadata_filename = os.path.join(store_dir, TEACHER_METADATA_FILENAME)
+  if tf.gfile.Exists(metadata_filename):
+    tf.gfile.Remove(metadata_filename)
+  tf.gfile.MakeDirs(store_dir)
+
+  num_samples = dataset.num_samples
+
+  def _parse(record):
+    image_buffer, image_format, _, row = fgvc.parse_record(
+        record, with_manifest_row=True)
+    image = fgvc.decode_image(image_buffer, image_format)
+    return preprocessing_fn(image, image_size, image_size), row
+
+  with tf.Graph().as_default():
+    files = tf.data.Dataset.list_files(dataset.data_sources, shuffle=False)
+    records = files.flat_map(tf.data.TFRecordDataset)
+    batches = records.map(_parse, num_parallel_calls=num_preprocessing_threads)
+    batches = batches.batch(batch_size).prefetch(1)
+    images, rows = batches.make_one_shot_iterator().get_next()
+    logits, _ = network_fn(images)
+    metadata['num_classes'] = logits.shape[1].value
+    if top_k:
+      top_k_logits, top_k_classes = tf.nn.top_k(logits, k=top_k)
+      outputs = [top_k_logits, top_k_classes]
+    else:
+      outputs = [tf.cast(logits, tf.float16)]
+
+    all_rows, all_outputs = [], [[] for _ in outputs]
+    with tf.Session() as sess:
+      tf.logging.info('Computing the teacher logits of %d records from %s',
+                      num_samples, checkpoint_path)
+      tf.train.Saver().restore(sess, checkpoint_path)
+      while True:
+        try:
+          batch_rows, batch_outputs = sess.run([rows, outputs])
+        except tf.errors.OutOfRangeError:
+          break
+        if np.any(batch_rows < 0):
+          raise ValueError('The records have no manifest row, the dataset must '
+                           'be converted again with convert_dataset.py')
+        all_rows.append(batch_rows)
+        for output, batch_output in zip(all_outputs, batch_outputs):
+          output.append(batch_output)
+
+  all_rows = np.concatenate(all_rows)
+  if len(all_rows) != num_samples:
+    raise ValueError('The split holds %d records, expected %d' %
+                     (len(all_rows), num_samples))
+  order = np.argsort(all_rows)
+  np.save(os.path.join(store_dir, _ROWS_FILENAME), all_rows[order])
+  filenames = ([_TOP_K_LOGITS_FILENAME, _TOP_K_CLASSES_FILENAME] if top_k
+               else [_LOGITS_FILENAME])
+  for filename, output in zip(filenames, all_outputs):
+    np.save(os.path.join(store_dir, filename), np.concatenate(output)[order])
+
+  with tf.gfile.Open(metadata_filename, 'w') as f:
+    f.write(json.dumps(metadata, indent=2, sort_keys=True))
+  return metadata
+
+
+def get_soft_targets_fn(store_dir, temperature=1.0):
+  """Returns a function mapping manifest rows to teacher soft targets.
+
+  Args:
+    store_dir: The directory of a store written by `build_store`.
+    temperature: The temperature of the teacher softmax.
+
+  Returns:
+    A function taking an int64 Tensor of manifest rows of shape [batch_size]
+    and returning the float Tensor of the teacher probabilities of shape
+    [batch_size, num_classes].
+
+  Raises:
+    ValueError: If there is no complete store in `store_dir`.
+  """
+  metadata = read_store_metadata(store_dir)
+  if metadata is None:
+    raise ValueError('There are no teacher logits in %s' % store_dir)
+  num_classes = metadata['num_classes']
+  stored_rows = np.load(os.path.join(store_dir, _ROWS_FILENAME))
+  if metadata['top_k']:
+    top_k_logits = np.load(os.path.join(store_dir, _TOP_K_LOGITS_FILENAME),
+                           mmap_mode='r')
+    top_k_classes = np.load(os.path.join(store_dir, _TOP_K_CLASSES_FILENAME),
+                            mmap_mode='r')
+  else:
+    logits = np.load(os.path.join(store_dir, _LOGITS_FILENAME), mmap_mode='r')
+
+  def _softmax(batch_logits):
+    batch_logits = batch_logits.astype(np.float32) / temperature
+    batch_logits -= batch_logits.max(axis=1, keepdims=True)
+    probabilities = np.exp(batch_logits)
+    return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+  def _soft_targets(rows):
+    indices = np.searchsorted(stored_rows, rows)
+    indices = np.minimum(indices, len(stored_rows) - 1)
+    missing = stored_rows[indices] != rows
+    if np.any(missing):
+      raise ValueError('No teacher logits for the manifest rows %s' %
+                       rows[missing])
+    if not metadata['top_k']:
+      return _softmax(logits[indices])
+    soft_targets = np.zeros((len(rows), num_classes), dtype=np.float32)
+    soft_targets[np.arange(len(rows))[:, np.newaxis],
+                 top_k_classes[indices]] = _softmax(top_k_logits[indices])
+    return soft_targets
+
+  def soft_targets_fn(rows):
+    soft_targets = tf.py_func(_soft_targets, [rows], tf.float32,
+                              stateful=False)
+    soft_targets.set_shape(rows.shape.concatenate([num_classes]))
+    return soft_targets
+
+  return soft_targets_fn
@@ -0,0 +1,206 @@
+"""Synchronous data parallelism between training processes on one host.
+
+Every worker process builds the same graph on its own shards of the dataset.
+The gradients of a step are averaged across the workers through a file in
+shared memory before they are applied, so the workers apply identical updates
+and their variables stay identical without any parameter server:
+
+  1. every worker writes its flattened gradients to its row of the buffer;
+  2. after a barrier, worker k averages the k-th slice of all the rows into
+     the result row;
+  3. after a second barrier, every worker reads the whole result row.
+
+The variables are broadcast from worker 0 to the others whenever a session is
+created, which covers fine-tuning from a checkpoint, randomly initialized
+layers and the restore of worker 0 from its train_dir alike.
+
+Usage:
+
+  # In the launching process, before starting the workers.
+  barrier = multiprocessing.get_context('spawn').Barrier(num_workers)
+
+  # In every worker.
+  allreduce = local_allreduce.LocalAllReduce(
+      num_workers, rank, barrier, buffer_filename)
+  grads_and_vars = allreduce.all_reduce(grads_and_vars)
+  train_op = optimizer.apply_gradients(grads_and_vars)
+  broadcast_hook = local_allreduce.BroadcastVariablesHook(
+      allreduce.broadcast(tf.global_variables()))
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import tempfile
+import numpy as np
+import tensorflow as tf
+
+# The seconds a worker waits for the others at a barrier before giving up.
+_TIMEOUT_SECS = 600
+
+# The largest number of float32 words a broadcast copies at once.
+_BROADCAST_ROW_SIZE = 1 << 22
+
+
+def _buffer_directory():
+  """Returns /dev/shm when available, and the temporary directory otherwise."""
+  if os.path.isdir('/dev/shm'):
+    return '/dev/shm'
+  return tempfile.gettempdir()
+
+
+def buffer_filename(name):
+  """Returns the path of a shared buffer file named `name`."""
+  return os.path.join(_buffer_directory(), name)
+
+
+def _to_words(tensor):
+  """Bitcasts a Tensor to a flat float32 Tensor of the same bytes."""
+  if tensor.dtype.base_dtype != tf.float32:
+    tensor = tf.bitcast(tensor, tf.float32)
+  return tf.reshape(tensor, [-1])
+
+
+def _from_words(words, shape, dtype):
+  """Inverts `_to_words` for a Tensor of static `shape` and `dtype`."""
+  if dtype == tf.float32:
+    return tf.reshape(words, shape)
+  ratio = dtype.size // 4
+  words = tf.reshape(words, shape.as_list() + ([ratio] if ratio > 1 else []))
+  return tf.bitcast(words, dtype)
+
+
+class LocalAllReduce(object):
+  """Averages gradients and broadcasts variables between local processes.
+
+  The buffer file is created by worker 0 on the first collective op run, with
+  one row per worker and a result row as large as the largest collective op of
+  the graph, so every worker must build the same graph and run the same
+  sequence of collective ops.
+  """
+
+  def __init__(self, num_workers, rank, barrier, filename,
+               timeout_secs=_TIMEOUT_SECS):
+    """Creates a LocalAllReduce.
+
+    Args:
+      num_workers: The number of worker processes.
+      rank: The index of this worker, in [0, num_workers).
+      barrier: A `multiprocessing.Barrier` shared by the `num_workers`
+        workers.
+      filename: The path of the buffer file, identical in all the workers.
+      timeout_secs: The seconds to wait for the other workers at a barrier.
+    """
+    self._num_workers = num_workers
+    self._rank = rank
+    self._barrier = barrier
+    self._filename = filename
+    self._timeout_secs = timeout_secs
+    self._size = 1
+    self._buffer = None
+
+  def _wait(self):
+    self._barrier.wait(self._timeout_secs)
+
+  def _open(self):
+    """Creates or maps the buffer file, once all the graphs are built."""
+    shape = (self._num_workers + 1, self._size)
+    if self._rank == 0:
+      self._buffer = np.memmap(self._filename, dtype=np.float32, mode='w+',
+                               shape=shape)
+    self._wait()
+    if self._rank != 0:
+      self._buffer = np.memmap(self._filename, dtype=np.float32, mode='r+',
+                               shape=shape)
+
+  def _reduce(self, values):
+    """Returns the mean of `values` over all the workers."""
+    if self._buffer is None:
+      self._open()
+    size = len(values)
+    self._buffer[self._rank, :size] = values
+    self._wait()
+    start = self._rank * size // self._num_workers
+    end = (self._rank + 1) * size // self._num_workers
+    self._buffer[-1, start:end] = np.mean(
+        self._buffer[:-1, start:end], axis=0)
+    self._wait()
+    return np.array(self._buffer[-1, :size])
+
+  def _broadcast(self, values):
+    """Returns the `values` of worker 0, copied row by row."""
+    if self._buffer is None:
+      self._open()
+    values = np.array(values)
+    for start in range(0, len(values), self._size):
+      end = min(start + self._size, len(values))
+      if self._rank == 0:
+        self._buffer[-1, :end - start] = values[start:end]
+      self._wait()
+      values[start:end] = self._buffer[-1, :end - start]
+      self._wait()
+    return values
+
+  def all_reduce(self, grads_and_vars):
+    """Averages a list of (gradient, variable) across the workers.
+
+    Args:
+      grads_and_vars: The list of (gradient, variable) of this worker, as
+        returned by `model_deploy.optimize_clones`.
+
+    Returns:
+      The list of (mean gradient, variable), in the same order.
+    """
+    grads = []
+    for grad, _ in grads_and_vars:
+      if isinstance(grad, tf.IndexedSlices):
+        grad = tf.convert_to_tensor(grad)
+      grads.append(tf.cast(grad, tf.float32))
+    sizes = [grad.shape.num_elements() for grad in grads]
+    self._size = max(self._size, sum(sizes))
+    with tf.name_scope('local_allreduce'):
+      flat_grads = tf.concat([tf.reshape(grad, [-1]) for grad in grads], 0)
+      mean_grads = tf.py_func(self._reduce, [flat_grads], tf.float32,
+                              stateful=True)
+      mean_grads.set_shape(flat_grads.shape)
+      return [
+          (tf.cast(tf.reshape(mean_grad, var.shape), var.dtype.base_dtype),
+           var)
+          for mean_grad, (_, var) in zip(tf.split(mean_grads, sizes),
+                                         grads_and_vars)]
+
+  def broadcast(self, variables):
+    """Returns an op assigning the values of worker 0 to `variables`.
+
+    Args:
+      variables: A list of variables. Those whose dtype is not a multiple of
+        4 bytes, e.g. booleans, are left out.
+
+    Returns:
+      The broadcast op.
+    """
+    variables = [var for var in variables
+                 if var.dtype.base_dtype.size % 4 == 0]
+    with tf.name_scope('local_broadcast'):
+      words = [_to_words(var.read_value()) for var in variables]
+      sizes = [word.shape.num_elements() for word in words]
+      self._size = max(self._size, min(sum(sizes), _BROADCAST_ROW_SIZE))
+      flat_words = tf.concat(words, 0)
+      broadcast_words = tf.py_func(self._broadcast, [flat_words], tf.float32,
+                                   stateful=True)
+      broadcast_words.set_shape(flat_words.shape)
+      return tf.group(*[
+          tf.assign(var, _from_words(word, var.shape, var.dtype.base_dtype))
+          for word, var in zip(tf.split(broadcast_words, sizes), variables)])
+
+
+class BroadcastVariablesHook(tf.train.SessionRunHook):
+  """Runs a `LocalAllReduce.broadcast` op once every session is created."""
+
+  def __init__(self, broadcast_op):
+    self._broadcast_op = broadcast_op
+
+  def after_create_session(self, session, coord):
+    session.run(self._broadcast_op)
@@ -0,0 +1,132 @@
+"""Tests for local_allreduce."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import os
+import traceback
+import numpy as np
+import tensorflow as tf
+
+from deployment import local_allreduce
+
+# The seconds the test waits for the result of a worker.
+_WORKER_TIMEOUT_SECS = 300
+
+
+def _run_worker(worker_fn, num_workers, rank, barrier, filename, queue):
+  """Puts the result of `worker_fn(rank, allreduce)`, or its error, in queue."""
+  try:
+    with tf.Graph().as_default():
+      allreduce = local_allreduce.LocalAllReduce(
+          num_workers, rank, barrier, filename, timeout_secs=60)
+      queue.put((rank, worker_fn(rank, allreduce), None))
+  except Exception:  # pylint: disable=broad-except
+    barrier.abort()
+    queue.put((rank, None, traceback.format_exc()))
+
+
+# The workers of the tests, defined at the top level to be run in spawned
+# processes.
+
+
+def _average_gradients(rank, allreduce):
+  weights = tf.Variable(tf.zeros([2, 3]))
+  biases = tf.Variable(tf.zeros([3]))
+  grads_and_vars = allreduce.all_reduce([
+      (tf.fill([2, 3], float(rank)), weights),
+      (tf.constant([1.0, 2.0, 3.0]) * (rank + 1), biases)])
+  with tf.Session() as sess:
+    return sess.run([grad for grad, _ in grads_and_vars])
+
+
+def _average_indexed_slices(rank, allreduce):
+  embeddings = tf.Variable(tf.zeros([4, 2]))
+  grad = tf.IndexedSlices(tf.fill([1, 2], float(rank + 1)),
+                          tf.constant([rank]), tf.constant([4, 2]))
+  [(mean_grad, _)] = allreduce.all_reduce([(grad, embeddings)])
+  with tf.Session() as sess:
+    return sess.run(mean_grad)
+
+
+def _broadcast_variables(rank, allreduce):
+  weights = tf.Variable(tf.fill([5], float(rank + 1)))
+  step = tf.Variable(np.int64(10 ** 12 + rank))
+  broadcast_op = allreduce.broadcast([weights, step])
+  with tf.Session() as sess:
+    sess.run(tf.global_variables_initializer())
+    sess.run(broadcast_op)
+    return sess.run([weights, step])
+
+
+def _broadcast_in_several_rows(rank, allreduce):
+  # Set in the worker process, whose module is imported afresh.
+  local_allreduce._BROADCAST_ROW_SIZE = 3
+  weights = tf.Variable(tf.range(10, dtype=tf.float32) * (rank + 1))
+  broadcast_op = allreduce.broadcast([weights])
+  with tf.Session() as sess:
+    sess.run(tf.global_variables_initializer())
+    sess.run(broadcast_op)
+    return sess.run(weights)
+
+
+class LocalAllReduceTest(tf.test.TestCase):
+
+  def _runWorkers(self, num_workers, worker_fn):
+    """Runs `worker_fn(rank, allreduce)` in one spawned process per worker."""
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(num_workers)
+    queue = context.Queue()
+    filename = os.path.join(self.get_temp_dir(), 'allreduce_buffer')
+    processes = [
+        context.Process(target=_run_worker,
+                        args=(worker_fn, num_workers, rank, barrier, filename,
+                              queue))
+        for rank in range(num_workers)]
+    for process in processes:
+      process.start()
+    results = [None] * num_workers
+    errors = []
+    try:
+      # The results are read before the join, which waits for the queue.
+      for _ in range(num_workers):
+        rank, result, error = queue.get(timeout=_WORKER_TIMEOUT_SECS)
+        results[rank] = result
+        if error:
+          errors.append('Worker %d failed:\n%s' % (rank, error))
+    finally:
+      for process in processes:
+        process.join(_WORKER_TIMEOUT_SECS)
+        if process.is_alive():
+          process.terminate()
+    if errors:
+      self.fail('\n'.join(errors))
+    return results
+
+  def testAllReduceAveragesGradients(self):
+    results = self._runWorkers(3, _average_gradients)
+    for weights_grad, biases_grad in results:
+      self.assertAllClose(weights_grad, np.ones([2, 3]))
+      self.assertAllClose(biases_grad, [2.0, 4.0, 6.0])
+
+  def testAllReduceConvertsIndexedSlices(self):
+    results = self._runWorkers(2, _average_indexed_slices)
+    for mean_grad in results:
+      self.assertAllClose(mean_grad, [[0.5, 0.5], [1.0, 1.0], [0, 0], [0, 0]])
+
+  def testBroadcastCopiesTheFirstWorker(self):
+    results = self._runWorkers(3, _broadcast_variables)
+    for weights, step in results:
+      self.assertAllEqual(weights, np.ones([5]))
+      self.assertEqual(step, 10 ** 12)
+
+  def testBroadcastLargerThanTheBuffer(self):
+    results = self._runWorkers(2, _broadcast_in_several_rows)
+    for weights in results:
+      self.assertAllEqual(weights, np.arange(10))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,263 @@
+"""Removes output channels of convolutions and the weights that read them.
+
+A convolution followed by its batch norm and activation can lose output
+channels when every op reading them only moves them around (pooling,
+concatenation, reshape to a vector) before they reach the input of other
+convolutions or fully connected layers. The channels are traced through the
+graph of the network to find these consumers and the offset of the channels
+in their input, which the concatenations of the inception blocks shift.
+
+The pruned variables have the shapes of the network built with the channel
+config of `get_channel_config`, see `inception_utils.conv2d`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import fnmatch
+import numpy as np
+import tensorflow as tf
+
+# A convolution whose output channels can be removed, with the `Consumer`s of
+# its output.
+PrunableConv = collections.namedtuple(
+    'PrunableConv', ['scope', 'num_channels', 'consumers'])
+
+# A layer reading the channels of a `PrunableConv` from `offset` on, along the
+# `axis` of its weights.
+Consumer = collections.namedtuple('Consumer', ['scope', 'offset', 'axis'])
+
+# The ops between a convolution and the output whose channels are pruned.
+_CONV_OUTPUT_OP_TYPES = ('FusedBatchNorm', 'FusedBatchNormV2',
+                         'FusedBatchNormV3', 'BiasAdd', 'Relu', 'Relu6')
+
+# The ops that keep every channel of their input at its place.
+_CHANNEL_PRESERVING_OP_TYPES = ('MaxPool', 'AvgPool', 'Identity', 'Relu',
+                                'Mean', 'Reshape', 'Squeeze')
+
+# The variables of a convolution indexed by its output channels.
+_OUTPUT_CHANNEL_VARIABLES = ('weights', 'biases', 'BatchNorm/beta',
+                             'BatchNorm/gamma', 'BatchNorm/moving_mean',
+                             'BatchNorm/moving_variance')
+
+
+# The ops reading a variable between the variable and the layer using it.
+_VARIABLE_READ_OP_TYPES = ('Identity', 'ReadVariableOp')
+
+
+def get_variable_scope(op):
+  """Returns the variable scope of a convolution or fully connected layer.
+
+  The op names of the inception networks repeat the name of the network, e.g.
+  'InceptionV3/InceptionV3/Mixed_5b/...', but not the names of their
+  variables, so the scope is the one of the weights the op reads.
+
+  Args:
+    op: A Conv2D, DepthwiseConv2dNative or MatMul op.
+
+  Returns:
+    The scope of the variable read as the second input of `op`, or the scope
+    of the op name if it reads no variable.
+  """
+  weights_op = op.inputs[1].op
+  while weights_op.type in _VARIABLE_READ_OP_TYPES and weights_op.inputs:
+    weights_op = weights_op.inputs[0].op
+  if weights_op.type not in ('VariableV2', 'VarHandleOp'):
+    return op.name.rsplit('/', 1)[0]
+  return weights_op.name.rsplit('/', 1)[0]
+
+
+def _num_channels(tensor):
+  return tensor.shape[-1].value
+
+
+def _conv_output(conv_op):
+  """Returns the output of the batch norm and activation of a convolution."""
+  output = conv_op.outputs[0]
+  while True:
+    consumers = output.consumers()
+    if len(consumers) != 1 or consumers[0].type not in _CONV_OUTPUT_OP_TYPES:
+      return output
+    output = consumers[0].outputs[0]
+
+
+def _trace_consumers(tensor, offset):
+  """Returns the `Consumer`s of the channels of `tensor`.
+
+  Args:
+    tensor: A Tensor whose last dimension holds channels.
+    offset: The index of the first channel of `tensor` in the pruned output.
+
+  Returns:
+    The list of `Consumer`s, or None if an op uses the channels otherwise.
+  """
+  consumers = []
+  for op in tensor.consumers():
+    if op.type == 'Shape':
+      continue
+    if op.type == 'Conv2D' and op.inputs[0] is tensor:
+      consumers.append(Consumer(get_variable_scope(op), offset, 2))
+    elif op.type == 'MatMul' and op.inputs[0] is tensor:
+      consumers.append(Consumer(get_variable_scope(op), offset, 0))
+    elif (op.type in _CHANNEL_PRESERVING_OP_TYPES and
+          op.inputs[0] is tensor and
+          _num_channels(op.outputs[0]) == _num_channels(tensor)):
+      traced = _trace_consumers(op.outputs[0], offset)
+      if traced is None:
+        return None
+      consumers.extend(traced)
+    elif op.type == 'ConcatV2':
+      axis = tf.contrib.util.constant_value(op.inputs[-1])
+      if axis is None or axis % len(tensor.shape) != len(tensor.shape) - 1:
+        return None
+      concat_offset = 0
+      for concat_input in op.inputs[:-1]:
+        if concat_input is tensor:
+          break
+        concat_offset += _num_channels(concat_input)
+      traced = _trace_consumers(op.outputs[0], offset + concat_offset)
+      if traced is None:
+        return None
+      consumers.extend(traced)
+    else:
+      return None
+  return consumers
+
+
+def find_prunable_convs(graph, scope_patterns=None):
+  """Finds the convolutions of a graph whose output channels can be removed.
+
+  Args:
+    graph: The graph of the network, built for inference with static shapes.
+    scope_patterns: An optional list of fnmatch patterns of the variable scopes
+      of the convolutions to prune, all the prunable ones if None.
+
+  Returns:
+    A list of `PrunableConv`, in the order of the graph.
+  """
+  prunable_convs = []
+  for op in graph.get_operations():
+    if op.type != 'Conv2D':
+      continue
+    scope = get_variable_scope(op)
+    if scope_patterns and not any(fnmatch.fnmatch(scope, pattern)
+                                  for pattern in scope_patterns):
+      continue
+    output = _conv_output(op)
+    consumers = _trace_consumers(output, 0)
+    if consumers:
+      prunable_convs.append(
+          PrunableConv(scope, _num_channels(output), consumers))
+  return prunable_convs
+
+
+def select_channels(get_tensor,
+                    prunable_convs,
+                    prune_ratio,
+                    criterion='l1',
+                    channel_round=8,
+                    min_channels=8):
+  """Selects the output channels kept by every prunable convolution.
+
+  Args:
+    get_tensor: A function returning the value of a variable from its name,
+      such as the `get_tensor` of a checkpoint reader.
+    prunable_convs: The list of `PrunableConv` to prune.
+    prune_ratio: The fraction of the channels of every convolution removed,
+      or a dict from the scopes of the convolutions to their fraction, 0 for
+      the missing ones.
+    criterion: The importance of a channel, either "l1" for the L1 norm of its
+      filter or "bn_gamma" for the magnitude of its batch norm scale.
+    channel_round: The numbers of kept channels are rounded up to a multiple
+      of it.
+    min_channels: The smallest number of channels kept by a convolution.
+
+  Returns:
+    A dict from the scopes of the convolutions to the sorted array of the
+    indices of their kept channels.
+
+  Raises:
+    ValueError: If `criterion` is not recognized, or if it is "bn_gamma" and
+      a batch norm has no scale.
+  """
+  kept_channels = {}
+  for conv in prunable_convs:
+    if criterion == 'l1':
+      weights = get_tensor(conv.scope + '/weights')
+      scores = np.abs(weights).sum(axis=(0, 1, 2))
+    elif criterion == 'bn_gamma':
+      gamma_name = conv.scope + '/BatchNorm/gamma'
+      try:
+        gamma = get_tensor(gamma_name)
+      except (KeyError, tf.errors.NotFoundError):
+        # The inception networks build their batch norms without scale.
+        raise ValueError('The bn_gamma criterion requires %s, a batch norm '
+                         'with scale=True' % gamma_name)
+      scores = np.abs(gamma)
+    else:
+      raise ValueError('Pruning criterion [%s] was not recognized' % criterion)
+    ratio = (prune_ratio.get(conv.scope, 0.) if isinstance(prune_ratio, dict)
+             else prune_ratio)
+    num_kept = int(np.ceil(conv.num_channels * (1 - ratio) /
+                           channel_round)) * channel_round
+    num_kept = min(max(num_kept, min_channels), conv.num_channels)
+    kept_channels[conv.scope] = np.sort(np.argsort(-scores)[:num_kept])
+  return kept_channels
+
+
+def get_channel_config(prunable_convs, kept_channels):
+  """Returns the channel config of the pruned network.
+
+  Args:
+    prunable_convs: The list of `PrunableConv` of the network.
+    kept_channels: The dict returned by `select_channels`.
+
+  Returns:
+    A dict from the scopes of the prunable convolutions to their number of
+    output channels.
+  """
+  return {conv.scope: int(len(kept_channels.get(
+      conv.scope, range(conv.num_channels)))) for conv in prunable_convs}
+
+
+def prune_variables(get_tensor, variable_names, prunable_convs, kept_channels):
+  """Removes the pruned channels from the values of the variables.
+
+  Args:
+    get_tensor: A function returning the value of a variable from its name.
+    variable_names: The names of the variables of the network.
+    prunable_convs: The list of `PrunableConv` of the network.
+    kept_channels: The dict returned by `select_channels`.
+
+  Returns:
+    A dict from the variable names to their pruned numpy values.
+  """
+  input_masks = {}
+  for conv in prunable_convs:
+    if conv.scope not in kept_channels:
+      continue
+    removed = np.setdiff1d(np.arange(conv.num_channels),
+                           kept_channels[conv.scope])
+    for consumer in conv.consumers:
+      if consumer.scope not in input_masks:
+        num_inputs = get_tensor(consumer.scope + '/weights').shape[
+            consumer.axis]
+        input_masks[consumer.scope] = (np.ones(num_inputs, dtype=bool),
+                                       consumer.axis)
+      input_masks[consumer.scope][0][consumer.offset + removed] = False
+
+  values = {}
+  for name in variable_names:
+    value = get_tensor(name)
+    scope, variable = name.rsplit('/', 1)
+    if scope.endswith('/BatchNorm'):
+      scope, variable = scope[:-len('/BatchNorm')], 'BatchNorm/' + variable
+    if scope in kept_channels and variable in _OUTPUT_CHANNEL_VARIABLES:
+      value = value.take(kept_channels[scope], axis=-1)
+    if scope in input_masks and variable == 'weights':
+      mask, axis = input_masks[scope]
+      value = value.compress(mask, axis=axis)
+    values[name] = value
+  return values
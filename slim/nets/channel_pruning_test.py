@@ -0,0 +1,126 @@
+"""Tests for channel_pruning."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from nets import channel_pruning
+from nets import inception
+
+slim = tf.contrib.slim
+
+
+def _build_block(inputs, channel_config=None):
+  """Builds a small inception-like block followed by a classifier."""
+  channel_config = channel_config or {}
+  def conv2d(net, num_outputs, scope):
+    return slim.conv2d(net, channel_config.get(scope, num_outputs), [1, 1],
+                       normalizer_fn=slim.batch_norm,
+                       normalizer_params={'is_training': False}, scope=scope)
+  branch_0 = conv2d(inputs, 8, 'Branch_0')
+  branch_1 = conv2d(conv2d(inputs, 8, 'Branch_1a'), 16, 'Branch_1b')
+  branch_2 = slim.max_pool2d(inputs, [3, 3], stride=1, padding='SAME')
+  net = tf.concat(axis=3, values=[branch_0, branch_1, branch_2])
+  net = conv2d(net, 8, 'Mixed')
+  net = slim.avg_pool2d(net, [4, 4], padding='VALID')
+  net = slim.flatten(net)
+  return slim.fully_connected(net, 5, activation_fn=None, scope='Logits')
+
+
+class ChannelPruningTest(tf.test.TestCase):
+
+  def testFindPrunableConvsFollowsTheConcatenation(self):
+    with tf.Graph().as_default() as graph:
+      _build_block(tf.placeholder(tf.float32, [1, 4, 4, 3]))
+      convs = {conv.scope: conv
+               for conv in channel_pruning.find_prunable_convs(graph)}
+    self.assertEqual(sorted(convs), ['Branch_0', 'Branch_1a', 'Branch_1b',
+                                     'Mixed'])
+    self.assertEqual(convs['Branch_0'].consumers,
+                     [channel_pruning.Consumer('Mixed', 0, 2)])
+    self.assertEqual(convs['Branch_1a'].consumers,
+                     [channel_pruning.Consumer('Branch_1b', 0, 2)])
+    self.assertEqual(convs['Branch_1b'].consumers,
+                     [channel_pruning.Consumer('Mixed', 8, 2)])
+    self.assertEqual(convs['Mixed'].consumers,
+                     [channel_pruning.Consumer('Logits', 0, 0)])
+
+  def testPrunedVariablesBuildTheThinnerNetwork(self):
+    with tf.Graph().as_default() as graph:
+      inputs = tf.random_uniform([2, 4, 4, 3], seed=1)
+      _build_block(inputs)
+      convs = channel_pruning.find_prunable_convs(graph)
+      with self.test_session(graph=graph) as sess:
+        sess.run(tf.global_variables_initializer())
+        values = {variable.op.name: sess.run(variable)
+                  for variable in tf.global_variables()}
+    kept_channels = channel_pruning.select_channels(
+        values.__getitem__, convs, prune_ratio=0.5, channel_round=2,
+        min_channels=2)
+    self.assertEqual(len(kept_channels['Branch_1b']), 8)
+    channel_config = channel_pruning.get_channel_config(convs, kept_channels)
+    pruned_values = channel_pruning.prune_variables(
+        values.__getitem__, list(values), convs, kept_channels)
+
+    with tf.Graph().as_default():
+      _build_block(tf.placeholder(tf.float32, [2, 4, 4, 3]), channel_config)
+      for variable in tf.global_variables():
+        self.assertEqual(variable.shape.as_list(),
+                         list(pruned_values[variable.op.name].shape))
+    self.assertAllEqual(
+        pruned_values['Mixed/weights'],
+        values['Mixed/weights'].take(
+            np.concatenate([kept_channels['Branch_0'],
+                            8 + kept_channels['Branch_1b'],
+                            np.arange(24, 27)]), axis=2).take(
+                                kept_channels['Mixed'], axis=3))
+
+  def testSelectChannelsWithRatiosPerConvolution(self):
+    with tf.Graph().as_default() as graph:
+      _build_block(tf.placeholder(tf.float32, [1, 4, 4, 3]))
+      convs = channel_pruning.find_prunable_convs(graph)
+    values = {conv.scope + '/weights': np.random.rand(1, 1, 3, 16)
+              for conv in convs}
+    kept_channels = channel_pruning.select_channels(
+        values.__getitem__, convs, {'Branch_1b': 0.75}, channel_round=2,
+        min_channels=2)
+    self.assertEqual(len(kept_channels['Branch_1b']), 4)
+    self.assertEqual(len(kept_channels['Branch_0']), 8)
+
+  def testBnGammaRequiresTheBatchNormScale(self):
+    with tf.Graph().as_default() as graph:
+      _build_block(tf.placeholder(tf.float32, [1, 4, 4, 3]))
+      convs = channel_pruning.find_prunable_convs(graph)
+      values = {variable.op.name: np.ones(variable.shape.as_list())
+                for variable in tf.global_variables()}
+    self.assertNotIn('Branch_0/BatchNorm/gamma', values)
+    with self.assertRaisesRegexp(ValueError, 'Branch_0/BatchNorm/gamma'):
+      channel_pruning.select_channels(values.__getitem__, convs, 0.5,
+                                      criterion='bn_gamma')
+
+  def testInceptionV3ChannelConfig(self):
+    with tf.Graph().as_default() as graph:
+      inception.inception_v3(tf.placeholder(tf.float32, [1, 299, 299, 3]),
+                             num_classes=10, is_training=False)
+      convs = channel_pruning.find_prunable_convs(
+          graph, ['InceptionV3/Mixed_5b/*'])
+    self.assertEqual(len(convs), 7)
+    self.assertEqual(convs[0].scope,
+                     'InceptionV3/Mixed_5b/Branch_0/Conv2d_0a_1x1')
+    self.assertIn(
+        channel_pruning.Consumer(
+            'InceptionV3/Mixed_5c/Branch_0/Conv2d_0a_1x1', 0, 2),
+        convs[0].consumers)
+    channel_config = {conv.scope: 8 for conv in convs}
+    with tf.Graph().as_default():
+      _, end_points = inception.inception_v3(
+          tf.placeholder(tf.float32, [1, 299, 299, 3]), num_classes=10,
+          is_training=False, channel_config=channel_config)
+      self.assertEqual(end_points['Mixed_5b'].shape[-1].value, 8 * 4)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,164 @@
+"""Hierarchical softmax head over the taxonomic classes of the labels.
+
+The head predicts the taxonomic class (Aves, Insecta, ...) of an image with a
+first softmax, then its species with a softmax over the species of that class
+only, so that
+
+  log p(species) = log p(class) + log p(species | class).
+
+It returns these log-probabilities as its logits: their softmax is the
+probability itself, so the usual softmax cross-entropy on them is the negative
+log-likelihood of the hierarchical model, and the argmax is its prediction.
+
+At inference, only the species of the `top_k_groups` most likely classes of
+the images of the batch are computed, which saves most of the last layer of a
+vocabulary of thousands of species. The species of the other classes of an
+image get a log-probability of `MIN_LOG_PROBABILITY`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+slim = tf.contrib.slim
+
+MIN_LOG_PROBABILITY = -1e9
+
+
+def get_label_groups(labels_to_taxa, num_classes, labels_offset=0):
+  """Returns the group of every label and the names of the groups.
+
+  Args:
+    labels_to_taxa: A dict from the dataset labels to the names of their
+      taxonomic class, the `labels_to_taxa` of a `Dataset`.
+    num_classes: The number of classes of the network.
+    labels_offset: The offset subtracted from the dataset labels.
+
+  Returns:
+    A tuple of the list of the group index of every class of the network and
+    the sorted list of the group names.
+
+  Raises:
+    ValueError: If a class has no taxon.
+  """
+  if not labels_to_taxa:
+    raise ValueError('The dataset has no taxon of its labels, it must be '
+                     'converted again with convert_dataset.py')
+  group_names = sorted(set(labels_to_taxa.values()))
+  label_groups = []
+  for label in range(num_classes):
+    if label + labels_offset not in labels_to_taxa:
+      raise ValueError('The label %d has no taxon' % (label + labels_offset))
+    label_groups.append(
+        group_names.index(labels_to_taxa[label + labels_offset]))
+  return label_groups, group_names
+
+
+def _log_softmax_within_groups(logits, groups, num_groups):
+  """Normalizes the logits of every group of classes separately.
+
+  Args:
+    logits: A float Tensor of shape [batch_size, num_classes].
+    groups: An int32 Tensor of shape [num_classes] of the group of every class.
+    num_groups: The number of groups.
+
+  Returns:
+    The log-probabilities of the classes within their group, of the shape of
+    `logits`.
+  """
+  logits = tf.transpose(logits)
+  # The maxima only shift the logits for the stability of the exponential.
+  maxima = tf.stop_gradient(
+      tf.unsorted_segment_max(logits, groups, num_groups))
+  logits -= tf.gather(maxima, groups)
+  sums = tf.unsorted_segment_sum(tf.exp(logits), groups, num_groups)
+  return tf.transpose(logits - tf.log(tf.gather(sums, groups)))
+
+
+def hierarchical_logits(features,
+                        label_groups,
+                        end_points=None,
+                        is_training=True,
+                        top_k_groups=0,
+                        dropout_keep_prob=0.8,
+                        weight_decay=0.0,
+                        scope='HierarchicalLogits'):
+  """Builds the hierarchical head on the features of a network.
+
+  Args:
+    features: The features of the network without its logits layer, of shape
+      [batch_size, num_features] or [batch_size, 1, 1, num_features].
+    label_groups: The list of the group index of every class.
+    end_points: The dict of end points of the network, updated with the ones
+      of the head.
+    is_training: Whether the head is being trained.
+    top_k_groups: If positive and `is_training` is False, the number of most
+      likely groups of every image whose classes are computed.
+    dropout_keep_prob: The fraction of the features kept by the dropout.
+    weight_decay: The l2 coefficient of the weights of the head.
+    scope: The variable scope of the head.
+
+  Returns:
+    A tuple of the float Tensor of the log-probabilities of the classes, of
+    shape [batch_size, num_classes], and the dict of end points, with the
+    `GroupLogits` and `GroupPredictions` of the groups.
+  """
+  end_points = {} if end_points is None else end_points
+  num_classes = len(label_groups)
+  num_groups = max(label_groups) + 1
+  groups = tf.constant(label_groups, dtype=tf.int32)
+
+  with tf.variable_scope(scope, values=[features]):
+    net = slim.flatten(features)
+    net = slim.dropout(net, keep_prob=dropout_keep_prob,
+                       is_training=is_training, scope='Dropout')
+    end_points['PreLogits'] = net
+    group_logits = slim.fully_connected(
+        net, num_groups, activation_fn=None, normalizer_fn=None,
+        weights_regularizer=slim.l2_regularizer(weight_decay),
+        scope='GroupLogits')
+    group_log_probabilities = tf.nn.log_softmax(group_logits)
+    weights = slim.model_variable(
+        'weights', shape=[net.shape[1].value, num_classes],
+        initializer=tf.truncated_normal_initializer(stddev=0.01),
+        regularizer=slim.l2_regularizer(weight_decay))
+    biases = slim.model_variable(
+        'biases', shape=[num_classes], initializer=tf.zeros_initializer())
+
+    if is_training or not 0 < top_k_groups < num_groups:
+      logits = tf.nn.xw_plus_b(net, weights, biases)
+      log_probabilities = (
+          tf.gather(group_log_probabilities, groups, axis=1) +
+          _log_softmax_within_groups(logits, groups, num_groups))
+    else:
+      _, top_groups = tf.nn.top_k(group_logits, k=top_k_groups)
+      is_top_group = tf.reduce_max(
+          tf.one_hot(top_groups, num_groups), axis=1) > 0
+      # The classes of the top groups of any image of the batch.
+      classes = tf.to_int32(tf.where(
+          tf.gather(tf.reduce_any(is_top_group, axis=0), groups))[:, 0])
+      class_groups = tf.gather(groups, classes)
+      logits = tf.nn.xw_plus_b(net, tf.gather(weights, classes, axis=1),
+                               tf.gather(biases, classes))
+      class_log_probabilities = (
+          tf.gather(group_log_probabilities, class_groups, axis=1) +
+          _log_softmax_within_groups(logits, class_groups, num_groups))
+      is_computed = tf.gather(is_top_group, class_groups, axis=1)
+      shape = tf.stack([num_classes, tf.shape(net)[0]])
+      log_probabilities = tf.transpose(tf.scatter_nd(
+          classes[:, tf.newaxis], tf.transpose(class_log_probabilities),
+          shape))
+      is_computed = tf.transpose(tf.scatter_nd(
+          classes[:, tf.newaxis], tf.transpose(tf.to_int32(is_computed)),
+          shape)) > 0
+      log_probabilities = tf.where(
+          is_computed, log_probabilities,
+          tf.fill(tf.shape(log_probabilities), MIN_LOG_PROBABILITY))
+
+  end_points['GroupLogits'] = group_logits
+  end_points['GroupPredictions'] = tf.nn.softmax(group_logits)
+  end_points['Logits'] = log_probabilities
+  end_points['Predictions'] = tf.exp(log_probabilities)
+  return log_probabilities, end_points
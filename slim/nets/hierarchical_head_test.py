@@ -0,0 +1,67 @@
+"""Tests for hierarchical_head."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from nets import hierarchical_head
+
+
+class HierarchicalHeadTest(tf.test.TestCase):
+
+  def testGetLabelGroups(self):
+    labels_to_taxa = {1: 'Insecta', 2: 'Aves', 3: 'Insecta', 4: 'Other'}
+    label_groups, group_names = hierarchical_head.get_label_groups(
+        labels_to_taxa, 4, labels_offset=1)
+    self.assertEqual(group_names, ['Aves', 'Insecta', 'Other'])
+    self.assertEqual(label_groups, [1, 0, 1, 2])
+
+  def testGetLabelGroupsRequiresEveryLabel(self):
+    with self.assertRaises(ValueError):
+      hierarchical_head.get_label_groups({0: 'Aves'}, 2)
+
+  def testLogProbabilitiesAreNormalized(self):
+    label_groups = [0, 1, 0, 2, 1, 1]
+    features = tf.random_normal([4, 8])
+    log_probabilities, end_points = hierarchical_head.hierarchical_logits(
+        features, label_groups, is_training=False)
+    with self.test_session() as sess:
+      sess.run(tf.global_variables_initializer())
+      log_probabilities, group_predictions = sess.run(
+          [log_probabilities, end_points['GroupPredictions']])
+    probabilities = np.exp(log_probabilities)
+    self.assertAllClose(probabilities.sum(axis=1), np.ones(4))
+    # The probability of a group is the sum of the ones of its classes.
+    for group in range(3):
+      self.assertAllClose(
+          probabilities[:, np.array(label_groups) == group].sum(axis=1),
+          group_predictions[:, group])
+
+  def testTopKGroupsMatchesTheFullHead(self):
+    label_groups = [0, 1, 0, 2, 1, 3, 3]
+    features = tf.random_normal([5, 8], seed=1)
+    with tf.variable_scope('head'):
+      full_log_probabilities, end_points = (
+          hierarchical_head.hierarchical_logits(
+              features, label_groups, is_training=False))
+    with tf.variable_scope('head', reuse=True):
+      top_k_log_probabilities, _ = hierarchical_head.hierarchical_logits(
+          features, label_groups, is_training=False, top_k_groups=2)
+    with self.test_session() as sess:
+      sess.run(tf.global_variables_initializer())
+      full, top_k, group_logits = sess.run(
+          [full_log_probabilities, top_k_log_probabilities,
+           end_points['GroupLogits']])
+    top_groups = np.argsort(-group_logits, axis=1)[:, :2]
+    for image in range(5):
+      is_computed = np.isin(label_groups, top_groups[image])
+      self.assertAllClose(top_k[image, is_computed], full[image, is_computed])
+      self.assertTrue(np.all(top_k[image, ~is_computed] ==
+                             hierarchical_head.MIN_LOG_PROBABILITY))
+
+
+if __name__ == '__main__':
+  tf.test.main()
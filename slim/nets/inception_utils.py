@@ -24,6 +24,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import json
+
 import tensorflow as tf
 
 slim = tf.contrib.slim
@@ -76,3 +78,43 @@ def inception_arg_scope(weight_decay=0.00004,
         normalizer_fn=normalizer_fn,
         normalizer_params=normalizer_params) as sc:
       return sc
+
+
+@slim.add_arg_scope
+def conv2d(inputs, num_outputs, kernel_size, channel_config=None, **kwargs):
+  """`slim.conv2d` whose number of outputs can be set by a channel config.
+
+  The inception networks build their convolutions with this function, so that
+  the networks thinned by structured_prune.py can be built from the channel
+  config written next to their checkpoint.
+
+  Args:
+    inputs: The input Tensor of the convolution.
+    num_outputs: The number of output channels of the full network.
+    kernel_size: The height and width of the kernel.
+    channel_config: A dict from the variable scopes of convolutions, such as
+      'InceptionV3/Mixed_5b/Branch_1/Conv2d_0a_1x1', to their number of output
+      channels. The convolutions that are not in it keep `num_outputs`.
+    **kwargs: The other arguments of `slim.conv2d`, including its `scope`.
+
+  Returns:
+    The output Tensor of the convolution.
+  """
+  if channel_config:
+    name = '%s/%s' % (tf.get_variable_scope().name, kwargs['scope'])
+    num_outputs = channel_config.get(name, num_outputs)
+  return slim.conv2d(inputs, num_outputs, kernel_size, **kwargs)
+
+
+def read_channel_config(filename):
+  """Reads the channel config written by structured_prune.py.
+
+  Args:
+    filename: The JSON file of the channel config.
+
+  Returns:
+    The channel config dict, to give as `channel_config` to the inception
+    networks.
+  """
+  with tf.gfile.Open(filename, 'r') as f:
+    return json.loads(f.read())['channels']
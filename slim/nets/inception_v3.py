@@ -24,13 +24,15 @@ from nets import inception_utils
 
 slim = tf.contrib.slim
 trunc_normal = lambda stddev: tf.truncated_normal_initializer(0.0, stddev)
+conv2d = inception_utils.conv2d
 
 
 def inception_v3_base(inputs,
                       final_endpoint='Mixed_7c',
                       min_depth=16,
                       depth_multiplier=1.0,
-                      scope=None):
+                      scope=None,
+                      channel_config=None):
   """Inception model from http://arxiv.org/abs/1512.00567.
 
   Constructs an Inception v3 network from inputs to the given final endpoint.
@@ -78,6 +80,9 @@ def inception_v3_base(inputs,
       usage will be to set this value in (0, 1) to reduce the number of
       parameters or computation cost of the model.
     scope: Optional variable_scope.
+    channel_config: Optional dict from the variable scopes of convolutions to
+      their number of output channels, overriding the ones above. See
+      `inception_utils.conv2d`.
 
   Returns:
     tensor_out: output tensor corresponding to the final_endpoint.
@@ -96,22 +101,23 @@ def inception_v3_base(inputs,
     raise ValueError('depth_multiplier is not greater than zero.')
   depth = lambda d: max(int(d * depth_multiplier), min_depth)
 
-  with tf.variable_scope(scope, 'InceptionV3', [inputs]):
+  with tf.variable_scope(scope, 'InceptionV3', [inputs]), slim.arg_scope(
+      [conv2d], channel_config=channel_config):
     with slim.arg_scope([slim.conv2d, slim.max_pool2d, slim.avg_pool2d],
                         stride=1, padding='VALID'):
       # 299 x 299 x 3
       end_point = 'Conv2d_1a_3x3'
-      net = slim.conv2d(inputs, depth(32), [3, 3], stride=2, scope=end_point)
+      net = conv2d(inputs, depth(32), [3, 3], stride=2, scope=end_point)
       end_points[end_point] = net
       if end_point == final_endpoint: return net, end_points
       # 149 x 149 x 32
       end_point = 'Conv2d_2a_3x3'
-      net = slim.conv2d(net, depth(32), [3, 3], scope=end_point)
+      net = conv2d(net, depth(32), [3, 3], scope=end_point)
       end_points[end_point] = net
       if end_point == final_endpoint: return net, end_points
       # 147 x 147 x 32
       end_point = 'Conv2d_2b_3x3'
-      net = slim.conv2d(net, depth(64), [3, 3], padding='SAME', scope=end_point)
+      net = conv2d(net, depth(64), [3, 3], padding='SAME', scope=end_point)
       end_points[end_point] = net
       if end_point == final_endpoint: return net, end_points
       # 147 x 147 x 64
@@ -121,12 +127,12 @@ def inception_v3_base(inputs,
       if end_point == final_endpoint: return net, end_points
       # 73 x 73 x 64
       end_point = 'Conv2d_3b_1x1'
-      net = slim.conv2d(net, depth(80), [1, 1], scope=end_point)
+      net = conv2d(net, depth(80), [1, 1], scope=end_point)
       end_points[end_point] = net
       if end_point == final_endpoint: return net, end_points
       # 73 x 73 x 80.
       end_point = 'Conv2d_4a_3x3'
-      net = slim.conv2d(net, depth(192), [3, 3], scope=end_point)
+      net = conv2d(net, depth(192), [3, 3], scope=end_point)
       end_points[end_point] = net
       if end_point == final_endpoint: return net, end_points
       # 71 x 71 x 192.
@@ -143,21 +149,21 @@ def inception_v3_base(inputs,
       end_point = 'Mixed_5b'
       with tf.variable_scope(end_point):
         with tf.variable_scope('Branch_0'):
-          branch_0 = slim.conv2d(net, depth(64), [1, 1], scope='Conv2d_0a_1x1')
+          branch_0 = conv2d(net, depth(64), [1, 1], scope='Conv2d_0a_1x1')
         with tf.variable_scope('Branch_1'):
-          branch_1 = slim.conv2d(net, depth(48), [1, 1], scope='Conv2d_0a_1x1')
-          branch_1 = slim.conv2d(branch_1, depth(64), [5, 5],
-                                 scope='Conv2d_0b_5x5')
+          branch_1 = conv2d(net, depth(48), [1, 1], scope='Conv2d_0a_1x1')
+          branch_1 = conv2d(branch_1, depth(64), [5, 5],
+                            scope='Conv2d_0b_5x5')
         with tf.variable_scope('Branch_2'):
-          branch_2 = slim.conv2d(net, depth(64), [1, 1], scope='Conv2d_0a_1x1')
-          branch_2 = slim.conv2d(branch_2, depth(96), [3, 3],
-                                 scope='Conv2d_0b_3x3')
-          branch_2 = slim.conv2d(branch_2, depth(96), [3, 3],
-                                 scope='Conv2d_0c_3x3')
+          branch_2 = conv2d(net, depth(64), [1, 1], scope='Conv2d_0a_1x1')
+          branch_2 = conv2d(branch_2, depth(96), [3, 3],
+                            scope='Conv2d_0b_3x3')
+          branch_2 = conv2d(branch_2, depth(96), [3, 3],
+                            scope='Conv2d_0c_3x3')
         with tf.variable_scope('Branch_3'):
           branch_3 = slim.avg_pool2d(net, [3, 3], scope='AvgPool_0a_3x3')
-          branch_3 = slim.conv2d(branch_3, depth(32), [1, 1],
-                                 scope='Conv2d_0b_1x1')
+          branch_3 = conv2d(branch_3, depth(32), [1, 1],
+                            scope='Conv2d_0b_1x1')
         net = tf.concat(axis=3, values=[branch_0, branch_1, branch_2, branch_3])
       end_points[end_point] = net
       if end_point == final_endpoint: return net, end_points
@@ -166,22 +172,22 @@ def inception_v3_base(inputs,
       end_point = 'Mixed_5c'
       with tf.variable_scope(end_point):
         with tf.variable_scope('Branch_0'):
-          branch_0 = slim.conv2d(net, depth(64), [1, 1], scope='Conv2d_0a_1x1')
+          branch_0 = conv2d(net, depth(64), [1, 1], scope='Conv2d_0a_1x1')
         with tf.variable_scope('Branch_1'):
-          branch_1 = slim.conv2d(net, depth(48), [1, 1], scope='Conv2d_0b_1x1')
-          branch_1 = slim.conv2d(branch_1, depth(64), [5, 5],
-                                 scope='Conv_1_0c_5x5')
+          branch_1 = conv2d(net, depth(48), [1, 1], scope='Conv2d_0b_1x1')
+          branch_1 = conv2d(branch_1, depth(64), [5, 5],
+                            scope='Conv_1_0c_5x5')
         with tf.variable_scope('Branch_2'):
-          branch_2 = slim.conv2d(net, depth(64), [1, 1],
-                                 scope='Conv2d_0a_1x1')
-          branch_2 = slim.conv2d(branch_2, depth(96), [3, 3],
-                                 scope='Conv2d_0b_3x3')
-          branch_2 = slim.conv2d(branch_2, depth(96), [3, 3],
-                                 scope='Conv2d_0c_3x3')
+          branch_2 = conv2d(net, depth(64), [1, 1],
+                            scope='Conv2d_0a_1x1')
+          branch_2 = conv2d(branch_2, depth(96), [3, 3],
+                            scope='Conv2d_0b_3x3')
+          branch_2 = conv2d(branch_2, depth(96), [3, 3],
+                            scope='Conv2d_0c_3x3')
         with tf.variable_scope('Branch_3'):
           branch_3 = slim.avg_pool2d(net, [3, 3], scope='AvgPool_0a_3x3')
-          branch_3 = slim.conv2d(branch_3, depth(64), [1, 1],
-                                 scope='Conv2d_0b_1x1')
+          branch_3 = conv2d(branch_3, depth(64), [1, 1],
+                            scope='Conv2d_0b_1x1')
         net = tf.concat(axis=3, values=[branch_0, branch_1, branch_2, branch_3])
       end_points[end_point] = net
       if end_point == final_endpoint: return net, end_points
@@ -190,21 +196,21 @@ def inception_v3_base(inputs,
       end_point = 'Mixed_5d'
       with tf.variable_scope(end_point):
         with tf.variable_scope('Branch_0'):
-          branch_0 = slim.conv2d(net, depth(64), [1, 1], scope='Conv2d_0a_1x1')
+          branch_0 = conv2d(net, depth(64), [1, 1], scope='Conv2d_0a_1x1')
         with tf.variable_scope('Branch_1'):
-          branch_1 = slim.conv2d(net, depth(48), [1, 1], scope='Conv2d_0a_1x1')
-          branch_1 = slim.conv2d(branch_1, depth(64), [5, 5],
-                                 scope='Conv2d_0b_5x5')
+          branch_1 = conv2d(net, depth(48), [1, 1], scope='Conv2d_0a_1x1')
+          branch_1 = conv2d(branch_1, depth(64), [5, 5],
+                            scope='Conv2d_0b_5x5')
         with tf.variable_scope('Branch_2'):
-          branch_2 = slim.conv2d(net, depth(64), [1, 1], scope='Conv2d_0a_1x1')
-          branch_2 = slim.conv2d(branch_2, depth(96), [3, 3],
-                                 scope='Conv2d_0b_3x3')
-          branch_2 = slim.conv2d(branch_2, depth(96), [3, 3],
-                                 scope='Conv2d_0c_3x3')
+          branch_2 = conv2d(net, depth(64), [1, 1], scope='Conv2d_0a_1x1')
+          branch_2 = conv2d(branch_2, depth(96), [3, 3],
+                            scope='Conv2d_0b_3x3')
+          branch_2 = conv2d(branch_2, depth(96), [3, 3],
+                            scope='Conv2d_0c_3x3')
         with tf.variable_scope('Branch_3'):
           branch_3 = slim.avg_pool2d(net, [3, 3], scope='AvgPool_0a_3x3')
-          branch_3 = slim.conv2d(branch_3, depth(64), [1, 1],
-                                 scope='Conv2d_0b_1x1')
+          branch_3 = conv2d(branch_3, depth(64), [1, 1],
+                            scope='Conv2d_0b_1x1')
         net = tf.concat(axis=3, values=[branch_0, branch_1, branch_2, branch_3])
       end_points[end_point] = net
       if end_point == final_endpoint: return net, end_points
@@ -213,14 +219,14 @@ def inception_v3_base(inputs,
       end_point = 'Mixed_6a'
       with tf.variable_scope(end_point):
         with tf.variable_scope('Branch_0'):
-          branch_0 = slim.conv2d(net, depth(384), [3, 3], stride=2,
-                                 padding='VALID', scope='Conv2d_1a_1x1')
+          branch_0 = conv2d(net, depth(384), [3, 3], stride=2,
+                            padding='VALID', scope='Conv2d_1a_1x1')
         with tf.variable_scope('Branch_1'):
-          branch_1 = slim.conv2d(net, depth(64), [1, 1], scope='Conv2d_0a_1x1')
-          branch_1 = slim.conv2d(branch_1, depth(96), [3, 3],
-                                 scope='Conv2d_0b_3x3')
-          branch_1 = slim.conv2d(branch_1, depth(96), [3, 3], stride=2,
-                                 padding='VALID', scope='Conv2d_1a_1x1')
+          branch_1 = conv2d(net, depth(64), [1, 1], scope='Conv2d_0a_1x1')
+          branch_1 = conv2d(branch_1, depth(96), [3, 3],
+                            scope='Conv2d_0b_3x3')
+          branch_1 = conv2d(branch_1, depth(96), [3, 3], stride=2,
+                            padding='VALID', scope='Conv2d_1a_1x1')
         with tf.variable_scope('Branch_2'):
           branch_2 = slim.max_pool2d(net, [3, 3], stride=2, padding='VALID',
                                      scope='MaxPool_1a_3x3')
@@ -232,27 +238,27 @@ def inception_v3_base(inputs,
       end_point = 'Mixed_6b'
       with tf.variable_scope(end_point):
         with tf.variable_scope('Branch_0'):
-          branch_0 = slim.conv2d(net, depth(192), [1, 1], scope='Conv2d_0a_1x1')
+          branch_0 = conv2d(net, depth(192), [1, 1], scope='Conv2d_0a_1x1')
         with tf.variable_scope('Branch_1'):
-          branch_1 = slim.conv2d(net, depth(128), [1, 1], scope='Conv2d_0a_1x1')
-          branch_1 = slim.conv2d(branch_1, depth(128), [1, 7],
-                                 scope='Conv2d_0b_1x7')
-          branch_1 = slim.conv2d(branch_1, depth(192), [7, 1],
-                                 scope='Conv2d_0c_7x1')
+          branch_1 = conv2d(net, depth(128), [1, 1], scope='Conv2d_0a_1x1')
+          branch_1 = conv2d(branch_1, depth(128), [1, 7],
+                            scope='Conv2d_0b_1x7')
+          branch_1 = conv2d(branch_1, depth(192), [7, 1],
+                            scope='Conv2d_0c_7x1')
         with tf.variable_scope('Branch_2'):
-          branch_2 = slim.conv2d(net, depth(128), [1, 1], scope='Conv2d_0a_1x1')
-          branch_2 = slim.conv2d(branch_2, depth(128), [7, 1],
-                                 scope='Conv2d_0b_7x1')
-          branch_2 = slim.conv2d(branch_2, depth(128), [1, 7],
-                                 scope='Conv2d_0c_1x7')
-          branch_2 = slim.conv2d(branch_2, depth(128), [7, 1],
-                                 scope='Conv2d_0d_7x1')
-          branch_2 = slim.conv2d(branch_2, depth(192), [1, 7],
-                                 scope='Conv2d_0e_1x7')
+          branch_2 = conv2d(net, depth(128), [1, 1], scope='Conv2d_0a_1x1')
+          branch_2 = conv2d(branch_2, depth(128), [7, 1],
+                            scope='Conv2d_0b_7x1')
+          branch_2 = conv2d(branch_2, depth(128), [1, 7],
+                            scope='Conv2d_0c_1x7')
+          branch_2 = conv2d(branch_2, depth(128), [7, 1],
+                            scope='Conv2d_0d_7x1')
+          branch_2 = conv2d(branch_2, depth(192), [1, 7],
+                            scope='Conv2d_0e_1x7')
         with tf.variable_scope('Branch_3'):
           branch_3 = slim.avg_pool2d(net, [3, 3], scope='AvgPool_0a_3x3')
-          branch_3 = slim.conv2d(branch_3, depth(192), [1, 1],
-                                 scope='Conv2d_0b_1x1')
+          branch_3 = conv2d(branch_3, depth(192), [1, 1],
+                            scope='Conv2d_0b_1x1')
         net = tf.concat(axis=3, values=[branch_0, branch_1, branch_2, branch_3])
       end_points[end_point] = net
       if end_point == final_endpoint: return net, end_points
@@ -261,27 +267,27 @@ def inception_v3_base(inputs,
       end_point = 'Mixed_6c'
       with tf.variable_scope(end_point):
         with tf.variable_scope('Branch_0'):
-          branch_0 = slim.conv2d(net, depth(192), [1, 1], scope='Conv2d_0a_1x1')
+          branch_0 = conv2d(net, depth(192), [1, 1], scope='Conv2d_0a_1x1')
         with tf.variable_scope('Branch_1'):
-          branch_1 = slim.conv2d(net, depth(160), [1, 1], scope='Conv2d_0a_1x1')
-          branch_1 = slim.conv2d(branch_1, depth(160), [1, 7],
-                                 scope='Conv2d_0b_1x7')
-          branch_1 = slim.conv2d(branch_1, depth(192), [7, 1],
-                                 scope='Conv2d_0c_7x1')
+          branch_1 = conv2d(net, depth(160), [1, 1], scope='Conv2d_0a_1x1')
+          branch_1 = conv2d(branch_1, depth(160), [1, 7],
+                            scope='Conv2d_0b_1x7')
+          branch_1 = conv2d(branch_1, depth(192), [7, 1],
+                            scope='Conv2d_0c_7x1')
         with tf.variable_scope('Branch_2'):
-          branch_2 = slim.conv2d(net, depth(160), [1, 1], scope='Conv2d_0a_1x1')
-          branch_2 = slim.conv2d(branch_2, depth(160), [7, 1],
-                                 scope='Conv2d_0b_7x1')
-          branch_2 = slim.conv2d(branch_2, depth(160), [1, 7],
-                                 scope='Conv2d_0c_1x7')
-          branch_2 = slim.conv2d(branch_2, depth(160), [7, 1],
-                                 scope='Conv2d_0d_7x1')
-          branch_2 = slim.conv2d(branch_2, depth(192), [1, 7],
-                                 scope='Conv2d_0e_1x7')
+          branch_2 = conv2d(net, depth(160), [1, 1], scope='Conv2d_0a_1x1')
+          branch_2 = conv2d(branch_2, depth(160), [7, 1],
+                            scope='Conv2d_0b_7x1')
+          branch_2 = conv2d(branch_2, depth(160), [1, 7],
+                            scope='Conv2d_0c_1x7')
+          branch_2 = conv2d(branch_2, depth(160), [7, 1],
+                            scope='Conv2d_0d_7x1')
+          branch_2 = conv2d(branch_2, depth(192), [1, 7],
+                            scope='Conv2d_0e_1x7')
         with tf.variable_scope('Branch_3'):
           branch_3 = slim.avg_pool2d(net, [3, 3], scope='AvgPool_0a_3x3')
-          branch_3 = slim.conv2d(branch_3, depth(192), [1, 1],
-                                 scope='Conv2d_0b_1x1')
+          branch_3 = conv2d(branch_3, depth(192), [1, 1],
+                            scope='Conv2d_0b_1x1')
         net = tf.concat(axis=3, values=[branch_0, branch_1, branch_2, branch_3])
       end_points[end_point] = net
       if end_point == final_endpoint: return net, end_points
@@ -289,27 +295,27 @@ def inception_v3_base(inputs,
       end_point = 'Mixed_6d'
       with tf.variable_scope(end_point):
         with tf.variable_scope('Branch_0'):
-          branch_0 = slim.conv2d(net, depth(192), [1, 1], scope='Conv2d_0a_1x1')
+          branch_0 = conv2d(net, depth(192), [1, 1], scope='Conv2d_0a_1x1')
         with tf.variable_scope('Branch_1'):
-          branch_1 = slim.conv2d(net, depth(160), [1, 1], scope='Conv2d_0a_1x1')
-          branch_1 = slim.conv2d(branch_1, depth(160), [1, 7],
-                                 scope='Conv2d_0b_1x7')
-          branch_1 = slim.conv2d(branch_1, depth(192), [7, 1],
-                                 scope='Conv2d_0c_7x1')
+          branch_1 = conv2d(net, depth(160), [1, 1], scope='Conv2d_0a_1x1')
+          branch_1 = conv2d(branch_1, depth(160), [1, 7],
+                            scope='Conv2d_0b_1x7')
+          branch_1 = conv2d(branch_1, depth(192), [7, 1],
+                            scope='Conv2d_0c_7x1')
         with tf.variable_scope('Branch_2'):
-          branch_2 = slim.conv2d(net, depth(160), [1, 1], scope='Conv2d_0a_1x1')
-          branch_2 = slim.conv2d(branch_2, depth(160), [7, 1],
-                                 scope='Conv2d_0b_7x1')
-          branch_2 = slim.conv2d(branch_2, depth(160), [1, 7],
-                                 scope='Conv2d_0c_1x7')
-          branch_2 = slim.conv2d(branch_2, depth(160), [7, 1],
-                                 scope='Conv2d_0d_7x1')
-          branch_2 = slim.conv2d(branch_2, depth(192), [1, 7],
-                                 scope='Conv2d_0e_1x7')
+          branch_2 = conv2d(net, depth(160), [1, 1], scope='Conv2d_0a_1x1')
+          branch_2 = conv2d(branch_2, depth(160), [7, 1],
+                            scope='Conv2d_0b_7x1')
+          branch_2 = conv2d(branch_2, depth(160), [1, 7],
+                            scope='Conv2d_0c_1x7')
+          branch_2 = conv2d(branch_2, depth(160), [7, 1],
+                            scope='Conv2d_0d_7x1')
+          branch_2 = conv2d(branch_2, depth(192), [1, 7],
+                            scope='Conv2d_0e_1x7')
         with tf.variable_scope('Branch_3'):
           branch_3 = slim.avg_pool2d(net, [3, 3], scope='AvgPool_0a_3x3')
-          branch_3 = slim.conv2d(branch_3, depth(192), [1, 1],
-                                 scope='Conv2d_0b_1x1')
+          branch_3 = conv2d(branch_3, depth(192), [1, 1],
+                            scope='Conv2d_0b_1x1')
         net = tf.concat(axis=3, values=[branch_0, branch_1, branch_2, branch_3])
       end_points[end_point] = net
       if end_point == final_endpoint: return net, end_points
@@ -318,27 +324,27 @@ def inception_v3_base(inputs,
       end_point = 'Mixed_6e'
       with tf.variable_scope(end_point):
         with tf.variable_scope('Branch_0'):
-          branch_0 = slim.conv2d(net, depth(192), [1, 1], scope='Conv2d_0a_1x1')
+          branch_0 = conv2d(net, depth(192), [1, 1], scope='Conv2d_0a_1x1')
         with tf.variable_scope('Branch_1'):
-          branch_1 = slim.conv2d(net, depth(192), [1, 1], scope='Conv2d_0a_1x1')
-          branch_1 = slim.conv2d(branch_1, depth(192), [1, 7],
-                                 scope='Conv2d_0b_1x7')
-          branch_1 = slim.conv2d(branch_1, depth(192), [7, 1],
-                                 scope='Conv2d_0c_7x1')
+          branch_1 = conv2d(net, depth(192), [1, 1], scope='Conv2d_0a_1x1')
+          branch_1 = conv2d(branch_1, depth(192), [1, 7],
+                            scope='Conv2d_0b_1x7')
+          branch_1 = conv2d(branch_1, depth(192), [7, 1],
+                            scope='Conv2d_0c_7x1')
         with tf.variable_scope('Branch_2'):
-          branch_2 = slim.conv2d(net, depth(192), [1, 1], scope='Conv2d_0a_1x1')
-          branch_2 = slim.conv2d(branch_2, depth(192), [7, 1],
-                                 scope='Conv2d_0b_7x1')
-          branch_2 = slim.conv2d(branch_2, depth(192), [1, 7],
-                                 scope='Conv2d_0c_1x7')
-          branch_2 = slim.conv2d(branch_2, depth(192), [7, 1],
-                                 scope='Conv2d_0d_7x1')
-          branch_2 = slim.conv2d(branch_2, depth(192), [1, 7],
-                                 scope='Conv2d_0e_1x7')
+          branch_2 = conv2d(net, depth(192), [1, 1], scope='Conv2d_0a_1x1')
+          branch_2 = conv2d(branch_2, depth(192), [7, 1],
+                            scope='Conv2d_0b_7x1')
+          branch_2 = conv2d(branch_2, depth(192), [1, 7],
+                            scope='Conv2d_0c_1x7')
+          branch_2 = conv2d(branch_2, depth(192), [7, 1],
+                            scope='Conv2d_0d_7x1')
+          branch_2 = conv2d(branch_2, depth(192), [1, 7],
+                            scope='Conv2d_0e_1x7')
         with tf.variable_scope('Branch_3'):
           branch_3 = slim.avg_pool2d(net, [3, 3], scope='AvgPool_0a_3x3')
-          branch_3 = slim.conv2d(branch_3, depth(192), [1, 1],
-                                 scope='Conv2d_0b_1x1')
+          branch_3 = conv2d(branch_3, depth(192), [1, 1],
+                            scope='Conv2d_0b_1x1')
         net = tf.concat(axis=3, values=[branch_0, branch_1, branch_2, branch_3])
       end_points[end_point] = net
       if end_point == final_endpoint: return net, end_points
@@ -347,17 +353,17 @@ def inception_v3_base(inputs,
       end_point = 'Mixed_7a'
       with tf.variable_scope(end_point):
         with tf.variable_scope('Branch_0'):
-          branch_0 = slim.conv2d(net, depth(192), [1, 1], scope='Conv2d_0a_1x1')
-          branch_0 = slim.conv2d(branch_0, depth(320), [3, 3], stride=2,
-                                 padding='VALID', scope='Conv2d_1a_3x3')
+          branch_0 = conv2d(net, depth(192), [1, 1], scope='Conv2d_0a_1x1')
+          branch_0 = conv2d(branch_0, depth(320), [3, 3], stride=2,
+                            padding='VALID', scope='Conv2d_1a_3x3')
         with tf.variable_scope('Branch_1'):
-          branch_1 = slim.conv2d(net, depth(192), [1, 1], scope='Conv2d_0a_1x1')
-          branch_1 = slim.conv2d(branch_1, depth(192), [1, 7],
-                                 scope='Conv2d_0b_1x7')
-          branch_1 = slim.conv2d(branch_1, depth(192), [7, 1],
-                                 scope='Conv2d_0c_7x1')
-          branch_1 = slim.conv2d(branch_1, depth(192), [3, 3], stride=2,
-                                 padding='VALID', scope='Conv2d_1a_3x3')
+          branch_1 = conv2d(net, depth(192), [1, 1], scope='Conv2d_0a_1x1')
+          branch_1 = conv2d(branch_1, depth(192), [1, 7],
+                            scope='Conv2d_0b_1x7')
+          branch_1 = conv2d(branch_1, depth(192), [7, 1],
+                            scope='Conv2d_0c_7x1')
+          branch_1 = conv2d(branch_1, depth(192), [3, 3], stride=2,
+                            padding='VALID', scope='Conv2d_1a_3x3')
         with tf.variable_scope('Branch_2'):
           branch_2 = slim.max_pool2d(net, [3, 3], stride=2, padding='VALID',
                                      scope='MaxPool_1a_3x3')
@@ -368,22 +374,22 @@ def inception_v3_base(inputs,
       end_point = 'Mixed_7b'
       with tf.variable_scope(end_point):
         with tf.variable_scope('Branch_0'):
-          branch_0 = slim.conv2d(net, depth(320), [1, 1], scope='Conv2d_0a_1x1')
+          branch_0 = conv2d(net, depth(320), [1, 1], scope='Conv2d_0a_1x1')
         with tf.variable_scope('Branch_1'):
-          branch_1 = slim.conv2d(net, depth(384), [1, 1], scope='Conv2d_0a_1x1')
+          branch_1 = conv2d(net, depth(384), [1, 1], scope='Conv2d_0a_1x1')
           branch_1 = tf.concat(axis=3, values=[
-              slim.conv2d(branch_1, depth(384), [1, 3], scope='Conv2d_0b_1x3'),
-              slim.conv2d(branch_1, depth(384), [3, 1], scope='Conv2d_0b_3x1')])
+              conv2d(branch_1, depth(384), [1, 3], scope='Conv2d_0b_1x3'),
+              conv2d(branch_1, depth(384), [3, 1], scope='Conv2d_0b_3x1')])
         with tf.variable_scope('Branch_2'):
-          branch_2 = slim.conv2d(net, depth(448), [1, 1], scope='Conv2d_0a_1x1')
-          branch_2 = slim.conv2d(
+          branch_2 = conv2d(net, depth(448), [1, 1], scope='Conv2d_0a_1x1')
+          branch_2 = conv2d(
               branch_2, depth(384), [3, 3], scope='Conv2d_0b_3x3')
           branch_2 = tf.concat(axis=3, values=[
-              slim.conv2d(branch_2, depth(384), [1, 3], scope='Conv2d_0c_1x3'),
-              slim.conv2d(branch_2, depth(384), [3, 1], scope='Conv2d_0d_3x1')])
+              conv2d(branch_2, depth(384), [1, 3], scope='Conv2d_0c_1x3'),
+              conv2d(branch_2, depth(384), [3, 1], scope='Conv2d_0d_3x1')])
         with tf.variable_scope('Branch_3'):
           branch_3 = slim.avg_pool2d(net, [3, 3], scope='AvgPool_0a_3x3')
-          branch_3 = slim.conv2d(
+          branch_3 = conv2d(
               branch_3, depth(192), [1, 1], scope='Conv2d_0b_1x1')
         net = tf.concat(axis=3, values=[branch_0, branch_1, branch_2, branch_3])
       end_points[end_point] = net
@@ -393,22 +399,22 @@ def inception_v3_base(inputs,
       end_point = 'Mixed_7c'
       with tf.variable_scope(end_point):
         with tf.variable_scope('Branch_0'):
-          branch_0 = slim.conv2d(net, depth(320), [1, 1], scope='Conv2d_0a_1x1')
+          branch_0 = conv2d(net, depth(320), [1, 1], scope='Conv2d_0a_1x1')
         with tf.variable_scope('Branch_1'):
-          branch_1 = slim.conv2d(net, depth(384), [1, 1], scope='Conv2d_0a_1x1')
+          branch_1 = conv2d(net, depth(384), [1, 1], scope='Conv2d_0a_1x1')
           branch_1 = tf.concat(axis=3, values=[
-              slim.conv2d(branch_1, depth(384), [1, 3], scope='Conv2d_0b_1x3'),
-              slim.conv2d(branch_1, depth(384), [3, 1], scope='Conv2d_0c_3x1')])
+              conv2d(branch_1, depth(384), [1, 3], scope='Conv2d_0b_1x3'),
+              conv2d(branch_1, depth(384), [3, 1], scope='Conv2d_0c_3x1')])
         with tf.variable_scope('Branch_2'):
-          branch_2 = slim.conv2d(net, depth(448), [1, 1], scope='Conv2d_0a_1x1')
-          branch_2 = slim.conv2d(
+          branch_2 = conv2d(net, depth(448), [1, 1], scope='Conv2d_0a_1x1')
+          branch_2 = conv2d(
               branch_2, depth(384), [3, 3], scope='Conv2d_0b_3x3')
           branch_2 = tf.concat(axis=3, values=[
-              slim.conv2d(branch_2, depth(384), [1, 3], scope='Conv2d_0c_1x3'),
-              slim.conv2d(branch_2, depth(384), [3, 1], scope='Conv2d_0d_3x1')])
+              conv2d(branch_2, depth(384), [1, 3], scope='Conv2d_0c_1x3'),
+              conv2d(branch_2, depth(384), [3, 1], scope='Conv2d_0d_3x1')])
         with tf.variable_scope('Branch_3'):
           branch_3 = slim.avg_pool2d(net, [3, 3], scope='AvgPool_0a_3x3')
-          branch_3 = slim.conv2d(
+          branch_3 = conv2d(
               branch_3, depth(192), [1, 1], scope='Conv2d_0b_1x1')
         net = tf.concat(axis=3, values=[branch_0, branch_1, branch_2, branch_3])
       end_points[end_point] = net
@@ -427,7 +433,8 @@ def inception_v3(inputs,
                  reuse=None,
                  create_aux_logits=True,
                  scope='InceptionV3',
-                 global_pool=False):
+                 global_pool=False,
+                 channel_config=None):
   """Inception model from http://arxiv.org/abs/1512.00567.
 
   "Rethinking the Inception Architecture for Computer Vision"
@@ -467,6 +474,9 @@ def inception_v3(inputs,
       logits layer. If false or unset, pooling is done with a fixed window
       that reduces default-sized inputs to 1x1, while larger inputs lead to
       larger outputs. If true, any input size is pooled down to 1x1.
+    channel_config: Optional dict from the variable scopes of the convolutions
+      of `inception_v3_base` to their number of output channels, as written by
+      structured_prune.py.
 
   Returns:
     net: a Tensor with the logits (pre-softmax activations) if num_classes
@@ -487,7 +497,7 @@ def inception_v3(inputs,
                         is_training=is_training):
       net, end_points = inception_v3_base(
           inputs, scope=scope, min_depth=min_depth,
-          depth_multiplier=depth_multiplier)
+          depth_multiplier=depth_multiplier, channel_config=channel_config)
 
       # Auxiliary Head logits
       if create_aux_logits and num_classes:
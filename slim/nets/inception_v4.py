@@ -29,6 +29,7 @@ import tensorflow as tf
 from nets import inception_utils
 
 slim = tf.contrib.slim
+conv2d = inception_utils.conv2d
 
 
 def block_inception_a(inputs, scope=None, reuse=None):
@@ -38,17 +39,17 @@ def block_inception_a(inputs, scope=None, reuse=None):
                       stride=1, padding='SAME'):
     with tf.variable_scope(scope, 'BlockInceptionA', [inputs], reuse=reuse):
       with tf.variable_scope('Branch_0'):
-        branch_0 = slim.conv2d(inputs, 96, [1, 1], scope='Conv2d_0a_1x1')
+        branch_0 = conv2d(inputs, 96, [1, 1], scope='Conv2d_0a_1x1')
       with tf.variable_scope('Branch_1'):
-        branch_1 = slim.conv2d(inputs, 64, [1, 1], scope='Conv2d_0a_1x1')
-        branch_1 = slim.conv2d(branch_1, 96, [3, 3], scope='Conv2d_0b_3x3')
+        branch_1 = conv2d(inputs, 64, [1, 1], scope='Conv2d_0a_1x1')
+        branch_1 = conv2d(branch_1, 96, [3, 3], scope='Conv2d_0b_3x3')
       with tf.variable_scope('Branch_2'):
-        branch_2 = slim.conv2d(inputs, 64, [1, 1], scope='Conv2d_0a_1x1')
-        branch_2 = slim.conv2d(branch_2, 96, [3, 3], scope='Conv2d_0b_3x3')
-        branch_2 = slim.conv2d(branch_2, 96, [3, 3], scope='Conv2d_0c_3x3')
+        branch_2 = conv2d(inputs, 64, [1, 1], scope='Conv2d_0a_1x1')
+        branch_2 = conv2d(branch_2, 96, [3, 3], scope='Conv2d_0b_3x3')
+        branch_2 = conv2d(branch_2, 96, [3, 3], scope='Conv2d_0c_3x3')
       with tf.variable_scope('Branch_3'):
         branch_3 = slim.avg_pool2d(inputs, [3, 3], scope='AvgPool_0a_3x3')
-        branch_3 = slim.conv2d(branch_3, 96, [1, 1], scope='Conv2d_0b_1x1')
+        branch_3 = conv2d(branch_3, 96, [1, 1], scope='Conv2d_0b_1x1')
       return tf.concat(axis=3, values=[branch_0, branch_1, branch_2, branch_3])
 
 
@@ -59,13 +60,13 @@ def block_reduction_a(inputs, scope=None, reuse=None):
                       stride=1, padding='SAME'):
     with tf.variable_scope(scope, 'BlockReductionA', [inputs], reuse=reuse):
       with tf.variable_scope('Branch_0'):
-        branch_0 = slim.conv2d(inputs, 384, [3, 3], stride=2, padding='VALID',
-                               scope='Conv2d_1a_3x3')
+        branch_0 = conv2d(inputs, 384, [3, 3], stride=2, padding='VALID',
+                          scope='Conv2d_1a_3x3')
       with tf.variable_scope('Branch_1'):
-        branch_1 = slim.conv2d(inputs, 192, [1, 1], scope='Conv2d_0a_1x1')
-        branch_1 = slim.conv2d(branch_1, 224, [3, 3], scope='Conv2d_0b_3x3')
-        branch_1 = slim.conv2d(branch_1, 256, [3, 3], stride=2,
-                               padding='VALID', scope='Conv2d_1a_3x3')
+        branch_1 = conv2d(inputs, 192, [1, 1], scope='Conv2d_0a_1x1')
+        branch_1 = conv2d(branch_1, 224, [3, 3], scope='Conv2d_0b_3x3')
+        branch_1 = conv2d(branch_1, 256, [3, 3], stride=2,
+                          padding='VALID', scope='Conv2d_1a_3x3')
       with tf.variable_scope('Branch_2'):
         branch_2 = slim.max_pool2d(inputs, [3, 3], stride=2, padding='VALID',
                                    scope='MaxPool_1a_3x3')
@@ -79,20 +80,20 @@ def block_inception_b(inputs, scope=None, reuse=None):
                       stride=1, padding='SAME'):
     with tf.variable_scope(scope, 'BlockInceptionB', [inputs], reuse=reuse):
       with tf.variable_scope('Branch_0'):
-        branch_0 = slim.conv2d(inputs, 384, [1, 1], scope='Conv2d_0a_1x1')
+        branch_0 = conv2d(inputs, 384, [1, 1], scope='Conv2d_0a_1x1')
       with tf.variable_scope('Branch_1'):
-        branch_1 = slim.conv2d(inputs, 192, [1, 1], scope='Conv2d_0a_1x1')
-        branch_1 = slim.conv2d(branch_1, 224, [1, 7], scope='Conv2d_0b_1x7')
-        branch_1 = slim.conv2d(branch_1, 256, [7, 1], scope='Conv2d_0c_7x1')
+        branch_1 = conv2d(inputs, 192, [1, 1], scope='Conv2d_0a_1x1')
+        branch_1 = conv2d(branch_1, 224, [1, 7], scope='Conv2d_0b_1x7')
+        branch_1 = conv2d(branch_1, 256, [7, 1], scope='Conv2d_0c_7x1')
       with tf.variable_scope('Branch_2'):
-        branch_2 = slim.conv2d(inputs, 192, [1, 1], scope='Conv2d_0a_1x1')
-        branch_2 = slim.conv2d(branch_2, 192, [7, 1], scope='Conv2d_0b_7x1')
-        branch_2 = slim.conv2d(branch_2, 224, [1, 7], scope='Conv2d_0c_1x7')
-        branch_2 = slim.conv2d(branch_2, 224, [7, 1], scope='Conv2d_0d_7x1')
-        branch_2 = slim.conv2d(branch_2, 256, [1, 7], scope='Conv2d_0e_1x7')
+        branch_2 = conv2d(inputs, 192, [1, 1], scope='Conv2d_0a_1x1')
+        branch_2 = conv2d(branch_2, 192, [7, 1], scope='Conv2d_0b_7x1')
+        branch_2 = conv2d(branch_2, 224, [1, 7], scope='Conv2d_0c_1x7')
+        branch_2 = conv2d(branch_2, 224, [7, 1], scope='Conv2d_0d_7x1')
+        branch_2 = conv2d(branch_2, 256, [1, 7], scope='Conv2d_0e_1x7')
       with tf.variable_scope('Branch_3'):
         branch_3 = slim.avg_pool2d(inputs, [3, 3], scope='AvgPool_0a_3x3')
-        branch_3 = slim.conv2d(branch_3, 128, [1, 1], scope='Conv2d_0b_1x1')
+        branch_3 = conv2d(branch_3, 128, [1, 1], scope='Conv2d_0b_1x1')
       return tf.concat(axis=3, values=[branch_0, branch_1, branch_2, branch_3])
 
 
@@ -103,15 +104,15 @@ def block_reduction_b(inputs, scope=None, reuse=None):
                       stride=1, padding='SAME'):
     with tf.variable_scope(scope, 'BlockReductionB', [inputs], reuse=reuse):
       with tf.variable_scope('Branch_0'):
-        branch_0 = slim.conv2d(inputs, 192, [1, 1], scope='Conv2d_0a_1x1')
-        branch_0 = slim.conv2d(branch_0, 192, [3, 3], stride=2,
-                               padding='VALID', scope='Conv2d_1a_3x3')
+        branch_0 = conv2d(inputs, 192, [1, 1], scope='Conv2d_0a_1x1')
+        branch_0 = conv2d(branch_0, 192, [3, 3], stride=2,
+                          padding='VALID', scope='Conv2d_1a_3x3')
       with tf.variable_scope('Branch_1'):
-        branch_1 = slim.conv2d(inputs, 256, [1, 1], scope='Conv2d_0a_1x1')
-        branch_1 = slim.conv2d(branch_1, 256, [1, 7], scope='Conv2d_0b_1x7')
-        branch_1 = slim.conv2d(branch_1, 320, [7, 1], scope='Conv2d_0c_7x1')
-        branch_1 = slim.conv2d(branch_1, 320, [3, 3], stride=2,
-                               padding='VALID', scope='Conv2d_1a_3x3')
+        branch_1 = conv2d(inputs, 256, [1, 1], scope='Conv2d_0a_1x1')
+        branch_1 = conv2d(branch_1, 256, [1, 7], scope='Conv2d_0b_1x7')
+        branch_1 = conv2d(branch_1, 320, [7, 1], scope='Conv2d_0c_7x1')
+        branch_1 = conv2d(branch_1, 320, [3, 3], stride=2,
+                          padding='VALID', scope='Conv2d_1a_3x3')
       with tf.variable_scope('Branch_2'):
         branch_2 = slim.max_pool2d(inputs, [3, 3], stride=2, padding='VALID',
                                    scope='MaxPool_1a_3x3')
@@ -125,26 +126,27 @@ def block_inception_c(inputs, scope=None, reuse=None):
                       stride=1, padding='SAME'):
     with tf.variable_scope(scope, 'BlockInceptionC', [inputs], reuse=reuse):
       with tf.variable_scope('Branch_0'):
-        branch_0 = slim.conv2d(inputs, 256, [1, 1], scope='Conv2d_0a_1x1')
+        branch_0 = conv2d(inputs, 256, [1, 1], scope='Conv2d_0a_1x1')
       with tf.variable_scope('Branch_1'):
-        branch_1 = slim.conv2d(inputs, 384, [1, 1], scope='Conv2d_0a_1x1')
+        branch_1 = conv2d(inputs, 384, [1, 1], scope='Conv2d_0a_1x1')
         branch_1 = tf.concat(axis=3, values=[
-            slim.conv2d(branch_1, 256, [1, 3], scope='Conv2d_0b_1x3'),
-            slim.conv2d(branch_1, 256, [3, 1], scope='Conv2d_0c_3x1')])
+            conv2d(branch_1, 256, [1, 3], scope='Conv2d_0b_1x3'),
+            conv2d(branch_1, 256, [3, 1], scope='Conv2d_0c_3x1')])
       with tf.variable_scope('Branch_2'):
-        branch_2 = slim.conv2d(inputs, 384, [1, 1], scope='Conv2d_0a_1x1')
-        branch_2 = slim.conv2d(branch_2, 448, [3, 1], scope='Conv2d_0b_3x1')
-        branch_2 = slim.conv2d(branch_2, 512, [1, 3], scope='Conv2d_0c_1x3')
+        branch_2 = conv2d(inputs, 384, [1, 1], scope='Conv2d_0a_1x1')
+        branch_2 = conv2d(branch_2, 448, [3, 1], scope='Conv2d_0b_3x1')
+        branch_2 = conv2d(branch_2, 512, [1, 3], scope='Conv2d_0c_1x3')
         branch_2 = tf.concat(axis=3, values=[
-            slim.conv2d(branch_2, 256, [1, 3], scope='Conv2d_0d_1x3'),
-            slim.conv2d(branch_2, 256, [3, 1], scope='Conv2d_0e_3x1')])
+            conv2d(branch_2, 256, [1, 3], scope='Conv2d_0d_1x3'),
+            conv2d(branch_2, 256, [3, 1], scope='Conv2d_0e_3x1')])
       with tf.variable_scope('Branch_3'):
         branch_3 = slim.avg_pool2d(inputs, [3, 3], scope='AvgPool_0a_3x3')
-        branch_3 = slim.conv2d(branch_3, 256, [1, 1], scope='Conv2d_0b_1x1')
+        branch_3 = conv2d(branch_3, 256, [1, 1], scope='Conv2d_0b_1x1')
       return tf.concat(axis=3, values=[branch_0, branch_1, branch_2, branch_3])
 
 
-def inception_v4_base(inputs, final_endpoint='Mixed_7d', scope=None):
+def inception_v4_base(inputs, final_endpoint='Mixed_7d', scope=None,
+                      channel_config=None):
   """Creates the Inception V4 network up to the given final endpoint.
 
   Args:
@@ -156,6 +158,9 @@ def inception_v4_base(inputs, final_endpoint='Mixed_7d', scope=None):
       'Mixed_6f', 'Mixed_6g', 'Mixed_6h', 'Mixed_7a', 'Mixed_7b', 'Mixed_7c',
       'Mixed_7d']
     scope: Optional variable_scope.
+    channel_config: Optional dict from the variable scopes of convolutions to
+      their number of output channels, overriding the ones above. See
+      `inception_utils.conv2d`.
 
   Returns:
     logits: the logits outputs of the model.
@@ -170,19 +175,20 @@ def inception_v4_base(inputs, final_endpoint='Mixed_7d', scope=None):
     end_points[name] = net
     return name == final_endpoint
 
-  with tf.variable_scope(scope, 'InceptionV4', [inputs]):
+  with tf.variable_scope(scope, 'InceptionV4', [inputs]), slim.arg_scope(
+      [conv2d], channel_config=channel_config):
     with slim.arg_scope([slim.conv2d, slim.max_pool2d, slim.avg_pool2d],
                         stride=1, padding='SAME'):
       # 299 x 299 x 3
-      net = slim.conv2d(inputs, 32, [3, 3], stride=2,
-                        padding='VALID', scope='Conv2d_1a_3x3')
+      net = conv2d(inputs, 32, [3, 3], stride=2,
+                   padding='VALID', scope='Conv2d_1a_3x3')
       if add_and_check_final('Conv2d_1a_3x3', net): return net, end_points
       # 149 x 149 x 32
-      net = slim.conv2d(net, 32, [3, 3], padding='VALID',
-                        scope='Conv2d_2a_3x3')
+      net = conv2d(net, 32, [3, 3], padding='VALID',
+                   scope='Conv2d_2a_3x3')
       if add_and_check_final('Conv2d_2a_3x3', net): return net, end_points
       # 147 x 147 x 32
-      net = slim.conv2d(net, 64, [3, 3], scope='Conv2d_2b_3x3')
+      net = conv2d(net, 64, [3, 3], scope='Conv2d_2b_3x3')
       if add_and_check_final('Conv2d_2b_3x3', net): return net, end_points
       # 147 x 147 x 64
       with tf.variable_scope('Mixed_3a'):
@@ -190,31 +196,31 @@ def inception_v4_base(inputs, final_endpoint='Mixed_7d', scope=None):
           branch_0 = slim.max_pool2d(net, [3, 3], stride=2, padding='VALID',
                                      scope='MaxPool_0a_3x3')
         with tf.variable_scope('Branch_1'):
-          branch_1 = slim.conv2d(net, 96, [3, 3], stride=2, padding='VALID',
-                                 scope='Conv2d_0a_3x3')
+          branch_1 = conv2d(net, 96, [3, 3], stride=2, padding='VALID',
+                            scope='Conv2d_0a_3x3')
         net = tf.concat(axis=3, values=[branch_0, branch_1])
         if add_and_check_final('Mixed_3a', net): return net, end_points
 
       # 73 x 73 x 160
       with tf.variable_scope('Mixed_4a'):
         with tf.variable_scope('Branch_0'):
-          branch_0 = slim.conv2d(net, 64, [1, 1], scope='Conv2d_0a_1x1')
-          branch_0 = slim.conv2d(branch_0, 96, [3, 3], padding='VALID',
-                                 scope='Conv2d_1a_3x3')
+          branch_0 = conv2d(net, 64, [1, 1], scope='Conv2d_0a_1x1')
+          branch_0 = conv2d(branch_0, 96, [3, 3], padding='VALID',
+                            scope='Conv2d_1a_3x3')
         with tf.variable_scope('Branch_1'):
-          branch_1 = slim.conv2d(net, 64, [1, 1], scope='Conv2d_0a_1x1')
-          branch_1 = slim.conv2d(branch_1, 64, [1, 7], scope='Conv2d_0b_1x7')
-          branch_1 = slim.conv2d(branch_1, 64, [7, 1], scope='Conv2d_0c_7x1')
-          branch_1 = slim.conv2d(branch_1, 96, [3, 3], padding='VALID',
-                                 scope='Conv2d_1a_3x3')
+          branch_1 = conv2d(net, 64, [1, 1], scope='Conv2d_0a_1x1')
+          branch_1 = conv2d(branch_1, 64, [1, 7], scope='Conv2d_0b_1x7')
+          branch_1 = conv2d(branch_1, 64, [7, 1], scope='Conv2d_0c_7x1')
+          branch_1 = conv2d(branch_1, 96, [3, 3], padding='VALID',
+                            scope='Conv2d_1a_3x3')
         net = tf.concat(axis=3, values=[branch_0, branch_1])
         if add_and_check_final('Mixed_4a', net): return net, end_points
 
       # 71 x 71 x 192
       with tf.variable_scope('Mixed_5a'):
         with tf.variable_scope('Branch_0'):
-          branch_0 = slim.conv2d(net, 192, [3, 3], stride=2, padding='VALID',
-                                 scope='Conv2d_1a_3x3')
+          branch_0 = conv2d(net, 192, [3, 3], stride=2, padding='VALID',
+                            scope='Conv2d_1a_3x3')
         with tf.variable_scope('Branch_1'):
           branch_1 = slim.max_pool2d(net, [3, 3], stride=2, padding='VALID',
                                      scope='MaxPool_1a_3x3')
@@ -258,7 +264,8 @@ def inception_v4(inputs, num_classes=1001, is_training=True,
                  dropout_keep_prob=0.8,
                  reuse=None,
                  scope='InceptionV4',
-                 create_aux_logits=True):
+                 create_aux_logits=True,
+                 channel_config=None):
   """Creates the Inception V4 model.
 
   Args:
@@ -272,6 +279,9 @@ def inception_v4(inputs, num_classes=1001, is_training=True,
       able to reuse 'scope' must be given.
     scope: Optional variable_scope.
     create_aux_logits: Whether to include the auxiliary logits.
+    channel_config: Optional dict from the variable scopes of the convolutions
+      of `inception_v4_base` to their number of output channels, as written by
+      structured_prune.py.
 
   Returns:
     net: a Tensor with the logits (pre-softmax activations) if num_classes
@@ -283,7 +293,8 @@ def inception_v4(inputs, num_classes=1001, is_training=True,
   with tf.variable_scope(scope, 'InceptionV4', [inputs], reuse=reuse) as scope:
     with slim.arg_scope([slim.batch_norm, slim.dropout],
                         is_training=is_training):
-      net, end_points = inception_v4_base(inputs, scope=scope)
+      net, end_points = inception_v4_base(inputs, scope=scope,
+                                          channel_config=channel_config)
 
       with slim.arg_scope([slim.conv2d, slim.max_pool2d, slim.avg_pool2d],
                           stride=1, padding='SAME'):
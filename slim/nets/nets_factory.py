@@ -23,6 +23,7 @@ import tensorflow as tf
 
 from nets import alexnet
 from nets import cifarnet
+from nets import hierarchical_head
 from nets import inception
 from nets import lenet
 from nets import mobilenet_v1
@@ -111,7 +112,24 @@ arg_scopes_map = {'alexnet_v2': alexnet.alexnet_v2_arg_scope,
                  }
 
 
-def get_network_fn(name, num_classes, weight_decay=0.0, is_training=False):
+# The networks that can be thinned by structured_prune.py.
+_CHANNEL_CONFIG_NETWORKS = ('inception_v3', 'inception_v4')
+
+# The networks returning the input of their logits layer with num_classes=0,
+# on which the hierarchical head can be built.
+_FEATURE_NETWORKS = (
+    'alexnet_v2', 'cifarnet', 'overfeat', 'vgg_a', 'vgg_16', 'vgg_19',
+    'inception_v1', 'inception_v2', 'inception_v3', 'inception_v4',
+    'inception_resnet_v2', 'lenet', 'resnet_v1_50', 'resnet_v1_101',
+    'resnet_v1_152', 'resnet_v1_200', 'resnet_v2_50', 'resnet_v2_101',
+    'resnet_v2_152', 'resnet_v2_200', 'mobilenet_v1', 'mobilenet_v1_075',
+    'mobilenet_v1_050', 'mobilenet_v1_025', 'mobilenet_v2',
+    'mobilenet_v2_140', 'mobilenet_v2_035', 'pnasnet_large',
+    'pnasnet_mobile')
+
+
+def get_network_fn(name, num_classes, weight_decay=0.0, is_training=False,
+                   label_groups=None, top_k_groups=0, channel_config=None):
   """Returns a network_fn such as `logits, end_points = network_fn(images)`.
 
   Args:
@@ -121,6 +139,14 @@ def get_network_fn(name, num_classes, weight_decay=0.0, is_training=False):
     weight_decay: The l2 coefficient for the model weights.
     is_training: `True` if the model is being used for training and `False`
       otherwise.
+    label_groups: If not None, the list of the group index of every class, and
+      the logits layer is replaced by the hierarchical head of
+      `hierarchical_head.hierarchical_logits` over these groups.
+    top_k_groups: The number of most likely groups whose classes the
+      hierarchical head computes at inference, or 0 for all of them.
+    channel_config: If not None, the dict from the variable scopes of the
+      convolutions to their number of output channels of a network thinned by
+      structured_prune.py. Only for inception_v3 and inception_v4.
 
   Returns:
     network_fn: A function that applies the model to a batch of images. It has
@@ -140,16 +166,35 @@ def get_network_fn(name, num_classes, weight_decay=0.0, is_training=False):
       the caller to do this or not.
 
   Raises:
-    ValueError: If network `name` is not recognized.
+    ValueError: If network `name` is not recognized, if `label_groups` does
+      not have `num_classes` groups or the network does not return its
+      features, or if the network has no channel config.
   """
   if name not in networks_map:
     raise ValueError('Name of network unknown %s' % name)
+  if channel_config is not None and name not in _CHANNEL_CONFIG_NETWORKS:
+    raise ValueError('%s does not support a channel config' % name)
+  if label_groups is not None and name not in _FEATURE_NETWORKS:
+    raise ValueError('%s does not support a hierarchical head' % name)
+  if label_groups is not None and len(label_groups) != num_classes:
+    raise ValueError('label_groups has %d classes, expected %d' %
+                     (len(label_groups), num_classes))
   func = networks_map[name]
   @functools.wraps(func)
   def network_fn(images, **kwargs):
+    if channel_config is not None:
+      kwargs['channel_config'] = channel_config
     arg_scope = arg_scopes_map[name](weight_decay=weight_decay)
     with slim.arg_scope(arg_scope):
-      return func(images, num_classes, is_training=is_training, **kwargs)
+      if label_groups is None:
+        return func(images, num_classes, is_training=is_training, **kwargs)
+      features, end_points = func(images, 0, is_training=is_training,
+                                  **kwargs)
+      return hierarchical_head.hierarchical_logits(
+          features, label_groups, end_points,
+          is_training=is_training,
+          top_k_groups=top_k_groups,
+          weight_decay=weight_decay)
   if hasattr(func, 'default_image_size'):
     network_fn.default_image_size = func.default_image_size
 
@@ -57,5 +57,17 @@ class NetworksTest(tf.test.TestCase):
         self.assertEqual(logits.get_shape().as_list()[0], batch_size)
         self.assertEqual(logits.get_shape().as_list()[-1], num_classes)
 
+  def testHierarchicalHeadRequiresTheFeatures(self):
+    label_groups = [0, 0, 1]
+    net_fn = nets_factory.get_network_fn('lenet', 3, label_groups=label_groups)
+    with tf.Graph().as_default():
+      logits, _ = net_fn(tf.random_uniform((2, 28, 28, 3)))
+      self.assertEqual(logits.get_shape().as_list(), [2, 3])
+    # The squeeze-and-excitation and nasnet networks build a logits layer of
+    # 0 classes instead of returning their features.
+    for net in ['inception_v3_se', 'inception_resnet_v2_se', 'nasnet_mobile']:
+      with self.assertRaises(ValueError):
+        nets_factory.get_network_fn(net, 3, label_groups=label_groups)
+
 if __name__ == '__main__':
   tf.test.main()
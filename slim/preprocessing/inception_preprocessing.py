@@ -153,6 +153,55 @@ def distorted_bounding_box_crop(image,
     return cropped_image, distort_bbox
 
 
+def decode_and_distorted_bounding_box_crop(image_buffer,
+                                         bbox,
+                                         min_object_covered=0.1,
+                                         aspect_ratio_range=(0.75, 1.33),
+                                         area_range=(0.05, 1.0),
+                                         max_attempts=100,
+                                         scope=None):
+  """Decodes only a randomly distorted bounding box of a JPEG image.
+
+  Same as decoding the image and calling `distorted_bounding_box_crop`, but
+  the crop window is sampled from the shape stored in the JPEG header and only
+  that window is decoded, which saves most of the decoding work on large
+  images.
+
+  Args:
+    image_buffer: scalar string Tensor with a JPEG encoded image.
+    bbox: 3-D float Tensor of bounding boxes arranged [1, num_boxes, coords]
+      where each coordinate is [0, 1) and the coordinates are arranged
+      as [ymin, xmin, ymax, xmax]. If num_boxes is 0 then it would use the whole
+      image.
+    min_object_covered: See `distorted_bounding_box_crop`.
+    aspect_ratio_range: See `distorted_bounding_box_crop`.
+    area_range: See `distorted_bounding_box_crop`.
+    max_attempts: See `distorted_bounding_box_crop`.
+    scope: Optional scope for name_scope.
+  Returns:
+    A tuple, a 3-D uint8 Tensor cropped_image and the distorted bbox
+  """
+  with tf.name_scope(scope, 'decode_and_distorted_bounding_box_crop',
+                     [image_buffer, bbox]):
+    sample_distorted_bounding_box = tf.image.sample_distorted_bounding_box(
+        tf.image.extract_jpeg_shape(image_buffer),
+        bounding_boxes=bbox,
+        min_object_covered=min_object_covered,
+        aspect_ratio_range=aspect_ratio_range,
+        area_range=area_range,
+        max_attempts=max_attempts,
+        use_image_if_no_bounding_boxes=True)
+    bbox_begin, bbox_size, distort_bbox = sample_distorted_bounding_box
+
+    # Decode only the window [offset_y, offset_x, target_height, target_width].
+    offset_y, offset_x, _ = tf.unstack(bbox_begin)
+    target_height, target_width, _ = tf.unstack(bbox_size)
+    crop_window = tf.stack([offset_y, offset_x, target_height, target_width])
+    cropped_image = tf.image.decode_and_crop_jpeg(image_buffer, crop_window,
+                                                  channels=3)
+    return cropped_image, distort_bbox
+
+
 def preprocess_for_train(image, height, width, bbox,
                          fast_mode=True,
                          scope=None,
@@ -207,38 +256,85 @@ def preprocess_for_train(image, height, width, bbox,
       tf.summary.image('images_with_distorted_bounding_box',
                        image_with_distorted_box)
 
-    # This resizing operation may distort the images because the aspect
-    # ratio is not respected. We select a resize method in a round robin
-    # fashion based on the thread number.
-    # Note that ResizeMethod contains 4 enumerated resizing methods.
-
-    # We select only 1 case for fast_mode bilinear.
-    num_resize_cases = 1 if fast_mode else 4
-    distorted_image = apply_with_random_selector(
-        distorted_image,
-        lambda x, method: tf.image.resize_images(x, [height, width], method),
-        num_cases=num_resize_cases)
-
-    if add_image_summaries:
-      tf.summary.image('cropped_resized_image',
-                       tf.expand_dims(distorted_image, 0))
-
-    # Randomly flip the image horizontally.
-    distorted_image = tf.image.random_flip_left_right(distorted_image)
+    return _distort_cropped_image(distorted_image, height, width, fast_mode,
+                                  add_image_summaries)
+
+
+def _distort_cropped_image(distorted_image, height, width, fast_mode,
+                           add_image_summaries):
+  """Resizes, flips and color-distorts a randomly cropped float image."""
+  # This resizing operation may distort the images because the aspect
+  # ratio is not respected. We select a resize method in a round robin
+  # fashion based on the thread number.
+  # Note that ResizeMethod contains 4 enumerated resizing methods.
+
+  # We select only 1 case for fast_mode bilinear.
+  num_resize_cases = 1 if fast_mode else 4
+  distorted_image = apply_with_random_selector(
+      distorted_image,
+      lambda x, method: tf.image.resize_images(x, [height, width], method),
+      num_cases=num_resize_cases)
+
+  if add_image_summaries:
+    tf.summary.image('cropped_resized_image',
+                     tf.expand_dims(distorted_image, 0))
+
+  # Randomly flip the image horizontally.
+  distorted_image = tf.image.random_flip_left_right(distorted_image)
+
+  # Randomly distort the colors. There are 1 or 4 ways to do it.
+  num_distort_cases = 1 if fast_mode else 4
+  distorted_image = apply_with_random_selector(
+      distorted_image,
+      lambda x, ordering: distort_color(x, ordering, fast_mode),
+      num_cases=num_distort_cases)
+
+  if add_image_summaries:
+    tf.summary.image('final_distorted_image',
+                     tf.expand_dims(distorted_image, 0))
+  distorted_image = tf.subtract(distorted_image, 0.5)
+  distorted_image = tf.multiply(distorted_image, 2.0)
+  return distorted_image
+
+
+def preprocess_jpeg_for_train(image_buffer, height, width, bbox,
+                              fast_mode=True,
+                              scope=None,
+                              add_image_summaries=True):
+  """Distort one JPEG encoded image for training a network.
+
+  Produces the same distribution of images as `preprocess_for_train` on the
+  decoded image, but only decodes the randomly sampled crop window (see
+  `decode_and_distorted_bounding_box_crop`). The bounding box summaries are
+  not available since the full image is never decoded.
 
-    # Randomly distort the colors. There are 1 or 4 ways to do it.
-    num_distort_cases = 1 if fast_mode else 4
-    distorted_image = apply_with_random_selector(
-        distorted_image,
-        lambda x, ordering: distort_color(x, ordering, fast_mode),
-        num_cases=num_distort_cases)
-
-    if add_image_summaries:
-      tf.summary.image('final_distorted_image',
-                       tf.expand_dims(distorted_image, 0))
-    distorted_image = tf.subtract(distorted_image, 0.5)
-    distorted_image = tf.multiply(distorted_image, 2.0)
-    return distorted_image
+  Args:
+    image_buffer: scalar string Tensor with a JPEG encoded image.
+    height: integer
+    width: integer
+    bbox: 3-D float Tensor of bounding boxes arranged [1, num_boxes, coords]
+      where each coordinate is [0, 1) and the coordinates are arranged
+      as [ymin, xmin, ymax, xmax].
+    fast_mode: Optional boolean, if True avoids slower transformations (i.e.
+      bi-cubic resizing, random_hue or random_contrast).
+    scope: Optional scope for name_scope.
+    add_image_summaries: Enable image summaries.
+  Returns:
+    3-D float Tensor of distorted image used for training with range [-1, 1].
+  """
+  with tf.name_scope(scope, 'distort_image', [image_buffer, height, width,
+                                              bbox]):
+    if bbox is None:
+      bbox = tf.constant([0.0, 0.0, 1.0, 1.0],
+                         dtype=tf.float32,
+                         shape=[1, 1, 4])
+    distorted_image, _ = decode_and_distorted_bounding_box_crop(image_buffer,
+                                                                bbox)
+    distorted_image.set_shape([None, None, 3])
+    distorted_image = tf.image.convert_image_dtype(distorted_image,
+                                                   dtype=tf.float32)
+    return _distort_cropped_image(distorted_image, height, width, fast_mode,
+                                  add_image_summaries)
 
 
 def preprocess_for_eval(image, height, width,
@@ -282,6 +378,45 @@ def preprocess_for_eval(image, height, width,
     return image
 
 
+def decode_jpeg_for_eval(image_buffer, height, width,
+                         central_fraction=0.875, scope=None):
+  """Decodes a JPEG image at a reduced resolution for evaluation.
+
+  libjpeg can scale the image by 1/2, 1/4 or 1/8 while decoding, skipping most
+  of the inverse DCT work. The largest of these factors is selected for which
+  the central crop of `preprocess_for_eval` is still at least height x width,
+  so that the final resize still downsizes the image. Small images are decoded
+  at full resolution.
+
+  Args:
+    image_buffer: scalar string Tensor with a JPEG encoded image.
+    height: integer
+    width: integer
+    central_fraction: Optional Float, fraction of the image cropped by
+      `preprocess_for_eval`.
+    scope: Optional scope for name_scope.
+  Returns:
+    3-D uint8 Tensor of the decoded image.
+  """
+  with tf.name_scope(scope, 'decode_jpeg_for_eval', [image_buffer]):
+    image_shape = tf.to_float(tf.image.extract_jpeg_shape(image_buffer))
+    crop_height = image_shape[0] * (central_fraction or 1.0)
+    crop_width = image_shape[1] * (central_fraction or 1.0)
+
+    def decode(ratio):
+      return lambda: tf.image.decode_jpeg(image_buffer, channels=3,
+                                          ratio=ratio)
+
+    # tf.case picks the first satisfied predicate, i.e. the largest ratio.
+    image = tf.case(
+        [(tf.logical_and(crop_height >= ratio * height,
+                         crop_width >= ratio * width), decode(ratio))
+         for ratio in (8, 4, 2)],
+        default=decode(1), exclusive=False)
+    image.set_shape([None, None, 3])
+    return image
+
+
 def preprocess_image(image, height, width,
                      is_training=False,
                      bbox=None,
@@ -316,3 +451,65 @@ def preprocess_image(image, height, width,
                                 add_image_summaries=add_image_summaries)
   else:
     return preprocess_for_eval(image, height, width)
+
+
+def preprocess_encoded_image(image_buffer, image_format, height, width,
+                             is_training=False,
+                             bbox=None,
+                             fast_mode=True,
+                             dct_scaled_decode=False):
+  """Decodes and pre-processes one encoded image for training or evaluation.
+
+  For training, JPEG images go through `preprocess_jpeg_for_train` so that
+  only the crop window is decoded, and other formats are fully decoded and
+  go through `preprocess_for_train`. Image summaries are disabled since the
+  two paths are selected at run time.
+
+  Args:
+    image_buffer: scalar string Tensor with a PNG or JPEG encoded image.
+    image_format: scalar string Tensor with the format of the image, as stored
+      under `image/format` in the TFRecords.
+    height: integer, image expected height.
+    width: integer, image expected width.
+    is_training: Boolean. If true it would transform an image for train,
+      otherwise it would transform it for evaluation.
+    bbox: 3-D float Tensor of bounding boxes arranged [1, num_boxes, coords]
+      where each coordinate is [0, 1) and the coordinates are arranged as
+      [ymin, xmin, ymax, xmax].
+    fast_mode: Optional boolean, if True avoids slower transformations.
+    dct_scaled_decode: Optional boolean, if True JPEG images are decoded for
+      evaluation at a reduced resolution (see `decode_jpeg_for_eval`).
+
+  Returns:
+    3-D float Tensor containing an appropriately scaled image
+  """
+  is_png = tf.logical_or(tf.equal(image_format, 'png'),
+                         tf.equal(image_format, 'PNG'))
+
+  def decode_image():
+    image = tf.cond(
+        is_png,
+        lambda: tf.image.decode_png(image_buffer, channels=3),
+        lambda: tf.image.decode_jpeg(image_buffer, channels=3))
+    image.set_shape([None, None, 3])
+    return image
+
+  if not is_training:
+    if dct_scaled_decode:
+      image = tf.cond(
+          is_png,
+          lambda: tf.image.decode_png(image_buffer, channels=3),
+          lambda: decode_jpeg_for_eval(image_buffer, height, width))
+      image.set_shape([None, None, 3])
+    else:
+      image = decode_image()
+    return preprocess_for_eval(image, height, width)
+
+  image = tf.cond(
+      is_png,
+      lambda: preprocess_for_train(decode_image(), height, width, bbox,
+                                   fast_mode, add_image_summaries=False),
+      lambda: preprocess_jpeg_for_train(image_buffer, height, width, bbox,
+                                        fast_mode, add_image_summaries=False))
+  image.set_shape([height, width, 3])
+  return image
@@ -27,6 +27,37 @@ from preprocessing import vgg_preprocessing
 
 slim = tf.contrib.slim
 
+_PREPROCESSING_FN_MAP = {
+    'cifarnet': cifarnet_preprocessing,
+    'inception': inception_preprocessing,
+    'inception_v1': inception_preprocessing,
+    'inception_v2': inception_preprocessing,
+    'inception_v3': inception_preprocessing,
+    'inception_v4': inception_preprocessing,
+    'inception_resnet_v2': inception_preprocessing,
+    'lenet': lenet_preprocessing,
+    'mobilenet_v1': inception_preprocessing,
+    'mobilenet_v2': inception_preprocessing,
+    'mobilenet_v2_035': inception_preprocessing,
+    'mobilenet_v2_140': inception_preprocessing,
+    'nasnet_mobile': inception_preprocessing,
+    'nasnet_large': inception_preprocessing,
+    'pnasnet_mobile': inception_preprocessing,
+    'pnasnet_large': inception_preprocessing,
+    'resnet_v1_50': vgg_preprocessing,
+    'resnet_v1_101': vgg_preprocessing,
+    'resnet_v1_152': vgg_preprocessing,
+    'resnet_v1_200': vgg_preprocessing,
+    'resnet_v2_50': vgg_preprocessing,
+    'resnet_v2_101': vgg_preprocessing,
+    'resnet_v2_152': vgg_preprocessing,
+    'resnet_v2_200': vgg_preprocessing,
+    'vgg': vgg_preprocessing,
+    'vgg_a': vgg_preprocessing,
+    'vgg_16': vgg_preprocessing,
+    'vgg_19': vgg_preprocessing,
+}
+
 
 def get_preprocessing(name, is_training=False):
   """Returns preprocessing_fn(image, height, width, **kwargs).
@@ -44,42 +75,48 @@ def get_preprocessing(name, is_training=False):
   Raises:
     ValueError: If Preprocessing `name` is not recognized.
   """
-  preprocessing_fn_map = {
-      'cifarnet': cifarnet_preprocessing,
-      'inception': inception_preprocessing,
-      'inception_v1': inception_preprocessing,
-      'inception_v2': inception_preprocessing,
-      'inception_v3': inception_preprocessing,
-      'inception_v4': inception_preprocessing,
-      'inception_resnet_v2': inception_preprocessing,
-      'lenet': lenet_preprocessing,
-      'mobilenet_v1': inception_preprocessing,
-      'mobilenet_v2': inception_preprocessing,
-      'mobilenet_v2_035': inception_preprocessing,
-      'mobilenet_v2_140': inception_preprocessing,
-      'nasnet_mobile': inception_preprocessing,
-      'nasnet_large': inception_preprocessing,
-      'pnasnet_mobile': inception_preprocessing,
-      'pnasnet_large': inception_preprocessing,
-      'resnet_v1_50': vgg_preprocessing,
-      'resnet_v1_101': vgg_preprocessing,
-      'resnet_v1_152': vgg_preprocessing,
-      'resnet_v1_200': vgg_preprocessing,
-      'resnet_v2_50': vgg_preprocessing,
-      'resnet_v2_101': vgg_preprocessing,
-      'resnet_v2_152': vgg_preprocessing,
-      'resnet_v2_200': vgg_preprocessing,
-      'vgg': vgg_preprocessing,
-      'vgg_a': vgg_preprocessing,
-      'vgg_16': vgg_preprocessing,
-      'vgg_19': vgg_preprocessing,
-  }
-
-  if name not in preprocessing_fn_map:
+  if name not in _PREPROCESSING_FN_MAP:
     raise ValueError('Preprocessing name [%s] was not recognized' % name)
 
   def preprocessing_fn(image, output_height, output_width, **kwargs):
-    return preprocessing_fn_map[name].preprocess_image(
+    return _PREPROCESSING_FN_MAP[name].preprocess_image(
         image, output_height, output_width, is_training=is_training, **kwargs)
 
   return preprocessing_fn
+
+
+def get_encoded_preprocessing(name, is_training=False):
+  """Returns preprocessing_fn(image_buffer, image_format, height, width).
+
+  The returned function decodes the image itself, which lets it decode only
+  the region it crops. Only the inception preprocessing supports it.
+
+  Args:
+    name: The name of the preprocessing function.
+    is_training: `True` if the model is being used for training and `False`
+      otherwise.
+
+  Returns:
+    preprocessing_fn: A function that decodes and preprocesses a single
+      encoded image (pre-batch). It has the following signature:
+        image = preprocessing_fn(image_buffer, image_format, output_height,
+                                 output_width, ...).
+
+  Raises:
+    ValueError: If Preprocessing `name` is not recognized or does not support
+      encoded images.
+  """
+  if name not in _PREPROCESSING_FN_MAP:
+    raise ValueError('Preprocessing name [%s] was not recognized' % name)
+  module = _PREPROCESSING_FN_MAP[name]
+  if not hasattr(module, 'preprocess_encoded_image'):
+    raise ValueError('Preprocessing [%s] does not support encoded images' %
+                     name)
+
+  def preprocessing_fn(image_buffer, image_format, output_height, output_width,
+                       **kwargs):
+    return module.preprocess_encoded_image(
+        image_buffer, image_format, output_height, output_width,
+        is_training=is_training, **kwargs)
+
+  return preprocessing_fn
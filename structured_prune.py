@@ -0,0 +1,231 @@
+"""Prunes whole channels of inception_v3 and inception_v4 checkpoints.
+
+Unlike prune.py, which zeroes small weights in place, the output channels of
+the convolutions of the network with the smallest filter L1 norm (or batch
+norm scale) are removed, with the input channels of the convolutions, branch
+concatenations and logits that read them. The pruned checkpoint is smaller,
+and it is loaded into the thinner network built from the channel_config.json
+written next to it:
+
+python structured_prune.py --model_name=inception_v3 \
+    --checkpoint_path=./checkpoints/haute_garonne_other \
+    --output_path=./checkpoints/pruned/model.ckpt --prune_ratio=0.3
+
+python train.py ... --model_name=inception_v3 \
+    --checkpoint_path=./checkpoints/pruned/model.ckpt \
+    --channel_config=./checkpoints/pruned/channel_config.json
+
+The FLOPs, parameters and CPU latency of a batch of one image of the network
+are reported before and after the pruning. Only the model variables are
+written, not the optimizer slots nor the moving averages, so the pruned
+network is meant to be fine-tuned again.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import warnings
+warnings.filterwarnings('ignore')
+import json
+import os
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+
+sys.path.insert(0, './slim/')
+import checkpoint_tools
+from nets import channel_pruning
+from nets import inception_utils
+from nets import nets_factory
+
+slim = tf.contrib.slim
+
+tf.app.flags.DEFINE_string(
+    'model_name', 'inception_v3',
+    'The name of the architecture, inception_v3 or inception_v4.')
+
+tf.app.flags.DEFINE_string(
+    'checkpoint_path', None,
+    'The checkpoint to prune, or the directory of its latest checkpoint.')
+
+tf.app.flags.DEFINE_string(
+    'channel_config', None,
+    'The channel config of the checkpoint if it was already pruned.')
+
+tf.app.flags.DEFINE_string(
+    'output_path', None,
+    'The path of the pruned checkpoint. The channel config is written to '
+    'channel_config.json in its directory.')
+
+tf.app.flags.DEFINE_float(
+    'prune_ratio', 0.25,
+    'The fraction of the output channels of every pruned convolution removed.')
+
+tf.app.flags.DEFINE_string(
+    'prune_plan', None,
+    'The prune_plan.json of prune_sensitivity.py --method=channel, whose '
+    'ratios of every convolution replace --prune_ratio.')
+
+tf.app.flags.DEFINE_string(
+    'criterion', 'l1',
+    'The importance of a channel, "l1" for the L1 norm of its filter or '
+    '"bn_gamma" for its batch norm scale. The batch norms of the inception '
+    'networks have no scale, so they only support "l1".')
+
+tf.app.flags.DEFINE_string(
+    'prune_scopes', None,
+    'Comma-separated list of fnmatch patterns of the convolutions to prune, '
+    'e.g. "InceptionV3/Mixed_6*,InceptionV3/Mixed_7*". Defaults to all the '
+    'convolutions before the logits.')
+
+tf.app.flags.DEFINE_integer(
+    'channel_round', 8,
+    'The numbers of kept channels are rounded up to a multiple of it.')
+
+tf.app.flags.DEFINE_integer(
+    'min_channels', 8, 'The smallest number of channels of a convolution.')
+
+tf.app.flags.DEFINE_integer(
+    'image_size', None,
+    'The image size of the statistics. Defaults to the network default.')
+
+tf.app.flags.DEFINE_integer(
+    'latency_runs', 20,
+    'The number of timed inferences of the latency, after 5 warmup ones.')
+
+FLAGS = tf.app.flags.FLAGS
+
+# The logits weights of every network, whose shape gives the number of classes.
+_LOGITS_VARIABLES = {
+    'inception_v3': 'InceptionV3/Logits/Conv2d_1c_1x1/weights',
+    'inception_v4': 'InceptionV4/Logits/Logits/weights',
+}
+
+# The scopes of the heads, whose layers are never pruned.
+_HEAD_SCOPES = ('Logits', 'AuxLogits')
+
+
+def _build_network(num_classes, channel_config, create_aux_logits):
+  """Builds the network on a batch of one image and returns its logits."""
+  network_fn = nets_factory.get_network_fn(
+      FLAGS.model_name, num_classes, is_training=False,
+      channel_config=channel_config)
+  image_size = FLAGS.image_size or network_fn.default_image_size
+  images = tf.random_uniform([1, image_size, image_size, 3])
+  logits, _ = network_fn(images, create_aux_logits=create_aux_logits)
+  return logits
+
+
+def _get_statistics(num_classes, channel_config):
+  """Returns the FLOPs, parameters and CPU latency of the inference network."""
+  with tf.Graph().as_default() as graph:
+    logits = _build_network(num_classes, channel_config,
+                            create_aux_logits=False)
+    flops = tf.profiler.profile(
+        graph, options=tf.profiler.ProfileOptionBuilder(
+            tf.profiler.ProfileOptionBuilder.float_operation()
+        ).with_empty_output().build()).total_float_ops
+    num_parameters = sum(variable.shape.num_elements()
+                         for variable in slim.get_model_variables())
+    config = tf.ConfigProto(device_count={'GPU': 0})
+    with tf.Session(config=config) as sess:
+      sess.run(tf.global_variables_initializer())
+      for _ in range(5):
+        sess.run(logits)
+      latencies = []
+      for _ in range(FLAGS.latency_runs):
+        start_time = time.time()
+        sess.run(logits)
+        latencies.append(time.time() - start_time)
+  return flops, num_parameters, 1000 * np.median(latencies)
+
+
+def main(_):
+  if FLAGS.model_name not in _LOGITS_VARIABLES:
+    raise ValueError('Structured pruning supports %s' %
+                     ', '.join(sorted(_LOGITS_VARIABLES)))
+  if not FLAGS.checkpoint_path or not FLAGS.output_path:
+    raise ValueError('You must supply --checkpoint_path and --output_path')
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  checkpoint_path = FLAGS.checkpoint_path
+  if tf.gfile.IsDirectory(checkpoint_path):
+    checkpoint_path = tf.train.latest_checkpoint(checkpoint_path)
+  reader = checkpoint_tools.get_checkpoint_reader(checkpoint_path)
+  shapes = reader.get_variable_to_shape_map()
+  logits_variable = _LOGITS_VARIABLES[FLAGS.model_name]
+  if logits_variable not in shapes:
+    raise ValueError('%s has no %s' % (checkpoint_path, logits_variable))
+  num_classes = shapes[logits_variable][-1]
+  network_scope = logits_variable.split('/')[0]
+  create_aux_logits = any(name.startswith(network_scope + '/AuxLogits/')
+                          for name in shapes)
+  channel_config = None
+  if FLAGS.channel_config:
+    channel_config = inception_utils.read_channel_config(FLAGS.channel_config)
+
+  with tf.Graph().as_default() as graph:
+    _build_network(num_classes, channel_config, create_aux_logits)
+    variable_names = [variable.op.name for variable in tf.global_variables()]
+    prunable_convs = [
+        conv for conv in channel_pruning.find_prunable_convs(
+            graph,
+            FLAGS.prune_scopes.split(',') if FLAGS.prune_scopes else None)
+        if conv.scope.split('/')[1] not in _HEAD_SCOPES]
+  tf.logging.info('Pruning %d convolutions of %s', len(prunable_convs),
+                  checkpoint_path)
+
+  prune_ratio = FLAGS.prune_ratio
+  if FLAGS.prune_plan:
+    with tf.gfile.Open(FLAGS.prune_plan, 'r') as f:
+      prune_plan = json.loads(f.read())
+    if prune_plan['method'] != 'channel':
+      raise ValueError('%s is a plan of the %s method' %
+                       (FLAGS.prune_plan, prune_plan['method']))
+    prune_ratio = prune_plan['prune_ratios']
+  kept_channels = channel_pruning.select_channels(
+      reader.get_tensor, prunable_convs, prune_ratio,
+      criterion=FLAGS.criterion,
+      channel_round=FLAGS.channel_round,
+      min_channels=FLAGS.min_channels)
+  pruned_channel_config = dict(channel_config or {})
+  pruned_channel_config.update(
+      channel_pruning.get_channel_config(prunable_convs, kept_channels))
+  values = channel_pruning.prune_variables(
+      reader.get_tensor, variable_names, prunable_convs, kept_channels)
+
+  # Loading the values into the thinner network checks the channel config.
+  with tf.Graph().as_default():
+    _build_network(num_classes, pruned_channel_config, create_aux_logits)
+    variables = tf.global_variables()
+    with tf.Session() as sess:
+      for variable in variables:
+        variable.load(values[variable.op.name], sess)
+      tf.gfile.MakeDirs(os.path.dirname(FLAGS.output_path) or '.')
+      tf.train.Saver(variables).save(sess, FLAGS.output_path,
+                                     write_meta_graph=False)
+  channel_config_filename = os.path.join(
+      os.path.dirname(FLAGS.output_path), 'channel_config.json')
+  with tf.gfile.Open(channel_config_filename, 'w') as f:
+    f.write(json.dumps({
+        'model_name': FLAGS.model_name,
+        'checkpoint_path': checkpoint_path,
+        'prune_ratio': prune_ratio,
+        'criterion': FLAGS.criterion,
+        'channels': pruned_channel_config,
+    }, indent=2, sort_keys=True))
+  print('Pruned checkpoint saved at %s, channel config at %s' %
+        (FLAGS.output_path, channel_config_filename))
+
+  print('%-10s %12s %14s %16s' % ('network', 'GFLOPs', 'parameters (M)',
+                                  'CPU latency (ms)'))
+  for name, config in [('original', channel_config),
+                       ('pruned', pruned_channel_config)]:
+    flops, num_parameters, latency_ms = _get_statistics(num_classes, config)
+    print('%-10s %12.2f %14.2f %16.1f' % (name, flops / 1e9,
+                                          num_parameters / 1e6, latency_ms))
+
+
+if __name__ == '__main__':
+  tf.app.run()
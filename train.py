@@ -19,14 +19,25 @@ from __future__ import division
 from __future__ import print_function
 import warnings
 warnings.filterwarnings('ignore')
+import multiprocessing
+import os
 import sys
+import time
 import tensorflow as tf
 
 sys.path.insert(0, './slim/')
+import checkpoint_tools
+from datasets import bottleneck_cache
 from datasets import dataset_factory_fgvc
+from datasets import fgvc
+from datasets import teacher_logits
+from deployment import local_allreduce
 from deployment import model_deploy
+from nets import hierarchical_head
+from nets import inception_utils
 from nets import nets_factory
 from preprocessing import preprocessing_factory
+import training_hooks
 
 slim = tf.contrib.slim
 
@@ -76,6 +87,60 @@ tf.app.flags.DEFINE_integer(
 tf.app.flags.DEFINE_integer(
     'task', 0, 'Task id of the replica running the training.')
 
+tf.app.flags.DEFINE_integer(
+    'local_workers', 1,
+    'The number of training processes launched on this host. Every process '
+    'is pinned to its share of the CPUs and reads its share of the dataset '
+    'shards, and the gradients are averaged across the processes through '
+    'shared memory. --batch_size is per process. Only the first process '
+    'writes checkpoints and summaries.')
+
+tf.app.flags.DEFINE_integer(
+    'input_stats_every_n_steps', 0,
+    'If positive, the fill level of the input queues is sampled every step and '
+    'every n-th step is traced to split its time into input wait and compute. '
+    'The measures are written as summaries and to input_stats_<task>.json in '
+    'the train_dir.')
+
+tf.app.flags.DEFINE_float(
+    'input_wait_threshold', 0.25,
+    'The fraction of the step time spent waiting for inputs from which a '
+    'sampled step is considered starved.')
+
+tf.app.flags.DEFINE_integer(
+    'input_stall_window', 5,
+    'The number of consecutive starved samples reported as an input stall.')
+
+tf.app.flags.DEFINE_integer(
+    'run_stats_every_n_steps', 0,
+    'If positive, the images/s and the peak memory of the process are written '
+    'as summaries every n steps, and to run_stats_<task>.json in the '
+    'train_dir at the end of the run.')
+
+tf.app.flags.DEFINE_integer(
+    'profile_every_n_steps', 0,
+    'If positive, every n-th step is traced with a full trace. The traces are '
+    'written as Chrome timelines next to a table of the op times in '
+    '--profile_dir.')
+
+tf.app.flags.DEFINE_integer(
+    'profile_start_step', 0,
+    'The first step, counted from the start of the process, of a window of '
+    '--profile_num_steps traced steps.')
+
+tf.app.flags.DEFINE_integer(
+    'profile_num_steps', 0, 'The number of steps of the traced window.')
+
+tf.app.flags.DEFINE_string(
+    'profile_scopes', None,
+    'Comma-separated list of fnmatch patterns of op names whose time is '
+    'aggregated in the profile, e.g. "InceptionV3/Mixed_6*,*/Logits/*".')
+
+tf.app.flags.DEFINE_string(
+    'profile_dir', None,
+    'Directory of the profile. Defaults to the profile/ subdirectory of '
+    'the train_dir.')
+
 ######################
 # Optimization Flags #
 ######################
@@ -169,6 +234,13 @@ tf.app.flags.DEFINE_integer(
     'replicas_to_aggregate', 1,
     'The Number of gradients to collect before updating params.')
 
+tf.app.flags.DEFINE_integer(
+    'accumulation_steps', 1,
+    'The number of batches whose gradients are accumulated before each update '
+    'of the parameters, for an effective batch size of accumulation_steps * '
+    'batch_size. global_step and --max_number_of_steps count the updates. '
+    'Cannot be combined with multiple --worker_replicas.')
+
 tf.app.flags.DEFINE_float(
     'moving_average_decay', None,
     'The decay to use for the moving average.'
@@ -188,6 +260,17 @@ tf.app.flags.DEFINE_string(
     'dataset_dir', './data/',
     'The directory where the dataset files are stored.')
 
+tf.app.flags.DEFINE_string(
+    'input_backend', 'queue',
+    'The input pipeline, either "queue" for the queue-runner '
+    'DatasetDataProvider or "tf_data" for a tf.data pipeline.')
+
+tf.app.flags.DEFINE_boolean(
+    'fused_decode_and_crop', False,
+    'Whether to sample the training crop from the JPEG header and decode only '
+    'the crop window. Requires --input_backend=tf_data and the inception '
+    'preprocessing.')
+
 tf.app.flags.DEFINE_integer(
     'labels_offset', 0,
     'An offset for the labels in the dataset. This flag is primarily used to '
@@ -197,6 +280,18 @@ tf.app.flags.DEFINE_integer(
 tf.app.flags.DEFINE_string(
     'model_name', 'inception_v3', 'The name of the architecture to train.')
 
+tf.app.flags.DEFINE_boolean(
+    'hierarchical_head', False,
+    'Whether to replace the logits layer by a softmax over the taxonomic '
+    'classes of the labels followed by a softmax over the species of every '
+    'class. Requires a dataset converted with the taxa of its labels. The '
+    'head variables are in the HierarchicalLogits scope.')
+
+tf.app.flags.DEFINE_string(
+    'channel_config', None,
+    'The channel_config.json written by structured_prune.py next to a pruned '
+    'inception checkpoint, to train the thinner network it holds.')
+
 tf.app.flags.DEFINE_string(
     'preprocessing_name', None, 'The name of the preprocessing to use. If left '
     'as `None`, then the model_name flag is used.')
@@ -210,6 +305,26 @@ tf.app.flags.DEFINE_integer(
 tf.app.flags.DEFINE_integer('max_number_of_steps', None,
                             'The maximum number of training steps.')
 
+tf.app.flags.DEFINE_string(
+    'resolution_schedule', None,
+    'Comma-separated list of training stages "size:last_step[:batch_size[:'
+    'learning_rate]]", e.g. "224:3000:64,299:8000:32". Every stage trains at '
+    'its image size until the global step reaches its last step, resuming '
+    'from the checkpoint of the previous stage in the train_dir. The batch '
+    'size defaults to --batch_size and the learning rate to --learning_rate '
+    'scaled by the ratio of the batch sizes. Replaces --train_image_size and '
+    '--max_number_of_steps.')
+
+tf.app.flags.DEFINE_integer(
+    'stage_start_step', 0,
+    'Internal: the global step at which the current --resolution_schedule '
+    'stage starts.')
+
+tf.app.flags.DEFINE_integer(
+    'stage_start_images', 0,
+    'Internal: the number of images the stages before the current one train '
+    'on.')
+
 #####################
 # Fine-Tuning Flags #
 #####################
@@ -232,9 +347,151 @@ tf.app.flags.DEFINE_boolean(
     'ignore_missing_vars', False,
     'When restoring a checkpoint would ignore missing variables.')
 
+tf.app.flags.DEFINE_boolean(
+    'incremental_checkpoints', False,
+    'Whether to checkpoint only the variables the training updates, written '
+    'in the background. The other variables are read from --checkpoint_path, '
+    'recorded in base_checkpoint.json in the train_dir, which must not change '
+    'afterwards.')
+
+####################
+# Bottleneck Flags #
+####################
+
+tf.app.flags.DEFINE_string(
+    'bottleneck_dir', None,
+    'Directory of the cached bottleneck features. If set, the features of the '
+    'training split at --bottleneck_endpoint are computed once with the '
+    'weights of --checkpoint_path, and only the layers after that end point '
+    'are trained on them.')
+
+tf.app.flags.DEFINE_string(
+    'bottleneck_endpoint', 'AvgPool_1a',
+    'The end point of the network whose features are cached, e.g. AvgPool_1a, '
+    'Mixed_7c or Mixed_6e.')
+
+tf.app.flags.DEFINE_integer(
+    'bottleneck_num_views', 0,
+    'The number of augmented views of every image cached with the training '
+    'preprocessing. With 0, a single view is cached with the evaluation '
+    'preprocessing.')
+
+######################
+# Distillation Flags #
+######################
+
+tf.app.flags.DEFINE_string(
+    'distillation_dir', None,
+    'Directory of the cached teacher logits. If set, the logits of '
+    '--teacher_model_name are computed once for every record of the training '
+    'split, and the student is also trained on the teacher soft targets. '
+    'Requires --input_backend=tf_data and a dataset converted with the '
+    'manifest rows.')
+
+tf.app.flags.DEFINE_string(
+    'teacher_model_name', None,
+    'The name of the teacher architecture. Defaults to --model_name.')
+
+tf.app.flags.DEFINE_string(
+    'teacher_checkpoint_path', None,
+    'The checkpoint, or directory of checkpoints, of the teacher trained on '
+    'the same classes.')
+
+tf.app.flags.DEFINE_integer(
+    'teacher_image_size', None,
+    'The image size the teacher sees. Defaults to its default image size.')
+
+tf.app.flags.DEFINE_integer(
+    'teacher_top_k', 0,
+    'If positive, only the k largest teacher logits of every record are '
+    'stored and the soft targets are spread over these classes.')
+
+tf.app.flags.DEFINE_float(
+    'distillation_temperature', 4.0,
+    'The temperature of the teacher and student softmax in the soft target '
+    'loss.')
+
+tf.app.flags.DEFINE_float(
+    'distillation_weight', 0.5,
+    'The weight of the soft target loss, the labels loss being weighted by '
+    'one minus it. The soft target loss is also scaled by the squared '
+    'temperature to keep its gradients on the scale of the labels loss.')
+
+####################
+# Evaluation Flags #
+####################
+
+tf.app.flags.DEFINE_integer(
+    'eval_every_n_steps', 0,
+    'If positive, the model is evaluated every n global steps on a cached '
+    'subset of --eval_split_name, in the training process. The metrics are '
+    'written to eval_log.jsonl and the best checkpoint to the best/ '
+    'subdirectory of the train_dir.')
+
+tf.app.flags.DEFINE_string(
+    'eval_split_name', 'validation', 'The name of the evaluated split.')
+
+tf.app.flags.DEFINE_integer(
+    'eval_num_samples', 1000,
+    'The number of first records of --eval_split_name evaluated, or 0 for all '
+    'of them. Their preprocessed images are cached, 1 MB each at 299px.')
+
+tf.app.flags.DEFINE_integer(
+    'eval_batch_size', 100, 'The number of samples in each evaluation batch.')
+
+tf.app.flags.DEFINE_integer(
+    'eval_image_size', None,
+    'Eval image size. Defaults to --train_image_size.')
+
+tf.app.flags.DEFINE_string(
+    'eval_cache_filename', '',
+    'The prefix of the files caching the preprocessed evaluation images. If '
+    'left empty, they are cached in memory.')
+
+tf.app.flags.DEFINE_string(
+    'eval_metric', 'accuracy',
+    'The metric of the best checkpoint and of the early stopping, one of '
+    '"accuracy", "recall_5" and "f1_score" (macro-averaged).')
+
+tf.app.flags.DEFINE_integer(
+    'early_stopping_patience', 0,
+    'If positive, the training stops after this many evaluations in a row '
+    'without improvement of --eval_metric.')
+
+tf.app.flags.DEFINE_float(
+    'early_stopping_min_delta', 0.0,
+    'The smallest increase of --eval_metric counted as an improvement.')
+
 FLAGS = tf.app.flags.FLAGS
 
 
+def _use_sync_replicas():
+  """Whether the optimizer is wrapped in a SyncReplicasOptimizer.
+
+  The gradient accumulation and the local workers replace the
+  SyncReplicasOptimizer, which is a no-op with a single worker replica.
+  """
+  return (FLAGS.sync_replicas and FLAGS.accumulation_steps == 1 and
+          FLAGS.local_workers == 1)
+
+
+def _images_per_step():
+  """Returns the number of images of a step of a clone and local worker."""
+  return FLAGS.batch_size * FLAGS.accumulation_steps * FLAGS.local_workers
+
+
+def _get_images_seen(global_step):
+  """Returns the number of images seen at `global_step`, as a float Tensor.
+
+  The stages of --resolution_schedule may have different batch sizes, so the
+  images are counted from the start of the current stage and added to those
+  of the previous stages.
+  """
+  return (FLAGS.stage_start_images +
+          tf.to_float(global_step - FLAGS.stage_start_step) *
+          _images_per_step())
+
+
 def _configure_learning_rate(num_samples_per_epoch, global_step):
   """Configures the learning rate.
 
@@ -252,11 +509,16 @@ def _configure_learning_rate(num_samples_per_epoch, global_step):
   # over each epoch FLAGS.num_epochs_per_decay times. This is different
   # behavior from sync replicas and is expected to produce different results.
   decay_steps = int(num_samples_per_epoch * FLAGS.num_epochs_per_decay /
-                    FLAGS.batch_size)
+                    _images_per_step())
 
-  if FLAGS.sync_replicas:
+  if _use_sync_replicas():
     decay_steps /= FLAGS.replicas_to_aggregate
 
+  if FLAGS.stage_start_step or FLAGS.stage_start_images:
+    # The decay follows the images seen, in steps of the current batch size,
+    # so the learning rate does not jump when a stage changes the batch size.
+    global_step = _get_images_seen(global_step) / _images_per_step()
+
   if FLAGS.learning_rate_decay_type == 'exponential':
     return tf.train.exponential_decay(FLAGS.learning_rate,
                                       global_step,
@@ -351,6 +613,24 @@ def _get_init_fn():
         % FLAGS.train_dir)
     return None
 
+  checkpoint_path = _get_fine_tuning_checkpoint()
+  tf.logging.info('Fine-tuning from %s' % checkpoint_path)
+
+  return slim.assign_from_checkpoint_fn(
+      checkpoint_path,
+      _get_variables_to_warm_start(),
+      ignore_missing_vars=FLAGS.ignore_missing_vars)
+
+
+def _get_fine_tuning_checkpoint():
+  """Returns the checkpoint file of --checkpoint_path."""
+  if tf.gfile.IsDirectory(FLAGS.checkpoint_path):
+    return tf.train.latest_checkpoint(FLAGS.checkpoint_path)
+  return FLAGS.checkpoint_path
+
+
+def _get_variables_to_warm_start():
+  """Returns the model variables restored from --checkpoint_path."""
   exclusions = []
   if FLAGS.checkpoint_exclude_scopes:
     exclusions = [scope.strip()
@@ -364,18 +644,45 @@ def _get_init_fn():
         break
     else:
       variables_to_restore.append(var)
+  return variables_to_restore
 
-  if tf.gfile.IsDirectory(FLAGS.checkpoint_path):
-    checkpoint_path = tf.train.latest_checkpoint(FLAGS.checkpoint_path)
-  else:
-    checkpoint_path = FLAGS.checkpoint_path
 
-  tf.logging.info('Fine-tuning from %s' % checkpoint_path)
+def _build_incremental_saver(fetches, is_chief):
+  """Builds the saver of the incremental checkpoints of the training.
 
-  return slim.assign_from_checkpoint_fn(
-      checkpoint_path,
-      variables_to_restore,
-      ignore_missing_vars=FLAGS.ignore_missing_vars)
+  Args:
+    fetches: The ops run by the training steps.
+    is_chief: Whether this worker writes the base_checkpoint.json.
+
+  Returns:
+    A `checkpoint_tools.IncrementalSaver`.
+
+  Raises:
+    ValueError: If there is no checkpoint to fine-tune from.
+  """
+  if FLAGS.checkpoint_path is None:
+    raise ValueError('--incremental_checkpoints requires --checkpoint_path')
+  base_checkpoint = _get_fine_tuning_checkpoint()
+  reader = tf.train.NewCheckpointReader(base_checkpoint)
+  updated_names = set(var.op.name for var in
+                      checkpoint_tools.get_updated_variables(fetches))
+  frozen_variables = [var for var in _get_variables_to_warm_start()
+                      if var.op.name not in updated_names and
+                      reader.has_tensor(var.op.name)]
+  frozen_names = set(var.op.name for var in frozen_variables)
+  variables = [var for var in tf.global_variables()
+               if var.op.name not in frozen_names]
+  if is_chief:
+    checkpoint_tools.write_base_checkpoint(FLAGS.train_dir, base_checkpoint,
+                                           frozen_variables)
+  tf.logging.info(
+      'Checkpointing %d variables (%.1f MB), the %d others are read from %s',
+      len(variables),
+      sum(var.shape.num_elements() * var.dtype.base_dtype.size
+          for var in variables) / float(1 << 20),
+      len(frozen_variables), base_checkpoint)
+  return checkpoint_tools.IncrementalSaver(variables, frozen_variables,
+                                           base_checkpoint)
 
 
 def _get_variables_to_train():
@@ -397,11 +704,392 @@ def _get_variables_to_train():
   return variables_to_train
 
 
+def _accumulate_gradients(optimizer, grads_and_vars, global_step, update_ops,
+                          variable_averages=None,
+                          moving_average_variables=None,
+                          allreduce=None):
+  """Splits a training step into gradient accumulation and application.
+
+  Args:
+    optimizer: The optimizer applying the gradients.
+    grads_and_vars: The list of (gradient, variable) of one batch.
+    global_step: The global_step variable, incremented on every application.
+    update_ops: The ops to run on every batch, e.g. the batch norm updates.
+    variable_averages: An optional `ExponentialMovingAverage` updated after
+      every application.
+    moving_average_variables: The variables whose moving averages are updated.
+    allreduce: An optional `local_allreduce.LocalAllReduce` averaging the
+      accumulated gradients across the local workers before they are applied.
+
+  Returns:
+    A tuple (accumulate_op, apply_op). accumulate_op runs `update_ops` and adds
+    the gradients of one batch to the accumulators. apply_op does the same for
+    the last batch, then applies the mean of the accumulated gradients,
+    updates the moving averages and resets the accumulators.
+  """
+  accumulators = []
+  accumulate_ops = list(update_ops)
+  with tf.name_scope('gradient_accumulation'):
+    for grad, var in grads_and_vars:
+      if isinstance(grad, tf.IndexedSlices):
+        grad = tf.convert_to_tensor(grad)
+      with tf.device(var.device):
+        accumulator = slim.local_variable(
+            tf.zeros(var.shape, dtype=var.dtype.base_dtype),
+            name=var.op.name)
+      accumulators.append(accumulator)
+      accumulate_ops.append(tf.assign_add(accumulator, grad))
+    accumulate_op = tf.group(*accumulate_ops)
+
+    with tf.control_dependencies([accumulate_op]):
+      mean_grads_and_vars = [
+          (accumulator.read_value() / FLAGS.accumulation_steps, var)
+          for accumulator, (_, var) in zip(accumulators, grads_and_vars)]
+    if allreduce is not None:
+      mean_grads_and_vars = allreduce.all_reduce(mean_grads_and_vars)
+    apply_op = optimizer.apply_gradients(mean_grads_and_vars,
+                                         global_step=global_step)
+    with tf.control_dependencies([apply_op]):
+      reset_ops = [tf.assign(accumulator, tf.zeros_like(accumulator))
+                   for accumulator in accumulators]
+      if variable_averages is not None:
+        reset_ops.append(variable_averages.apply(moving_average_variables))
+  return accumulate_op, tf.group(apply_op, *reset_ops)
+
+
+def _build_bottleneck_cache():
+  """Computes the bottleneck cache of the training split if it is missing."""
+  checkpoint_path = FLAGS.checkpoint_path or FLAGS.train_dir
+  if tf.gfile.IsDirectory(checkpoint_path):
+    checkpoint_path = tf.train.latest_checkpoint(checkpoint_path)
+  if not checkpoint_path:
+    raise ValueError('The bottleneck cache requires the checkpoint to '
+                     'fine-tune from with --checkpoint_path')
+
+  dataset = dataset_factory_fgvc.get_dataset(
+      FLAGS.dataset_name, FLAGS.dataset_split_name, FLAGS.dataset_dir)
+  network_fn = nets_factory.get_network_fn(
+      FLAGS.model_name,
+      num_classes=(dataset.num_classes - FLAGS.labels_offset),
+      is_training=False,
+      channel_config=_get_channel_config())
+  preprocessing_name = FLAGS.preprocessing_name or FLAGS.model_name
+  bottleneck_cache.build_cache(
+      FLAGS.bottleneck_dir,
+      dataset,
+      network_fn,
+      FLAGS.bottleneck_endpoint,
+      FLAGS.train_image_size or network_fn.default_image_size,
+      FLAGS.bottleneck_num_views,
+      preprocessing_factory.get_preprocessing(preprocessing_name,
+                                              is_training=True),
+      preprocessing_factory.get_preprocessing(preprocessing_name,
+                                              is_training=False),
+      checkpoint_path,
+      batch_size=FLAGS.batch_size,
+      num_preprocessing_threads=FLAGS.num_preprocessing_threads,
+      model_name=FLAGS.model_name)
+
+
+def _build_teacher_logits():
+  """Computes the teacher logits of the training split if they are missing."""
+  if not FLAGS.teacher_checkpoint_path:
+    raise ValueError('--distillation_dir requires the checkpoint of the '
+                     'teacher with --teacher_checkpoint_path')
+
+  dataset = dataset_factory_fgvc.get_dataset(
+      FLAGS.dataset_name, FLAGS.dataset_split_name, FLAGS.dataset_dir)
+  teacher_model_name = FLAGS.teacher_model_name or FLAGS.model_name
+  network_fn = nets_factory.get_network_fn(
+      teacher_model_name,
+      num_classes=(dataset.num_classes - FLAGS.labels_offset),
+      is_training=False)
+  # The teacher preprocessing follows its own architecture, unless it is the
+  # student's.
+  preprocessing_name = (FLAGS.preprocessing_name
+                        if teacher_model_name == FLAGS.model_name else None)
+  teacher_logits.build_store(
+      FLAGS.distillation_dir,
+      dataset,
+      network_fn,
+      FLAGS.teacher_image_size or network_fn.default_image_size,
+      preprocessing_factory.get_preprocessing(
+          preprocessing_name or teacher_model_name, is_training=False),
+      FLAGS.teacher_checkpoint_path,
+      top_k=FLAGS.teacher_top_k,
+      batch_size=FLAGS.batch_size,
+      num_preprocessing_threads=FLAGS.num_preprocessing_threads,
+      model_name=teacher_model_name)
+
+
+def _get_channel_config():
+  """Returns the channel config of a pruned network, or None."""
+  if not FLAGS.channel_config:
+    return None
+  return inception_utils.read_channel_config(FLAGS.channel_config)
+
+
+def _get_label_groups(dataset):
+  """Returns the label groups of the hierarchical head, or None without it."""
+  if not FLAGS.hierarchical_head:
+    return None
+  label_groups, group_names = hierarchical_head.get_label_groups(
+      dataset.labels_to_taxa, dataset.num_classes - FLAGS.labels_offset,
+      FLAGS.labels_offset)
+  tf.logging.info('Hierarchical head over %d taxa: %s', len(group_names),
+                  ', '.join(group_names))
+  return label_groups
+
+
+def _build_inline_eval_hook(summary_writer):
+  """Builds an evaluation tower sharing the model variables, and its hook."""
+  dataset = dataset_factory_fgvc.get_dataset(
+      FLAGS.dataset_name, FLAGS.eval_split_name, FLAGS.dataset_dir)
+  network_fn = nets_factory.get_network_fn(
+      FLAGS.model_name,
+      num_classes=(dataset.num_classes - FLAGS.labels_offset),
+      is_training=False,
+      label_groups=_get_label_groups(dataset),
+      channel_config=_get_channel_config())
+  image_preprocessing_fn = preprocessing_factory.get_preprocessing(
+      FLAGS.preprocessing_name or FLAGS.model_name,
+      is_training=False)
+  eval_image_size = (FLAGS.eval_image_size or FLAGS.train_image_size or
+                     network_fn.default_image_size)
+
+  with tf.device('/cpu:0'):
+    batches = fgvc.get_cached_dataset(
+        dataset, image_preprocessing_fn, eval_image_size,
+        FLAGS.eval_batch_size,
+        num_samples=FLAGS.eval_num_samples,
+        num_preprocessing_threads=FLAGS.num_preprocessing_threads,
+        labels_offset=FLAGS.labels_offset,
+        cache_filename=FLAGS.eval_cache_filename)
+    iterator = batches.make_initializable_iterator()
+    images, labels = iterator.get_next()
+  with tf.name_scope('inline_eval'):
+    with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+      logits, _ = network_fn(images)
+
+  return training_hooks.InlineEvalHook(
+      FLAGS.eval_every_n_steps,
+      iterator.initializer,
+      logits,
+      labels,
+      best_dir=os.path.join(FLAGS.train_dir, 'best'),
+      log_filename=os.path.join(FLAGS.train_dir, 'eval_log.jsonl'),
+      metric=FLAGS.eval_metric,
+      patience=FLAGS.early_stopping_patience,
+      min_delta=FLAGS.early_stopping_min_delta,
+      summary_writer=summary_writer)
+
+
+def _shard_data_sources(data_sources, local_rank):
+  """Returns the shards of `data_sources` read by one local worker."""
+  if not isinstance(data_sources, (list, tuple)):
+    data_sources = [data_sources]
+  shards = sorted(shard for pattern in data_sources
+                  for shard in tf.gfile.Glob(pattern))
+  if len(shards) < FLAGS.local_workers:
+    raise ValueError('%d shards cannot be split between %d local workers' %
+                     (len(shards), FLAGS.local_workers))
+  return shards[local_rank::FLAGS.local_workers]
+
+
+def _local_worker_cpus(local_rank):
+  """Returns the contiguous share of the CPUs of a local worker."""
+  cpus = sorted(os.sched_getaffinity(0))
+  start = local_rank * len(cpus) // FLAGS.local_workers
+  end = (local_rank + 1) * len(cpus) // FLAGS.local_workers
+  return cpus[start:end]
+
+
+def _run_local_worker(argv, local_rank, barrier, buffer_filename):
+  """Entry point of a local worker process."""
+  FLAGS(argv)
+  tf.logging.set_verbosity(tf.logging.INFO)
+  if hasattr(os, 'sched_setaffinity'):
+    cpus = _local_worker_cpus(local_rank)
+    os.sched_setaffinity(0, cpus)
+    tf.logging.info('Local worker %d runs on the CPUs %s', local_rank, cpus)
+  _train(local_rank, local_allreduce.LocalAllReduce(
+      FLAGS.local_workers, local_rank, barrier, buffer_filename))
+
+
+def _launch_local_workers(argv):
+  """Runs the training in --local_workers processes and waits for them.
+
+  Args:
+    argv: The command line the workers parse their flags from.
+  """
+  # The workers are spawned rather than forked, the TensorFlow runtime of this
+  # process may already be running threads.
+  context = multiprocessing.get_context('spawn')
+  barrier = context.Barrier(FLAGS.local_workers)
+  buffer_filename = local_allreduce.buffer_filename(
+      'train_allreduce_%d' % os.getpid())
+  workers = [
+      context.Process(target=_run_local_worker,
+                      args=(argv, local_rank, barrier, buffer_filename),
+                      name='local_worker_%d' % local_rank)
+      for local_rank in range(FLAGS.local_workers)]
+  for worker in workers:
+    worker.start()
+  try:
+    failed = []
+    while not failed and any(worker.is_alive() for worker in workers):
+      time.sleep(1)
+      failed = [worker for worker in workers if worker.exitcode]
+    if failed:
+      # Releases the workers blocked in a collective op.
+      barrier.abort()
+    for worker in workers:
+      worker.join()
+  finally:
+    for worker in workers:
+      if worker.is_alive():
+        worker.terminate()
+    if os.path.exists(buffer_filename):
+      os.remove(buffer_filename)
+  if failed:
+    raise RuntimeError('%s exited with code %d' %
+                       (failed[0].name, failed[0].exitcode))
+
+
+def _parse_resolution_schedule(schedule):
+  """Parses --resolution_schedule into the flag values of every stage.
+
+  Args:
+    schedule: The value of --resolution_schedule.
+
+  Returns:
+    A list of dicts of the `train_image_size`, `max_number_of_steps`,
+    `batch_size`, `learning_rate`, `stage_start_step` and `stage_start_images`
+    flag values of every stage. A stage starts at the last step of the
+    previous one, after the images of the previous stages run to their end.
+
+  Raises:
+    ValueError: If a stage is malformed or the last steps do not increase.
+  """
+  stages = []
+  for stage in schedule.split(','):
+    fields = stage.strip().split(':')
+    if not 2 <= len(fields) <= 4:
+      raise ValueError('Resolution stage [%s] was not recognized' % stage)
+    batch_size = int(fields[2]) if len(fields) > 2 else FLAGS.batch_size
+    if len(fields) > 3:
+      learning_rate = float(fields[3])
+    else:
+      learning_rate = FLAGS.learning_rate * batch_size / FLAGS.batch_size
+    stages.append({
+        'train_image_size': int(fields[0]),
+        'max_number_of_steps': int(fields[1]),
+        'batch_size': batch_size,
+        'learning_rate': learning_rate,
+    })
+  for previous_stage, stage in zip(stages, stages[1:]):
+    if stage['max_number_of_steps'] <= previous_stage['max_number_of_steps']:
+      raise ValueError('The last steps of --resolution_schedule must increase')
+  start_step, start_images = 0, 0
+  for stage in stages:
+    stage['stage_start_step'] = start_step
+    stage['stage_start_images'] = start_images
+    start_images += ((stage['max_number_of_steps'] - start_step) *
+                     stage['batch_size'] * FLAGS.accumulation_steps *
+                     FLAGS.local_workers)
+    start_step = stage['max_number_of_steps']
+  return stages
+
+
+def _checkpoint_global_step(checkpoint_dir):
+  """Returns the global step of the latest checkpoint of a directory, or 0."""
+  checkpoint_path = tf.train.latest_checkpoint(checkpoint_dir)
+  if not checkpoint_path:
+    return 0
+  return int(tf.train.load_variable(checkpoint_path, 'global_step'))
+
+
+def _run_training(flag_values=None):
+  """Runs the training, with `flag_values` overriding some flags."""
+  flag_values = flag_values or {}
+  for name, value in flag_values.items():
+    setattr(FLAGS, name, value)
+  if FLAGS.local_workers > 1:
+    _launch_local_workers(sys.argv + ['--%s=%s' % (name, value) for
+                                      name, value in flag_values.items()])
+  else:
+    _train()
+
+
+def _train_resolution_schedule():
+  """Runs the stages of --resolution_schedule that are not finished yet.
+
+  Every stage builds its own graph and restores the checkpoint of the previous
+  one from the train_dir, the variables of the networks being independent of
+  the image size. An early stop of the inline evaluation ends the current
+  stage only.
+  """
+  stages = _parse_resolution_schedule(FLAGS.resolution_schedule)
+  # The inline evaluation stays at the final size, to compare the stages.
+  eval_image_size = FLAGS.eval_image_size or stages[-1]['train_image_size']
+  for i, stage in enumerate(stages):
+    global_step = _checkpoint_global_step(FLAGS.train_dir)
+    if global_step >= stage['max_number_of_steps']:
+      tf.logging.info('Skipping the stage %d/%d, finished at step %d', i + 1,
+                      len(stages), global_step)
+      continue
+    tf.logging.info(
+        'Stage %d/%d: training at %dpx with batches of %d and a learning rate '
+        'of %g from step %d to step %d', i + 1, len(stages),
+        stage['train_image_size'], stage['batch_size'],
+        stage['learning_rate'], global_step, stage['max_number_of_steps'])
+    stage['eval_image_size'] = eval_image_size
+    _run_training(stage)
+
+
 def main(_):
   if not FLAGS.dataset_dir:
     raise ValueError('You must supply the dataset directory with --dataset_dir')
 
   tf.logging.set_verbosity(tf.logging.INFO)
+  if FLAGS.accumulation_steps > 1 and FLAGS.worker_replicas > 1:
+    raise ValueError('--accumulation_steps does not support --worker_replicas')
+  if FLAGS.local_workers > 1 and (FLAGS.worker_replicas > 1 or
+                                  FLAGS.num_ps_tasks > 0):
+    raise ValueError('--local_workers does not support --worker_replicas and '
+                     '--num_ps_tasks')
+  if FLAGS.eval_every_n_steps > 0 and FLAGS.local_workers > 1:
+    raise ValueError('--eval_every_n_steps does not support --local_workers')
+  if FLAGS.resolution_schedule and (FLAGS.max_number_of_steps or
+                                    FLAGS.bottleneck_dir):
+    raise ValueError('--resolution_schedule does not support '
+                     '--max_number_of_steps and --bottleneck_dir')
+  if FLAGS.bottleneck_dir:
+    if FLAGS.worker_replicas > 1:
+      raise ValueError('--bottleneck_dir does not support --worker_replicas')
+    _build_bottleneck_cache()
+  if FLAGS.distillation_dir:
+    if FLAGS.input_backend != 'tf_data' or FLAGS.bottleneck_dir:
+      raise ValueError('--distillation_dir requires --input_backend=tf_data '
+                       'and does not support --bottleneck_dir')
+    if FLAGS.worker_replicas > 1:
+      raise ValueError('--distillation_dir does not support --worker_replicas')
+    _build_teacher_logits()
+
+  if FLAGS.resolution_schedule:
+    _train_resolution_schedule()
+  else:
+    _run_training()
+
+
+def _train(local_rank=0, allreduce=None):
+  """Builds the training graph and runs the training loop.
+
+  Args:
+    local_rank: The index of the local worker running the training.
+    allreduce: The `local_allreduce.LocalAllReduce` of the local workers, or
+      None for a single process.
+  """
   with tf.Graph().as_default():
     #######################
     # Config model_deploy #
@@ -422,6 +1110,9 @@ def main(_):
     ######################
     dataset = dataset_factory_fgvc.get_dataset(
         FLAGS.dataset_name, FLAGS.dataset_split_name, FLAGS.dataset_dir)
+    if allreduce is not None:
+      dataset.data_sources = _shard_data_sources(dataset.data_sources,
+                                                 local_rank)
 
     ######################
     # Select the network #
@@ -430,70 +1121,143 @@ def main(_):
         FLAGS.model_name,
         num_classes=(dataset.num_classes - FLAGS.labels_offset),
         weight_decay=FLAGS.weight_decay,
-        is_training=True)
+        is_training=True,
+        label_groups=_get_label_groups(dataset),
+        channel_config=_get_channel_config())
 
     #####################################
     # Select the preprocessing function #
     #####################################
     preprocessing_name = FLAGS.preprocessing_name or FLAGS.model_name
-    image_preprocessing_fn = preprocessing_factory.get_preprocessing(
-        preprocessing_name,
-        is_training=True)
+    if FLAGS.fused_decode_and_crop:
+      if FLAGS.input_backend != 'tf_data':
+        raise ValueError('--fused_decode_and_crop requires '
+                         '--input_backend=tf_data')
+      image_preprocessing_fn = preprocessing_factory.get_encoded_preprocessing(
+          preprocessing_name,
+          is_training=True)
+    else:
+      image_preprocessing_fn = preprocessing_factory.get_preprocessing(
+          preprocessing_name,
+          is_training=True)
 
     ##############################################################
     # Create a dataset provider that loads data from the dataset #
     ##############################################################
     with tf.device(deploy_config.inputs_device()):
-      provider = slim.dataset_data_provider.DatasetDataProvider(
-          dataset,
-          num_readers=FLAGS.num_readers,
-          common_queue_capacity=20 * FLAGS.batch_size,
-          common_queue_min=10 * FLAGS.batch_size)
-      [image, label] = provider.get(['image', 'label'])
-      label -= FLAGS.labels_offset
-
       train_image_size = FLAGS.train_image_size or network_fn.default_image_size
-
-      image = image_preprocessing_fn(image, train_image_size, train_image_size)
-
-      images, labels = tf.train.batch(
-          [image, label],
-          batch_size=FLAGS.batch_size,
-          num_threads=FLAGS.num_preprocessing_threads,
-          capacity=5 * FLAGS.batch_size)
-      labels = slim.one_hot_encoding(
-          labels, dataset.num_classes - FLAGS.labels_offset)
-      batch_queue = slim.prefetch_queue.prefetch_queue(
-          [images, labels], capacity=2 * deploy_config.num_clones)
+      num_classes = dataset.num_classes - FLAGS.labels_offset
+
+      if FLAGS.bottleneck_dir:
+        batches = bottleneck_cache.get_batched_dataset(
+            FLAGS.bottleneck_dir, FLAGS.batch_size,
+            labels_offset=FLAGS.labels_offset)
+        iterator = batches.make_one_shot_iterator()
+
+        def next_batch():
+          features, labels = iterator.get_next()
+          return features, slim.one_hot_encoding(labels, num_classes)
+      elif FLAGS.input_backend == 'queue':
+        provider = slim.dataset_data_provider.DatasetDataProvider(
+            dataset,
+            num_readers=FLAGS.num_readers,
+            common_queue_capacity=20 * FLAGS.batch_size,
+            common_queue_min=10 * FLAGS.batch_size)
+        [image, label] = provider.get(['image', 'label'])
+        label -= FLAGS.labels_offset
+
+        image = image_preprocessing_fn(image, train_image_size,
+                                       train_image_size)
+
+        images, labels = tf.train.batch(
+            [image, label],
+            batch_size=FLAGS.batch_size,
+            num_threads=FLAGS.num_preprocessing_threads,
+            capacity=5 * FLAGS.batch_size)
+        labels = slim.one_hot_encoding(labels, num_classes)
+        batch_queue = slim.prefetch_queue.prefetch_queue(
+            [images, labels], capacity=2 * deploy_config.num_clones)
+        next_batch = batch_queue.dequeue
+      elif FLAGS.input_backend == 'tf_data':
+        batches = fgvc.get_batched_dataset(
+            dataset, image_preprocessing_fn, train_image_size,
+            FLAGS.batch_size,
+            is_training=True,
+            num_readers=FLAGS.num_readers,
+            num_preprocessing_threads=FLAGS.num_preprocessing_threads,
+            labels_offset=FLAGS.labels_offset,
+            preprocess_encoded=FLAGS.fused_decode_and_crop,
+            with_manifest_rows=bool(FLAGS.distillation_dir))
+        iterator = batches.make_one_shot_iterator()
+
+        if FLAGS.distillation_dir:
+          soft_targets_fn = teacher_logits.get_soft_targets_fn(
+              FLAGS.distillation_dir, FLAGS.distillation_temperature)
+
+          def next_batch():
+            images, labels, rows = iterator.get_next()
+            return (images, slim.one_hot_encoding(labels, num_classes),
+                    soft_targets_fn(rows))
+        else:
+
+          def next_batch():
+            images, labels = iterator.get_next()
+            return images, slim.one_hot_encoding(labels, num_classes)
+      else:
+        raise ValueError('Input backend [%s] was not recognized' %
+                         FLAGS.input_backend)
 
     ####################
     # Define the model #
     ####################
-    def clone_fn(batch_queue):
+    def clone_fn(next_batch):
       """Allows data parallelism by creating multiple clones of network_fn."""
-      images, labels = batch_queue.dequeue()
-      logits, end_points = network_fn(images)
+      if FLAGS.distillation_dir:
+        images, labels, soft_targets = next_batch()
+      else:
+        images, labels = next_batch()
+      if FLAGS.bottleneck_dir:
+        # The batches hold the cached features instead of images.
+        logits, end_points = bottleneck_cache.network_on_features(
+            network_fn, images, FLAGS.bottleneck_endpoint, train_image_size)
+      else:
+        logits, end_points = network_fn(images)
 
       #############################
       # Specify the loss function #
       #############################
+      labels_weight = 1.0
+      if FLAGS.distillation_dir:
+        # The cross-entropy with the soft targets has the gradients of their
+        # KL divergence, the teacher entropy being a constant.
+        temperature = FLAGS.distillation_temperature
+        labels_weight -= FLAGS.distillation_weight
+        tf.losses.softmax_cross_entropy(
+            soft_targets, logits / temperature,
+            weights=FLAGS.distillation_weight * temperature ** 2,
+            scope='distillation_loss')
       if 'AuxLogits' in end_points:
         tf.losses.softmax_cross_entropy(
             labels, end_points['AuxLogits'],
-            label_smoothing=FLAGS.label_smoothing, weights=0.4,
+            label_smoothing=FLAGS.label_smoothing, weights=0.4 * labels_weight,
             scope='aux_loss')
       tf.losses.softmax_cross_entropy(
-          labels, logits, label_smoothing=FLAGS.label_smoothing, weights=1.0)
+          labels, logits, label_smoothing=FLAGS.label_smoothing,
+          weights=labels_weight)
       return end_points
 
     # Gather initial summaries.
     summaries = set(tf.get_collection(tf.GraphKeys.SUMMARIES))
 
-    clones = model_deploy.create_clones(deploy_config, clone_fn, [batch_queue])
+    clones = model_deploy.create_clones(deploy_config, clone_fn, [next_batch])
     first_clone_scope = deploy_config.clone_scope(0)
     # Gather update_ops from the first clone. These contain, for example,
     # the updates for the batch_norm variables created by network_fn.
     update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS, first_clone_scope)
+    if FLAGS.bottleneck_dir:
+      # Only the layers after the cached end point are run.
+      update_ops = [op for op in update_ops
+                    if not bottleneck_cache.depends_on_images(op)]
 
     # # Add summaries for end_points.
     # end_points = clones[0].outputs
@@ -533,7 +1297,7 @@ def main(_):
       optimizer = _configure_optimizer(learning_rate)
       summaries.add(tf.summary.scalar('learning_rate', learning_rate))
 
-    if FLAGS.sync_replicas:
+    if _use_sync_replicas():
       # If sync_replicas is enabled, the averaging will be done in the chief
       # queue runner.
       optimizer = tf.train.SyncReplicasOptimizer(
@@ -542,29 +1306,57 @@ def main(_):
           total_num_replicas=FLAGS.worker_replicas,
           variable_averages=variable_averages,
           variables_to_average=moving_average_variables)
-    elif FLAGS.moving_average_decay:
+    elif FLAGS.moving_average_decay and FLAGS.accumulation_steps == 1:
       # Update ops executed locally by trainer.
       update_ops.append(variable_averages.apply(moving_average_variables))
 
     # Variables to train.
     variables_to_train = _get_variables_to_train()
+    regularization_losses = None
+    if FLAGS.bottleneck_dir:
+      # The layers before the cached end point keep the weights the features
+      # were computed with: they are neither trained nor regularized.
+      before_endpoint = bottleneck_cache.get_variables_before_endpoint(
+          tf.get_collection(tf.GraphKeys.LOSSES), tf.trainable_variables())
+      selected = [var for var in variables_to_train if var in before_endpoint]
+      if FLAGS.trainable_scopes and selected:
+        raise ValueError(
+            '--trainable_scopes selects %s, which comes before the cached end '
+            'point %s' % (selected[0].op.name, FLAGS.bottleneck_endpoint))
+      variables_to_train = [var for var in variables_to_train
+                            if var not in before_endpoint]
+      regularization_losses = bottleneck_cache.get_regularization_losses(
+          before_endpoint)
 
     #  and returns a train_tensor and summary_op
     total_loss, clones_gradients = model_deploy.optimize_clones(
         clones,
         optimizer,
+        regularization_losses=regularization_losses,
         var_list=variables_to_train)
     # Add total_loss to summary.
     summaries.add(tf.summary.scalar('total_loss', total_loss))
 
     # Add epoch number to summary.
     summaries.add(tf.summary.scalar(
-        'epoch', global_step*FLAGS.batch_size/dataset.num_samples))
+        'epoch', _get_images_seen(global_step) / dataset.num_samples))
 
     # Create gradient updates.
-    grad_updates = optimizer.apply_gradients(clones_gradients,
-                                             global_step=global_step)
-    update_ops.append(grad_updates)
+    accumulate_tensor = None
+    if FLAGS.accumulation_steps > 1:
+      # The moving averages are only updated with the parameters.
+      accumulate_op, grad_updates = _accumulate_gradients(
+          optimizer, clones_gradients, global_step, update_ops,
+          variable_averages, moving_average_variables, allreduce=allreduce)
+      update_ops = [grad_updates]
+      with tf.control_dependencies([accumulate_op]):
+        accumulate_tensor = tf.identity(total_loss, name='accumulate_op')
+    else:
+      if allreduce is not None:
+        clones_gradients = allreduce.all_reduce(clones_gradients)
+      grad_updates = optimizer.apply_gradients(clones_gradients,
+                                               global_step=global_step)
+      update_ops.append(grad_updates)
 
     update_op = tf.group(*update_ops)
     with tf.control_dependencies([update_op]):
@@ -582,23 +1374,85 @@ def main(_):
     session_config = tf.ConfigProto()
     session_config.gpu_options.allow_growth = True
 
+    task = local_rank if allreduce is not None else FLAGS.task
+    summary_writer = (tf.summary.FileWriterCache.get(FLAGS.train_dir)
+                      if task == 0 else None)
+    hooks = []
+    if allreduce is not None:
+      hooks.append(local_allreduce.BroadcastVariablesHook(
+          allreduce.broadcast(tf.global_variables())))
+    if FLAGS.input_stats_every_n_steps > 0:
+      hooks.append(training_hooks.InputStallHook(
+          FLAGS.input_stats_every_n_steps,
+          os.path.join(FLAGS.train_dir, 'input_stats_%d.json' % task),
+          summary_writer=summary_writer,
+          wait_threshold=FLAGS.input_wait_threshold,
+          stall_window=FLAGS.input_stall_window))
+    if FLAGS.run_stats_every_n_steps > 0:
+      hooks.append(training_hooks.RunStatsHook(
+          FLAGS.run_stats_every_n_steps,
+          (FLAGS.batch_size * deploy_config.num_clones *
+           FLAGS.accumulation_steps * FLAGS.local_workers),
+          os.path.join(FLAGS.train_dir, 'run_stats_%d.json' % task),
+          summary_writer=summary_writer,
+          config={'model_name': FLAGS.model_name,
+                  'batch_size': FLAGS.batch_size,
+                  'num_clones': FLAGS.num_clones,
+                  'accumulation_steps': FLAGS.accumulation_steps,
+                  'local_workers': FLAGS.local_workers,
+                  'train_image_size': FLAGS.train_image_size}))
+    if FLAGS.profile_every_n_steps > 0 or FLAGS.profile_num_steps > 0:
+      profile_dir = FLAGS.profile_dir or os.path.join(FLAGS.train_dir,
+                                                      'profile')
+      if allreduce is not None:
+        profile_dir = os.path.join(profile_dir, 'worker_%d' % local_rank)
+      hooks.append(training_hooks.ProfilerHook(
+          profile_dir,
+          every_n_steps=FLAGS.profile_every_n_steps,
+          start_step=FLAGS.profile_start_step,
+          num_steps=FLAGS.profile_num_steps,
+          scope_patterns=(FLAGS.profile_scopes.split(',')
+                          if FLAGS.profile_scopes else None),
+          summary_op=summary_op))
+    if FLAGS.eval_every_n_steps > 0 and task == 0:
+      hooks.append(_build_inline_eval_hook(summary_writer))
+    for hook in hooks:
+      hook.begin()
+
+    if allreduce is not None and local_rank > 0:
+      # The local workers other than the first one write neither checkpoints
+      # nor summaries. Their variables are set by the broadcast, and
+      # slim.learning.train requires the default summary op without logdir.
+      logdir_kwargs = {'logdir': None}
+    else:
+      logdir_kwargs = {'logdir': FLAGS.train_dir, 'summary_op': summary_op}
+      if FLAGS.incremental_checkpoints:
+        logdir_kwargs['saver'] = _build_incremental_saver(
+            [train_tensor] +
+            ([accumulate_tensor] if accumulate_tensor is not None else []),
+            is_chief=(task == 0))
+
     ###########################
     # Kicks off the training. #
     ###########################
     slim.learning.train(
         train_tensor,
-        logdir=FLAGS.train_dir,
         master=FLAGS.master,
         is_chief=(FLAGS.task == 0),
         init_fn=_get_init_fn(),
-        summary_op=summary_op,
         number_of_steps=FLAGS.max_number_of_steps,
         log_every_n_steps=FLAGS.log_every_n_steps,
         save_summaries_secs=FLAGS.save_summaries_secs,
         save_interval_secs=FLAGS.save_interval_secs,
-        sync_optimizer=optimizer if FLAGS.sync_replicas else None,
-        session_config=session_config)
-
+        sync_optimizer=optimizer if _use_sync_replicas() else None,
+        session_config=session_config,
+        train_step_fn=(
+            training_hooks.get_train_step_fn(
+                hooks, accumulate_op=accumulate_tensor,
+                accumulation_steps=FLAGS.accumulation_steps)
+            if hooks or accumulate_tensor is not None
+            else slim.learning.train_step),
+        **logdir_kwargs)
 
 if __name__ == '__main__':
   tf.app.run()
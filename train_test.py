@@ -0,0 +1,131 @@
+"""Tests for train.py, run from the root of the repository."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import numpy as np
+import tensorflow as tf
+
+from absl.testing import flagsaver
+
+import train
+from datasets import dataset_utils
+from datasets import teacher_logits
+from nets import nets_factory
+
+FLAGS = tf.app.flags.FLAGS
+
+_NUM_CLASSES = 3
+
+_NUM_SAMPLES = 4
+
+
+def _write_dataset(dataset_dir):
+  """Writes a training split of small JPEG images with manifest rows."""
+  tf.gfile.MakeDirs(dataset_dir)
+  with tf.Graph().as_default(), tf.Session() as sess:
+    image = tf.placeholder(tf.uint8, [32, 32, 3])
+    encoded_image = tf.image.encode_jpeg(image)
+    shard = 'train-00000-of-00001'
+    shard_filename = os.path.join(dataset_dir, shard)
+    with tf.python_io.TFRecordWriter(shard_filename) as writer:
+      for row in range(_NUM_SAMPLES):
+        image_data = sess.run(encoded_image, {
+            image: np.random.randint(0, 255, [32, 32, 3]).astype(np.uint8)})
+        writer.write(dataset_utils.image_to_tfexample(
+            image_data, b'jpg', 32, 32, row % _NUM_CLASSES,
+            manifest_row=row).SerializeToString())
+  dataset_utils.write_dataset_metadata(dataset_dir, {
+      'num_samples': {'train': _NUM_SAMPLES, 'validation': 0},
+      'num_classes': _NUM_CLASSES,
+      'shards': {'train': [shard], 'validation': []},
+  })
+
+
+def _write_teacher_checkpoint(checkpoint_path):
+  """Writes a randomly initialized lenet checkpoint."""
+  with tf.Graph().as_default():
+    network_fn = nets_factory.get_network_fn('lenet', _NUM_CLASSES,
+                                             is_training=False)
+    network_fn(tf.zeros([1, 28, 28, 3]))
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      tf.train.Saver().save(sess, checkpoint_path)
+
+
+class TrainTest(tf.test.TestCase):
+
+  def testDistillationStep(self):
+    root_dir = self.get_temp_dir()
+    _write_dataset(os.path.join(root_dir, 'data', 'tiny'))
+    teacher_checkpoint_path = os.path.join(root_dir, 'teacher', 'model.ckpt')
+    _write_teacher_checkpoint(teacher_checkpoint_path)
+    distillation_dir = os.path.join(root_dir, 'distillation')
+    train_dir = os.path.join(root_dir, 'train')
+
+    with flagsaver.flagsaver(
+        dataset_dir=os.path.join(root_dir, 'data'),
+        dataset_name='tiny',
+        model_name='lenet',
+        input_backend='tf_data',
+        batch_size=2,
+        num_readers=1,
+        num_preprocessing_threads=1,
+        clone_on_cpu=True,
+        max_number_of_steps=1,
+        train_dir=train_dir,
+        distillation_dir=distillation_dir,
+        teacher_checkpoint_path=teacher_checkpoint_path,
+        teacher_top_k=2):
+      train.main(None)
+
+    metadata = teacher_logits.read_store_metadata(distillation_dir)
+    self.assertEqual(metadata['model_name'], 'lenet')
+    self.assertEqual(metadata['num_classes'], _NUM_CLASSES)
+    self.assertEqual(metadata['top_k'], 2)
+    self.assertEqual(metadata['num_samples'], _NUM_SAMPLES)
+    checkpoint_path = tf.train.latest_checkpoint(train_dir)
+    self.assertEqual(tf.train.load_variable(checkpoint_path, 'global_step'), 1)
+    with open(os.path.join(distillation_dir,
+                           teacher_logits.TEACHER_METADATA_FILENAME)) as f:
+      self.assertEqual(json.loads(f.read())['checkpoint_path'],
+                       teacher_checkpoint_path)
+
+  def testLearningRateIsContinuousAcrossStages(self):
+    # The batch size is divided by 4 at step 100, which divides the decay
+    # steps by 4 as well.
+    for decay_type, num_epochs_per_decay in [('exponential', 2.),
+                                             ('polynomial', 10.)]:
+      with flagsaver.flagsaver(batch_size=32,
+                               learning_rate_decay_type=decay_type,
+                               learning_rate_decay_factor=0.5,
+                               num_epochs_per_decay=num_epochs_per_decay):
+        stages = train._parse_resolution_schedule(
+            '224:100:32:0.01,299:300:8:0.01')
+        self.assertEqual(stages[1]['stage_start_step'], 100)
+        self.assertEqual(stages[1]['stage_start_images'], 3200)
+        learning_rates = []
+        for stage in stages:
+          with flagsaver.flagsaver(**stage), tf.Graph().as_default():
+            learning_rate = train._configure_learning_rate(
+                1000, tf.constant(100, tf.int64))
+            with tf.Session() as sess:
+              learning_rates.append(sess.run(learning_rate))
+      self.assertLess(learning_rates[0], 0.01)
+      self.assertAllClose(learning_rates[0], learning_rates[1], rtol=1e-2)
+
+  def testDistillationRequiresTheTeacherCheckpoint(self):
+    with flagsaver.flagsaver(
+        dataset_dir=self.get_temp_dir(),
+        input_backend='tf_data',
+        distillation_dir=os.path.join(self.get_temp_dir(), 'distillation'),
+        teacher_checkpoint_path=None):
+      with self.assertRaises(ValueError):
+        train.main(None)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,652 @@
+"""Session run hooks for the instrumentation of train.py and eval.py.
+
+`slim.learning.train` runs its own training loop and does not take hooks, so
+`get_train_step_fn` wraps `slim.learning.train_step` into a train step that
+runs `tf.train.SessionRunHook`s around every training step. `eval.py` passes
+the same hooks to `slim.evaluation.evaluation_loop` directly.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import fnmatch
+import json
+import os
+import resource
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+
+from tensorflow.python.client import timeline
+
+# The ops an input pipeline blocks in when it cannot keep up with the model.
+_INPUT_OP_TYPES = ('QueueDequeueV2', 'QueueDequeueManyV2',
+                   'QueueDequeueUpToV2', 'IteratorGetNext')
+
+
+def _merge_run_options(options_list):
+  """Returns the RunOptions with the highest trace level among options_list."""
+  options_list = [options for options in options_list if options is not None]
+  if not options_list:
+    return None
+  merged_options = tf.RunOptions()
+  for options in options_list:
+    merged_options.MergeFrom(options)
+  merged_options.trace_level = max(
+      options.trace_level for options in options_list)
+  return merged_options
+
+
+def get_train_step_fn(hooks, accumulate_op=None, accumulation_steps=1):
+  """Returns a `train_step_fn` for `slim.learning.train` that runs hooks.
+
+  The `begin` method of the hooks must be called before the graph is
+  finalized, i.e. before `slim.learning.train`. `after_create_session` is
+  called before the first step and `end` once the training stops.
+
+  With gradient accumulation, every step first runs `accumulate_op`
+  `accumulation_steps - 1` times, then the train op, which accumulates the
+  last batch and applies the gradients. The hooks see the whole sequence as
+  one step.
+
+  Args:
+    hooks: A list of `tf.train.SessionRunHook`.
+    accumulate_op: An optional op accumulating the gradients of one batch.
+    accumulation_steps: The number of batches of every step.
+
+  Returns:
+    A function with the signature of `slim.learning.train_step`.
+  """
+  state = {'session': None}
+
+  def train_step_fn(sess, train_op, global_step, train_step_kwargs):
+    """Runs one training step and the hooks around it."""
+    if state['session'] is not sess:
+      state['session'] = sess
+      for hook in hooks:
+        hook.after_create_session(sess, None)
+
+    start_time = time.time()
+    original_args = tf.train.SessionRunArgs([train_op, global_step])
+    run_context = tf.train.SessionRunContext(original_args, sess)
+    hook_args = [hook.before_run(run_context) or tf.train.SessionRunArgs(None)
+                 for hook in hooks]
+    feed_dict = {}
+    for args in hook_args:
+      feed_dict.update(args.feed_dict or {})
+    options = _merge_run_options([args.options for args in hook_args])
+    run_metadata = tf.RunMetadata() if options is not None else None
+
+    if accumulate_op is not None:
+      for _ in range(accumulation_steps - 1):
+        sess.run(accumulate_op)
+    hook_fetches = [[] if args.fetches is None else args.fetches
+                    for args in hook_args]
+    total_loss, np_global_step, hook_results = sess.run(
+        [train_op, global_step, hook_fetches],
+        feed_dict=feed_dict or None,
+        options=options,
+        run_metadata=run_metadata)
+    time_elapsed = time.time() - start_time
+
+    for hook, results in zip(hooks, hook_results):
+      hook.after_run(run_context, tf.train.SessionRunValues(
+          results=results, options=options, run_metadata=run_metadata))
+
+    if 'should_log' in train_step_kwargs:
+      if sess.run(train_step_kwargs['should_log']):
+        tf.logging.info('global step %d: loss = %.4f (%.3f sec/step)',
+                        np_global_step, total_loss, time_elapsed)
+
+    if 'should_stop' in train_step_kwargs:
+      should_stop = sess.run(train_step_kwargs['should_stop'])
+    else:
+      should_stop = False
+    should_stop = should_stop or run_context.stop_requested
+    if should_stop:
+      for hook in hooks:
+        hook.end(sess)
+    return total_loss, should_stop
+
+  return train_step_fn
+
+
+def _write_scalar_summaries(summary_writer, values, step):
+  """Writes a dict of scalars as TensorBoard summaries."""
+  if summary_writer is None:
+    return
+  summary_writer.add_summary(tf.Summary(value=[
+      tf.Summary.Value(tag=tag, simple_value=float(value))
+      for tag, value in sorted(values.items())]), step)
+
+
+class InputStallHook(tf.train.SessionRunHook):
+  """Tells apart input-bound and compute-bound steps.
+
+  Every step, the fill level of the queues of the input pipeline is sampled.
+  Every `every_n_steps` steps, the step is traced and its wall time is split
+  into the time spent blocked in the input ops (queue dequeues or
+  `IteratorGetNext` of tf.data) and the rest, the compute. A sampled step whose
+  input wait is at least `wait_threshold` of the step time is starved, and
+  `stall_window` consecutive starved samples are reported as a stall.
+
+  The measures are written as TensorBoard summaries under `input/` and, once
+  the training stops, as a JSON report.
+  """
+
+  def __init__(self, every_n_steps, report_filename, summary_writer=None,
+               wait_threshold=0.25, stall_window=5):
+    """Creates an InputStallHook.
+
+    Args:
+      every_n_steps: The number of steps between two traced steps.
+      report_filename: The path of the JSON report written at the end.
+      summary_writer: An optional `tf.summary.FileWriter` for the summaries.
+      wait_threshold: The fraction of the step time spent waiting for inputs
+        from which a step is starved.
+      stall_window: The number of consecutive starved samples reported as a
+        stall.
+    """
+    self._every_n_steps = every_n_steps
+    self._report_filename = report_filename
+    self._summary_writer = summary_writer
+    self._wait_threshold = wait_threshold
+    self._stall_window = stall_window
+
+  def begin(self):
+    self._global_step = tf.train.get_global_step()
+    self._queue_sizes = {}
+    self._queue_capacities = {}
+    for queue_runner in tf.get_collection(tf.GraphKeys.QUEUE_RUNNERS):
+      queue = queue_runner.queue
+      name = queue.queue_ref.op.name
+      self._queue_sizes[name] = queue.size()
+      self._queue_capacities[name] = queue.queue_ref.op.get_attr('capacity')
+    self._input_ops = set(
+        op.name for op in tf.get_default_graph().get_operations()
+        if op.type in _INPUT_OP_TYPES)
+    self._queue_fills = collections.defaultdict(list)
+    self._samples = []
+    self._num_starved = 0
+    self._stalls = []
+    self._num_steps = 0
+
+  def before_run(self, run_context):
+    self._should_trace = self._num_steps % self._every_n_steps == 0
+    self._num_steps += 1
+    self._start_time = time.time()
+    options = None
+    if self._should_trace:
+      options = tf.RunOptions(trace_level=tf.RunOptions.SOFTWARE_TRACE)
+    return tf.train.SessionRunArgs(
+        {'global_step': self._global_step, 'queue_sizes': self._queue_sizes},
+        options=options)
+
+  def _input_wait_seconds(self, step_stats):
+    """Returns the longest time an input op of the step was blocked."""
+    wait_micros = 0
+    for device_stats in step_stats.dev_stats:
+      for node_stats in device_stats.node_stats:
+        if node_stats.node_name in self._input_ops:
+          wait_micros = max(wait_micros, node_stats.all_end_rel_micros)
+    return wait_micros / 1e6
+
+  def after_run(self, run_context, run_values):
+    step_seconds = time.time() - self._start_time
+    global_step = run_values.results['global_step']
+    values = {}
+    for name, size in run_values.results['queue_sizes'].items():
+      fill = size / float(self._queue_capacities[name])
+      self._queue_fills[name].append(fill)
+      values['input/queue_fill/' + name] = fill
+    if self._should_trace and run_values.run_metadata is not None:
+      wait_seconds = min(
+          self._input_wait_seconds(run_values.run_metadata.step_stats),
+          step_seconds)
+      wait_fraction = wait_seconds / step_seconds if step_seconds else 0.
+      self._samples.append((global_step, step_seconds, wait_seconds))
+      values['input/wait_seconds'] = wait_seconds
+      values['input/compute_seconds'] = step_seconds - wait_seconds
+      values['input/wait_fraction'] = wait_fraction
+      self._update_starvation(global_step, wait_fraction)
+    _write_scalar_summaries(self._summary_writer, values, global_step)
+
+  def _update_starvation(self, global_step, wait_fraction):
+    """Counts consecutive starved samples and logs the stalls."""
+    if wait_fraction < self._wait_threshold:
+      self._num_starved = 0
+      return
+    self._num_starved += 1
+    if self._num_starved == self._stall_window:
+      self._stalls.append({'start_step': int(global_step), 'end_step': None})
+      tf.logging.warning(
+          'The input pipeline is stalling: %d sampled steps in a row waited '
+          'for inputs %.0f%% of the time or more', self._stall_window,
+          100 * self._wait_threshold)
+    if self._num_starved >= self._stall_window:
+      self._stalls[-1]['end_step'] = int(global_step)
+
+  def end(self, session):
+    report = {
+        'num_steps': self._num_steps,
+        'num_sampled_steps': len(self._samples),
+        'wait_threshold': self._wait_threshold,
+        'stalls': self._stalls,
+        'queue_fill': dict(
+            (name, {'mean': float(np.mean(fills)),
+                    'min': float(np.min(fills)),
+                    'empty_fraction': float(np.mean(np.equal(fills, 0.)))})
+            for name, fills in self._queue_fills.items()),
+    }
+    if self._samples:
+      _, step_seconds, wait_seconds = [np.array(x) for x in zip(*self._samples)]
+      wait_fractions = wait_seconds / np.maximum(step_seconds, 1e-9)
+      report.update({
+          'mean_step_seconds': float(step_seconds.mean()),
+          'mean_input_wait_seconds': float(wait_seconds.mean()),
+          'mean_compute_seconds': float((step_seconds - wait_seconds).mean()),
+          'input_wait_fraction': {
+              'mean': float(wait_fractions.mean()),
+              'p50': float(np.percentile(wait_fractions, 50)),
+              'p95': float(np.percentile(wait_fractions, 95)),
+          },
+          'bound': ('input' if wait_fractions.mean() >= self._wait_threshold
+                    else 'compute'),
+      })
+    with tf.gfile.Open(self._report_filename, 'w') as f:
+      f.write(json.dumps(report, indent=2, sort_keys=True))
+    tf.logging.info('Wrote the input pipeline report to %s',
+                    self._report_filename)
+
+
+class ProfilerHook(tf.train.SessionRunHook):
+  """Captures full traces of sampled steps and aggregates their op times.
+
+  A step is traced every `every_n_steps` steps and for the `num_steps` steps
+  from `start_step`, counted from the creation of the session. Every traced
+  step is written as a Chrome trace (open chrome://tracing), and the time of
+  every op over all traced steps is aggregated per op, per op type, per scope
+  (the first `scope_depth` components of the op names) and per fnmatch pattern
+  of `scope_patterns`, e.g. 'InceptionV3/Mixed_6*'. The tables are written as
+  profile.txt and profile.json in `output_dir` when the session ends.
+
+  The ops run by the queue runners or inside tf.data functions, such as the
+  preprocessing, are not part of the step and only show up as the time spent
+  in the dequeue or `IteratorGetNext` ops. The summaries are computed outside
+  the step as well, so `summary_op`, if given, is traced on its own after each
+  traced step; note that this consumes an extra batch.
+  """
+
+  def __init__(self, output_dir, every_n_steps=0, start_step=0, num_steps=0,
+               scope_patterns=None, scope_depth=2, summary_op=None,
+               max_ops=50):
+    """Creates a ProfilerHook.
+
+    Args:
+      output_dir: The directory of the traces and the tables.
+      every_n_steps: If positive, the number of steps between traced steps.
+      start_step: The first step of the traced window.
+      num_steps: The number of steps of the traced window.
+      scope_patterns: A list of fnmatch patterns of op names to aggregate.
+      scope_depth: The number of name components of the aggregated scopes.
+      summary_op: An optional summary op traced after each traced step.
+      max_ops: The number of ops listed in the per-op table.
+    """
+    self._output_dir = output_dir
+    self._every_n_steps = every_n_steps
+    self._start_step = start_step
+    self._num_steps = num_steps
+    self._scope_patterns = list(scope_patterns or [])
+    self._scope_depth = scope_depth
+    self._summary_op = summary_op
+    self._max_ops = max_ops
+
+  def begin(self):
+    tf.gfile.MakeDirs(self._output_dir)
+    self._op_types = dict(
+        (op.name, op.type) for op in tf.get_default_graph().get_operations())
+    self._op_micros = collections.defaultdict(int)
+    self._op_counts = collections.defaultdict(int)
+    self._traced_steps = []
+    self._step = 0
+
+  def _is_traced(self, step):
+    if self._every_n_steps > 0 and step % self._every_n_steps == 0:
+      return True
+    return self._start_step <= step < self._start_step + self._num_steps
+
+  def before_run(self, run_context):
+    self._should_trace = self._is_traced(self._step)
+    self._step += 1
+    if not self._should_trace:
+      return None
+    return tf.train.SessionRunArgs(
+        None, options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE))
+
+  def _record(self, run_metadata, name):
+    """Writes the Chrome trace of a traced run and accumulates its op times."""
+    trace = timeline.Timeline(run_metadata.step_stats)
+    with tf.gfile.Open(os.path.join(self._output_dir, name + '.json'),
+                       'w') as f:
+      f.write(trace.generate_chrome_trace_format())
+    for device_stats in run_metadata.step_stats.dev_stats:
+      # The GPU stream devices repeat the kernels of the GPU device.
+      if 'stream:' in device_stats.device:
+        continue
+      for node_stats in device_stats.node_stats:
+        self._op_micros[node_stats.node_name] += node_stats.all_end_rel_micros
+        self._op_counts[node_stats.node_name] += 1
+
+  def after_run(self, run_context, run_values):
+    if not self._should_trace or run_values.run_metadata is None:
+      return
+    step = self._step - 1
+    self._traced_steps.append(step)
+    self._record(run_values.run_metadata, 'timeline-%d' % step)
+    if self._summary_op is not None:
+      run_metadata = tf.RunMetadata()
+      run_context.session.run(
+          self._summary_op,
+          options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+          run_metadata=run_metadata)
+      self._record(run_metadata, 'timeline-%d-summary' % step)
+
+  def _tables(self):
+    """Returns the aggregated tables, as dicts of name to total micros."""
+    op_types = collections.defaultdict(int)
+    scopes = collections.defaultdict(int)
+    patterns = collections.OrderedDict(
+        (pattern, 0) for pattern in self._scope_patterns)
+    for name, micros in self._op_micros.items():
+      op_types[self._op_types.get(name, 'unknown')] += micros
+      scopes['/'.join(name.split('/')[:self._scope_depth])] += micros
+      for pattern in self._scope_patterns:
+        if fnmatch.fnmatchcase(name, pattern):
+          patterns[pattern] += micros
+    return [('op', self._op_micros), ('op type', op_types),
+            ('scope', scopes), ('pattern', patterns)]
+
+  def end(self, session):
+    if not self._traced_steps:
+      return
+    num_traced_steps = len(self._traced_steps)
+    total_micros = float(sum(self._op_micros.values())) or 1.
+    report = {'traced_steps': self._traced_steps}
+    lines = ['%d traced steps, %.1f ms of op time per step' % (
+        num_traced_steps, total_micros / 1e3 / num_traced_steps)]
+    for title, table in self._tables():
+      rows = sorted(table.items(), key=lambda item: -item[1])
+      if title == 'op':
+        rows = rows[:self._max_ops]
+      elif title == 'pattern':
+        rows = list(table.items())
+      report[title] = [
+          {'name': name,
+           'ms_per_step': micros / 1e3 / num_traced_steps,
+           'percent': 100 * micros / total_micros}
+          for name, micros in rows]
+      if not rows:
+        continue
+      lines.append('')
+      lines.append('%-70s %12s %8s' % (title, 'ms/step', '%'))
+      for row in report[title]:
+        lines.append('%-70s %12.2f %8.1f' % (
+            row['name'][-70:], row['ms_per_step'], row['percent']))
+
+    with tf.gfile.Open(os.path.join(self._output_dir, 'profile.json'),
+                       'w') as f:
+      f.write(json.dumps(report, indent=2))
+    with tf.gfile.Open(os.path.join(self._output_dir, 'profile.txt'),
+                       'w') as f:
+      f.write('\n'.join(lines) + '\n')
+    tf.logging.info('Wrote the op profile of %d steps to %s',
+                    num_traced_steps, self._output_dir)
+
+
+def peak_rss_mb():
+  """Returns the peak resident set size of the process, in MB."""
+  # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  if sys.platform == 'darwin':
+    return peak_rss / float(1 << 20)
+  return peak_rss / float(1 << 10)
+
+
+class RunStatsHook(tf.train.SessionRunHook):
+  """Measures the training throughput and the peak memory of the process.
+
+  The images/s are measured from the end of the first `num_warmup_steps`
+  steps, which include the graph optimizations and the filling of the input
+  queues. They are written as TensorBoard summaries under `run/` every
+  `every_n_steps` steps and, with the peak resident memory, as a JSON report
+  when the training stops.
+  """
+
+  def __init__(self, every_n_steps, images_per_step, report_filename,
+               summary_writer=None, num_warmup_steps=10, config=None):
+    """Creates a RunStatsHook.
+
+    Args:
+      every_n_steps: The number of steps between two summaries.
+      images_per_step: The number of images of every step.
+      report_filename: The path of the JSON report written at the end.
+      summary_writer: An optional `tf.summary.FileWriter` for the summaries.
+      num_warmup_steps: The number of first steps left out of the throughput.
+      config: An optional JSON serializable dict copied to the report, e.g.
+        the batch size and accumulation steps of the run.
+    """
+    self._every_n_steps = every_n_steps
+    self._images_per_step = images_per_step
+    self._report_filename = report_filename
+    self._summary_writer = summary_writer
+    self._num_warmup_steps = num_warmup_steps
+    self._config = config or {}
+
+  def begin(self):
+    self._global_step = tf.train.get_global_step()
+    self._num_steps = 0
+    self._start_time = None
+
+  def before_run(self, run_context):
+    return tf.train.SessionRunArgs(self._global_step)
+
+  def _images_per_sec(self):
+    num_timed_steps = self._num_steps - self._num_warmup_steps
+    if self._start_time is None or num_timed_steps <= 0:
+      return None
+    return (num_timed_steps * self._images_per_step /
+            (time.time() - self._start_time))
+
+  def after_run(self, run_context, run_values):
+    self._num_steps += 1
+    if self._num_steps == self._num_warmup_steps:
+      self._start_time = time.time()
+    images_per_sec = self._images_per_sec()
+    if (images_per_sec is not None and
+        self._num_steps % self._every_n_steps == 0):
+      _write_scalar_summaries(self._summary_writer, {
+          'run/images_per_sec': images_per_sec,
+          'run/peak_rss_mb': peak_rss_mb(),
+      }, run_values.results)
+
+  def end(self, session):
+    report = dict(self._config)
+    report.update({
+        'num_steps': self._num_steps,
+        'images_per_step': self._images_per_step,
+        'images_per_sec': self._images_per_sec(),
+        'peak_rss_mb': peak_rss_mb(),
+    })
+    with tf.gfile.Open(self._report_filename, 'w') as f:
+      f.write(json.dumps(report, indent=2, sort_keys=True))
+    tf.logging.info('Wrote the run statistics to %s', self._report_filename)
+
+
+def classification_metrics(logits, labels):
+  """Returns the accuracy, recall at 5 and macro F1-score of a set of logits.
+
+  Args:
+    logits: A float array of shape [num_samples, num_classes].
+    labels: An int array of shape [num_samples].
+
+  Returns:
+    A dict of the `accuracy`, `recall_5` and `f1_score` floats. The F1-score
+    is averaged over the classes that are either labeled or predicted.
+  """
+  predictions = np.argmax(logits, 1)
+  k = min(5, logits.shape[1])
+  top_k = np.argpartition(-logits, k - 1, axis=1)[:, :k]
+  num_classes = logits.shape[1]
+  true_positives = np.bincount(labels[predictions == labels],
+                               minlength=num_classes)
+  num_predicted = np.bincount(predictions, minlength=num_classes)
+  num_labeled = np.bincount(labels, minlength=num_classes)
+  present = num_predicted + num_labeled > 0
+  f1_scores = (2. * true_positives[present] /
+               (num_predicted[present] + num_labeled[present]))
+  return {
+      'accuracy': float(np.mean(predictions == labels)),
+      'recall_5': float(np.mean(np.any(top_k == labels[:, None], 1))),
+      'f1_score': float(np.mean(f1_scores)),
+  }
+
+
+class InlineEvalHook(tf.train.SessionRunHook):
+  """Evaluates the model being trained every n steps, in the training session.
+
+  The evaluation runs an inference tower sharing the variables of the model
+  over a finite input pipeline, such as the cached subset of
+  `fgvc.get_cached_dataset`. The metrics of every evaluation are logged,
+  written as TensorBoard summaries under `eval/` and appended to a JSON lines
+  file. The checkpoint with the best `metric` so far is kept in `best_dir`
+  with a best.json describing it, and with a positive `patience`, the training
+  stops once `patience` evaluations in a row have not improved it.
+
+  Every evaluation also records the `train_seconds` spent training since the
+  start of the first run of the log file, the evaluations left out, to compare
+  the accuracy reached in the same time by different training schedules.
+  """
+
+  def __init__(self, every_n_steps, iterator_initializer, logits, labels,
+               best_dir, log_filename, metric='accuracy', patience=0,
+               min_delta=0., summary_writer=None):
+    """Creates an InlineEvalHook.
+
+    Args:
+      every_n_steps: The number of global steps between two evaluations.
+      iterator_initializer: The op starting a pass over the evaluation data.
+      logits: The logits of the evaluation tower.
+      labels: The labels of the evaluation batches.
+      best_dir: The directory of the best checkpoint.
+      log_filename: The path of the JSON lines file of the evaluations.
+      metric: The metric to maximize, among the keys returned by
+        `classification_metrics`.
+      patience: The number of evaluations without improvement after which the
+        training stops, or 0 to never stop early.
+      min_delta: The smallest increase of `metric` counted as an improvement.
+      summary_writer: An optional `tf.summary.FileWriter` for the summaries.
+
+    Raises:
+      ValueError: If `metric` is not a known metric.
+    """
+    if metric not in ('accuracy', 'recall_5', 'f1_score'):
+      raise ValueError('Metric [%s] was not recognized' % metric)
+    self._every_n_steps = every_n_steps
+    self._iterator_initializer = iterator_initializer
+    self._logits = logits
+    self._labels = labels
+    self._best_dir = best_dir
+    self._log_filename = log_filename
+    self._metric = metric
+    self._patience = patience
+    self._min_delta = min_delta
+    self._summary_writer = summary_writer
+
+  def begin(self):
+    self._global_step = tf.train.get_global_step()
+    self._saver = tf.train.Saver(max_to_keep=1)
+    self._best_filename = os.path.join(self._best_dir, 'best.json')
+    self._best = None
+    # The best checkpoint of a previous run of the same train_dir still counts.
+    if tf.gfile.Exists(self._best_filename):
+      with tf.gfile.Open(self._best_filename, 'r') as f:
+        self._best = json.loads(f.read())
+    self._num_evals_without_improvement = 0
+    self._last_eval_step = None
+    self._train_seconds = 0.
+    if tf.gfile.Exists(self._log_filename):
+      with tf.gfile.Open(self._log_filename, 'r') as f:
+        lines = f.read().splitlines()
+      if lines:
+        self._train_seconds = json.loads(lines[-1]).get('train_seconds', 0.)
+    self._start_time = None
+
+  def after_create_session(self, session, coord):
+    self._start_time = time.time()
+
+  def before_run(self, run_context):
+    return tf.train.SessionRunArgs(self._global_step)
+
+  def _evaluate(self, session):
+    """Runs one pass over the evaluation data and returns the metrics."""
+    session.run(self._iterator_initializer)
+    all_logits, all_labels = [], []
+    while True:
+      try:
+        logits, labels = session.run([self._logits, self._labels])
+      except tf.errors.OutOfRangeError:
+        break
+      all_logits.append(logits)
+      all_labels.append(labels)
+    metrics = classification_metrics(np.concatenate(all_logits),
+                                     np.concatenate(all_labels))
+    metrics['num_samples'] = sum(len(labels) for labels in all_labels)
+    return metrics
+
+  def after_run(self, run_context, run_values):
+    global_step = int(run_values.results)
+    if (global_step % self._every_n_steps or
+        global_step == self._last_eval_step):
+      return
+    self._last_eval_step = global_step
+    eval_start_time = time.time()
+    self._train_seconds += eval_start_time - self._start_time
+    metrics = self._evaluate(run_context.session)
+    metrics['global_step'] = global_step
+    metrics['train_seconds'] = self._train_seconds
+    self._start_time = time.time()
+    tf.logging.info(
+        'Evaluation at step %d on %d samples (%.1f sec): accuracy = %.4f, '
+        'recall_5 = %.4f, f1_score = %.4f', global_step,
+        metrics['num_samples'], self._start_time - eval_start_time,
+        metrics['accuracy'], metrics['recall_5'], metrics['f1_score'])
+    _write_scalar_summaries(self._summary_writer, dict(
+        ('eval/' + name, metrics[name])
+        for name in ('accuracy', 'recall_5', 'f1_score')), global_step)
+    with tf.gfile.Open(self._log_filename, 'a') as f:
+      f.write(json.dumps(metrics, sort_keys=True) + '\n')
+
+    if (self._best is None or
+        metrics[self._metric] > self._best[self._metric] + self._min_delta):
+      self._num_evals_without_improvement = 0
+      tf.gfile.MakeDirs(self._best_dir)
+      metrics['checkpoint_path'] = self._saver.save(
+          run_context.session, os.path.join(self._best_dir, 'model.ckpt'),
+          global_step=global_step)
+      self._best = metrics
+      with tf.gfile.Open(self._best_filename, 'w') as f:
+        f.write(json.dumps(metrics, indent=2, sort_keys=True))
+      tf.logging.info('New best %s: saved %s', self._metric,
+                      metrics['checkpoint_path'])
+      return
+
+    self._num_evals_without_improvement += 1
+    if 0 < self._patience <= self._num_evals_without_improvement:
+      tf.logging.info(
+          'Stopping early: the %s has not improved on %.4f at step %d in %d '
+          'evaluations', self._metric, self._best[self._metric],
+          self._best['global_step'], self._num_evals_without_improvement)
+      run_context.request_stop()